@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the confirmation model column to the camera table
+"""
+from app import app, db
+from sqlalchemy import inspect, text
+
+with app.app_context():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('camera')]
+    with db.engine.connect() as conn:
+        if 'confirm_model_id' not in columns:
+            conn.execute(text("ALTER TABLE camera ADD COLUMN confirm_model_id INTEGER REFERENCES ai_model (id)"))
+        conn.commit()
+    print("Added confirm_model_id column to camera table")
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the per-class detection filter column to the camera table
+"""
+from app import app, db
+from sqlalchemy import inspect, text
+
+with app.app_context():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('camera')]
+    with db.engine.connect() as conn:
+        if 'detection_classes' not in columns:
+            conn.execute(text("ALTER TABLE camera ADD COLUMN detection_classes TEXT"))
+        conn.commit()
+    print("Added detection_classes column to camera table")
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the inference scheduling columns to the camera table
+"""
+from app import app, db
+from sqlalchemy import inspect, text
+
+with app.app_context():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('camera')]
+    with db.engine.connect() as conn:
+        if 'inference_priority' not in columns:
+            conn.execute(text("ALTER TABLE camera ADD COLUMN inference_priority INTEGER NOT NULL DEFAULT 1"))
+        if 'max_detection_latency' not in columns:
+            conn.execute(text("ALTER TABLE camera ADD COLUMN max_detection_latency REAL"))
+        conn.commit()
+    print("Added inference scheduling columns to camera table")
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the tiled inference columns to the camera table
+"""
+from app import app, db
+from sqlalchemy import inspect, text
+
+with app.app_context():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('camera')]
+    with db.engine.connect() as conn:
+        if 'inference_tiles' not in columns:
+            conn.execute(text("ALTER TABLE camera ADD COLUMN inference_tiles VARCHAR(10)"))
+        if 'tile_motion_only' not in columns:
+            conn.execute(text("ALTER TABLE camera ADD COLUMN tile_motion_only BOOLEAN NOT NULL DEFAULT 0"))
+        conn.commit()
+    print("Added tiled inference columns to camera table")
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the per-camera snapshot encoding columns to the camera table
+"""
+from app import app, db
+from sqlalchemy import inspect, text
+
+with app.app_context():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('camera')]
+    with db.engine.connect() as conn:
+        if 'snapshot_quality' not in columns:
+            conn.execute(text("ALTER TABLE camera ADD COLUMN snapshot_quality INTEGER"))
+        if 'snapshot_max_width' not in columns:
+            conn.execute(text("ALTER TABLE camera ADD COLUMN snapshot_max_width INTEGER"))
+        if 'snapshot_crop' not in columns:
+            conn.execute(text("ALTER TABLE camera ADD COLUMN snapshot_crop BOOLEAN"))
+        conn.commit()
+    print("Added snapshot columns to camera table")
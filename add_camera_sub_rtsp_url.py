@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the substream URL column to the camera table
+"""
+from app import app, db
+from sqlalchemy import inspect, text
+
+with app.app_context():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('camera')]
+    with db.engine.connect() as conn:
+        if 'sub_rtsp_url' not in columns:
+            conn.execute(text("ALTER TABLE camera ADD COLUMN sub_rtsp_url VARCHAR(255)"))
+        conn.commit()
+    print("Added sub_rtsp_url column to camera table")
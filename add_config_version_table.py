@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the config_version table used for cache invalidation
+"""
+from app import app, db
+from app.models.config_version import ConfigVersion
+
+with app.app_context():
+    ConfigVersion.__table__.create(db.engine, checkfirst=True)
+    if not db.session.get(ConfigVersion, 1):
+        db.session.add(ConfigVersion(id=1, version=0))
+        db.session.commit()
+    print("Added config_version table")
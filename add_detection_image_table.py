@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the detection_image table and count the references
+existing detections hold on their snapshot files
+
+Object storage offload used to track images by a detection id cursor in the
+offload state file. Images of detections behind that cursor whose local copy
+is gone were uploaded and evicted; every other image is uploaded again on the
+next offload pass.
+"""
+import os
+import json
+from datetime import datetime
+from app import app, db
+from app.models.detection import Detection
+from app.models.detection_image import DetectionImage
+from app.utils.object_store import STATE_FILE
+
+with app.app_context():
+    DetectionImage.__table__.create(db.engine, checkfirst=True)
+
+    uploaded_id = 0
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, 'r') as f:
+            uploaded_id = json.load(f).get('images_uploaded_id', 0)
+
+    known = {path for (path,) in db.session.query(DetectionImage.path)}
+    counts = db.session.query(
+        Detection.image_path, db.func.min(Detection.camera_id), db.func.count(Detection.id),
+        db.func.min(Detection.timestamp), db.func.max(Detection.timestamp), db.func.min(Detection.id)
+    ).filter(Detection.image_path.isnot(None)).group_by(Detection.image_path).all()
+
+    added = 0
+    evicted = 0
+    for path, camera_id, refs, first, last, first_id in counts:
+        if path in known:
+            continue
+        offloaded = first_id <= uploaded_id and not os.path.exists(path)
+        db.session.add(DetectionImage(camera_id=camera_id, path=path, ref_count=refs,
+                                      created_at=first or datetime.now(), last_used=last or datetime.now(),
+                                      uploaded=offloaded, evicted=offloaded))
+        added += 1
+        evicted += offloaded
+    db.session.commit()
+    print(f"Added detection_image table, registered {added} existing snapshot files ({evicted} offloaded)")
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+"""
+Migration script to add time indexes to the detection table
+"""
+from app import app, db
+from sqlalchemy import text
+
+with app.app_context():
+    with db.engine.connect() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_detection_timestamp ON detection (timestamp)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_detection_camera_timestamp ON detection (camera_id, timestamp)"))
+        conn.commit()
+    print("Added time indexes to detection table")
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the track_id column and its index to the detection table
+"""
+from app import app, db
+from sqlalchemy import inspect, text
+
+with app.app_context():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('detection')]
+    with db.engine.connect() as conn:
+        if 'track_id' not in columns:
+            conn.execute(text("ALTER TABLE detection ADD COLUMN track_id INTEGER"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_detection_camera_track ON detection (camera_id, track_id)"))
+        conn.commit()
+    print("Added track_id column to detection table")
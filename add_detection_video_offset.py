@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the video offset columns to the detection table and the
+file path index used to link detections to their recording segment
+"""
+from app import app, db
+from sqlalchemy import inspect, text
+
+with app.app_context():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('detection')]
+    with db.engine.connect() as conn:
+        if 'video_offset' not in columns:
+            conn.execute(text("ALTER TABLE detection ADD COLUMN video_offset REAL"))
+        if 'frame_offset' not in columns:
+            conn.execute(text("ALTER TABLE detection ADD COLUMN frame_offset INTEGER"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recording_file_path ON recording (file_path)"))
+        conn.commit()
+    print("Added video offset columns to detection table")
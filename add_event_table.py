@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the event table and the detection event_id column,
+then group existing detections into events
+"""
+from app import app, db
+from app.models.event import Event
+from sqlalchemy import inspect, text
+
+with app.app_context():
+    Event.__table__.create(db.engine, checkfirst=True)
+    columns = [column['name'] for column in inspect(db.engine).get_columns('detection')]
+    with db.engine.connect() as conn:
+        if 'event_id' not in columns:
+            conn.execute(text("ALTER TABLE detection ADD COLUMN event_id INTEGER REFERENCES event (id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_detection_event_id ON detection (event_id)"))
+        conn.commit()
+
+    from app.utils.event_store import rebuild_events
+    created = rebuild_events(db.session)
+    db.session.commit()
+    print(f"Added event table, grouped existing detections into {created} events")
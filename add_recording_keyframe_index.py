@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the keyframe_index column used by clip export to the recording table
+"""
+from app import app, db
+from sqlalchemy import inspect, text
+
+with app.app_context():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('recording')]
+    with db.engine.connect() as conn:
+        if 'keyframe_index' not in columns:
+            conn.execute(text("ALTER TABLE recording ADD COLUMN keyframe_index TEXT"))
+        conn.commit()
+    print("Added keyframe_index column to recording table")
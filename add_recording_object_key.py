@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the object_key and evicted columns used by object storage offload to the recording table
+"""
+from app import app, db
+from sqlalchemy import inspect, text
+
+with app.app_context():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('recording')]
+    with db.engine.connect() as conn:
+        if 'object_key' not in columns:
+            conn.execute(text("ALTER TABLE recording ADD COLUMN object_key VARCHAR(255)"))
+        if 'evicted' not in columns:
+            conn.execute(text("ALTER TABLE recording ADD COLUMN evicted BOOLEAN NOT NULL DEFAULT FALSE"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recording_object_key ON recording (object_key)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recording_offload ON recording (evicted, timestamp)"))
+        conn.commit()
+    print("Added object_key and evicted columns to recording table")
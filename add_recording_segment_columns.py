@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the frame_count column and time index to the recording table
+"""
+from app import app, db
+from sqlalchemy import inspect, text
+
+with app.app_context():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('recording')]
+    with db.engine.connect() as conn:
+        if 'frame_count' not in columns:
+            conn.execute(text("ALTER TABLE recording ADD COLUMN frame_count INTEGER DEFAULT 0"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recording_camera_timestamp ON recording (camera_id, timestamp)"))
+        conn.commit()
+    print("Added frame_count column and time index to recording table")
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the sprite_info column for scrub previews to the recording table
+"""
+from app import app, db
+from sqlalchemy import inspect, text
+
+with app.app_context():
+    columns = [column['name'] for column in inspect(db.engine).get_columns('recording')]
+    with db.engine.connect() as conn:
+        if 'sprite_info' not in columns:
+            conn.execute(text("ALTER TABLE recording ADD COLUMN sprite_info TEXT"))
+        conn.commit()
+    print("Added sprite_info column to recording table")
@@ -11,7 +11,9 @@ app.config.from_object('config.Config')
 # Configure max content length for large file uploads (increase to 1GB)
 app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024  # 1GB
 
-# Initialize database
+# Initialize database (engine tuning must be applied before the engine is created)
+from app.utils.database import configure_database
+configure_database(app)
 db = SQLAlchemy(app)
 
 # Initialize login manager
@@ -36,4 +38,5 @@ from app.models import User, Camera, AIModel, Recording, Detection, ROI
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
\ No newline at end of file
+    from app.utils.config_cache import ConfigCache
+    return ConfigCache.get_instance().get_user(int(user_id))
\ No newline at end of file
@@ -6,6 +6,9 @@ from .camera import Camera
 from .ai_model import AIModel
 from .recording import Recording
 from .detection import Detection
+from .detection_image import DetectionImage
+from .event import Event
 from .roi import ROI
+from .config_version import ConfigVersion
 
-__all__ = ['User', 'Camera', 'AIModel', 'Recording', 'Detection', 'ROI']
\ No newline at end of file
+__all__ = ['User', 'Camera', 'AIModel', 'Recording', 'Detection', 'DetectionImage', 'Event', 'ROI', 'ConfigVersion']
\ No newline at end of file
@@ -16,7 +16,7 @@ class AIModel(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
-    cameras = db.relationship('Camera', backref='ai_model', lazy=True)
+    cameras = db.relationship('Camera', backref='ai_model', lazy=True, foreign_keys='Camera.model_id')
     
     def __repr__(self):
         return f'<AIModel {self.name}>'
@@ -1,6 +1,7 @@
 """
 Camera model for IP camera configuration
 """
+import json
 from datetime import datetime
 from app import db
 
@@ -9,6 +10,7 @@ class Camera(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     rtsp_url = db.Column(db.String(255), nullable=False)
+    sub_rtsp_url = db.Column(db.String(255))  # Optional low resolution stream used for detection and live view
     username = db.Column(db.String(100))
     password = db.Column(db.String(100))
     is_active = db.Column(db.Boolean, default=True)
@@ -16,6 +18,16 @@ class Camera(db.Model):
     detection_enabled = db.Column(db.Boolean, default=True)
     model_id = db.Column(db.Integer, db.ForeignKey('ai_model.id'))
     confidence_threshold = db.Column(db.Float, default=0.5)
+    detection_classes = db.Column(db.Text)  # JSON object of allowed class names or ids to their threshold (null for the camera's), empty for all
+    confirm_model_id = db.Column(db.Integer, db.ForeignKey('ai_model.id'))  # Larger model that confirms detections, None for single-model detection
+    inference_tiles = db.Column(db.String(10))  # Tile grid for tiled inference such as '3x2', None for full frames
+    tile_motion_only = db.Column(db.Boolean, default=False)  # Only infer tiles with motion or live tracks
+    inference_priority = db.Column(db.Integer, default=1)  # Share weight (weighted scheduling) or rank (priority scheduling)
+    max_detection_latency = db.Column(db.Float)  # Frames older than this many seconds are not inferred, None for the default
+    # Detection snapshot encoding, None to use the detection settings
+    snapshot_quality = db.Column(db.Integer)  # JPEG quality
+    snapshot_max_width = db.Column(db.Integer)  # Snapshots are downscaled to this width
+    snapshot_crop = db.Column(db.Boolean)  # Store a crop around the object instead of the full frame
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Define relationships
@@ -58,12 +70,22 @@ class Camera(db.Model):
             'id': self.id,
             'name': self.name,
             'url': self.rtsp_url,
+            'sub_url': self.sub_rtsp_url,
             'enabled': self.is_active,
             'recording_enabled': self.recording_enabled,
             'detection_enabled': self.detection_enabled,
             'model_id': self.model_id,
             'ai_model_id': self.model_id,  # Include both for compatibility
             'confidence_threshold': self.confidence_threshold,
+            'detection_classes': json.loads(self.detection_classes) if self.detection_classes else {},
+            'confirm_model_id': self.confirm_model_id,
+            'inference_tiles': self.inference_tiles,
+            'tile_motion_only': self.tile_motion_only,
+            'inference_priority': self.inference_priority,
+            'max_detection_latency': self.max_detection_latency,
+            'snapshot_quality': self.snapshot_quality,
+            'snapshot_max_width': self.snapshot_max_width,
+            'snapshot_crop': self.snapshot_crop,
             'stream_url': f'/api/cameras/{self.id}/stream',
             'snapshot_url': f'/api/cameras/{self.id}/snapshot',
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -0,0 +1,14 @@
+"""
+Configuration version counter for cross-process cache invalidation
+"""
+from datetime import datetime
+from app import db
+
+class ConfigVersion(db.Model):
+    """Single-row counter bumped whenever cameras, ROIs or users change"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ConfigVersion {self.version}>'
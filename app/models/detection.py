@@ -6,11 +6,21 @@ from app import db
 
 class Detection(db.Model):
     """Detection model for object detections in video"""
+    __table_args__ = (
+        # Most queries filter a camera over a time range
+        db.Index('ix_detection_camera_timestamp', 'camera_id', 'timestamp'),
+        # A tracked object's row is updated in place when a better frame is seen
+        db.Index('ix_detection_camera_track', 'camera_id', 'track_id'),
+        db.Index('ix_detection_event_id', 'event_id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     camera_id = db.Column(db.Integer, db.ForeignKey('camera.id'), nullable=False)
     recording_id = db.Column(db.Integer, db.ForeignKey('recording.id'), nullable=True)
     roi_id = db.Column(db.Integer, db.ForeignKey('roi.id'), nullable=True)
-    timestamp = db.Column(db.DateTime, nullable=False)
+    track_id = db.Column(db.BigInteger)  # Tracker id of the object, one row per track
+    event_id = db.Column(db.Integer, db.ForeignKey('event.id'), nullable=True)
+    timestamp = db.Column(db.DateTime, nullable=False, index=True)
     class_name = db.Column(db.String(50), nullable=False)
     confidence = db.Column(db.Float, nullable=False)
     bbox_x = db.Column(db.Float, nullable=False)
@@ -19,6 +29,8 @@ class Detection(db.Model):
     bbox_height = db.Column(db.Float, nullable=False)
     image_path = db.Column(db.String(255))
     video_path = db.Column(db.String(255))
+    video_offset = db.Column(db.Float)  # Seconds into video_path, from the recorder state at detection time
+    frame_offset = db.Column(db.Integer)  # Frame index in video_path when the recorder counts frames
     notified = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -36,11 +48,15 @@ class Detection(db.Model):
             'camera_id': self.camera_id,
             'recording_id': self.recording_id, 
             'roi_id': self.roi_id,
+            'track_id': self.track_id,
+            'event_id': self.event_id,
             'class_name': self.class_name,
             'confidence': self.confidence,
             'bbox': [self.bbox_x, self.bbox_y, self.bbox_width, self.bbox_height],
             'image_path': self.image_path,
             'video_path': self.video_path,
+            'video_offset': self.video_offset,
+            'frame_offset': self.frame_offset,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'notified': self.notified
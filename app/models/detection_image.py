@@ -0,0 +1,27 @@
+"""
+Detection image model for reference counted snapshot files
+"""
+from datetime import datetime
+from app import db
+
+class DetectionImage(db.Model):
+    """A snapshot file in the image store, shared by every detection that references it"""
+    __tablename__ = 'detection_image'
+    __table_args__ = (
+        # The janitor looks for unreferenced images that have not been used for a while
+        db.Index('ix_detection_image_refs_used', 'ref_count', 'last_used'),
+        # The offloader looks for images to upload and uploaded local copies to evict
+        db.Index('ix_detection_image_offload', 'uploaded', 'evicted', 'last_used'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    camera_id = db.Column(db.Integer, db.ForeignKey('camera.id'), nullable=False)
+    path = db.Column(db.String(255), nullable=False, unique=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # Detection rows pointing at path
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    last_used = db.Column(db.DateTime, default=datetime.now)  # Last time a reference was added or dropped
+    uploaded = db.Column(db.Boolean, nullable=False, default=False)  # Copy verified in the object store
+    evicted = db.Column(db.Boolean, nullable=False, default=False)  # Local copy deleted after the upload
+
+    def __repr__(self):
+        return f'<DetectionImage {self.path} refs={self.ref_count}>'
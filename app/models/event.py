@@ -0,0 +1,49 @@
+"""
+Event model for bursts of detections
+"""
+from datetime import datetime
+from app import db
+
+class Event(db.Model):
+    """Detections of one class on one camera, merged while they are less than a gap apart"""
+    __table_args__ = (
+        # Playback and dashboards list a camera's events over a time range
+        db.Index('ix_event_camera_start', 'camera_id', 'start_time'),
+        # Ingest looks up the open event of a class to extend it
+        db.Index('ix_event_camera_class_end', 'camera_id', 'class_name', 'end_time'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    camera_id = db.Column(db.Integer, db.ForeignKey('camera.id'), nullable=False)
+    class_name = db.Column(db.String(50), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    detection_count = db.Column(db.Integer, default=0)  # Detection rows (tracks) in the event
+    peak_confidence = db.Column(db.Float, default=0)
+    best_detection_id = db.Column(db.Integer)  # Detection with the peak confidence, its image is the event snapshot
+    recording_id = db.Column(db.Integer, db.ForeignKey('recording.id'), nullable=True)  # Segment the event starts in
+    video_path = db.Column(db.String(255))
+    video_offset = db.Column(db.Float)  # Seconds into video_path where the event starts
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    camera = db.relationship('Camera', backref=db.backref('events', lazy='dynamic'))
+
+    def __repr__(self):
+        return f'<Event {self.id} {self.class_name} from {self.start_time}>'
+
+    def to_dict(self):
+        """Convert event to dictionary for API"""
+        return {
+            'id': self.id,
+            'camera_id': self.camera_id,
+            'class_name': self.class_name,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'duration': (self.end_time - self.start_time).total_seconds() if self.start_time and self.end_time else 0,
+            'detection_count': self.detection_count,
+            'peak_confidence': self.peak_confidence,
+            'best_detection_id': self.best_detection_id,
+            'image_url': f'/api/detections/{self.best_detection_id}/image' if self.best_detection_id else None,
+            'recording_id': self.recording_id,
+            'video_offset': self.video_offset
+        }
@@ -6,13 +6,29 @@ from app import db
 
 class Recording(db.Model):
     """Recording model for video footage storage"""
+    __table_args__ = (
+        # Playback lists a camera's segments over a time range
+        db.Index('ix_recording_camera_timestamp', 'camera_id', 'timestamp'),
+        # The offloader looks up segments not uploaded yet
+        db.Index('ix_recording_object_key', 'object_key'),
+        # and evicts uploaded local copies oldest-first
+        db.Index('ix_recording_offload', 'evicted', 'timestamp'),
+        # Detections are linked to the segment file they were recorded into
+        db.Index('ix_recording_file_path', 'file_path'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     camera_id = db.Column(db.Integer, db.ForeignKey('camera.id'), nullable=False)
     file_path = db.Column(db.String(255), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Use timestamp instead of start_time
     duration = db.Column(db.Float, default=0)  # Duration in seconds
     file_size = db.Column(db.Integer, default=0)  # File size in bytes (renamed from size_bytes)
+    frame_count = db.Column(db.Integer, default=0)  # Frames in the segment file
     thumbnail_path = db.Column(db.String(255))  # Path to thumbnail image
+    sprite_info = db.Column(db.Text)  # JSON layout of the scrub sprite sheet stored next to the thumbnail
+    keyframe_index = db.Column(db.Text)  # JSON [seconds, byte offset] per keyframe, for clip export
+    object_key = db.Column(db.String(255))  # Key in object storage once uploaded ('' if there was nothing to upload)
+    evicted = db.Column(db.Boolean, nullable=False, default=False)  # Local copy deleted after upload
     recording_type = db.Column(db.String(20), default='continuous')  # Type: continuous, motion, manual, etc.
     is_flagged = db.Column(db.Boolean, default=False)  # User-flagged importance
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -32,10 +48,13 @@ class Recording(db.Model):
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
             'duration': self.duration,
             'file_size': self.file_size,
+            'frame_count': self.frame_count,
             'recording_type': self.recording_type,
             'is_flagged': self.is_flagged,
+            'offloaded': bool(self.object_key),
             'video_url': f'/api/recordings/{self.id}/video',
             'thumbnail_url': f'/api/recordings/{self.id}/thumbnail',
+            'preview_url': f'/api/recordings/{self.id}/preview' if self.sprite_info else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'detection_count': self.detections.count() if self.detections else 0,
         }
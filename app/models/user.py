@@ -10,7 +10,8 @@ from app import db, login_manager
 @login_manager.user_loader
 def load_user(user_id):
     """Load user by id for Flask-Login"""
-    return User.query.get(int(user_id))
+    from app.utils.config_cache import ConfigCache
+    return ConfigCache.get_instance().get_user(int(user_id))
 
 class User(UserMixin, db.Model):
     """User model for authentication"""
@@ -42,8 +43,10 @@ class User(UserMixin, db.Model):
     
     def update_last_login(self):
         """Update last login timestamp"""
+        from app.utils.config_cache import ConfigCache
         self.last_login = datetime.utcnow()
         db.session.commit()
+        ConfigCache.get_instance().invalidate()
     
     def to_dict(self, include_email=False, include_api_key=False):
         """Convert user to dictionary for API"""
@@ -9,6 +9,7 @@ from werkzeug.utils import secure_filename
 from app import db
 from app.models import User, Camera
 from app.models.ai_model import AIModel
+from app.utils.config_cache import ConfigCache
 from app.utils.decorators import admin_required
 
 admin_bp = Blueprint('admin', __name__)
@@ -54,6 +55,7 @@ def create_user():
         
         db.session.add(user)
         db.session.commit()
+        ConfigCache.get_instance().invalidate()
         
         flash('User created successfully.', 'success')
         return redirect(url_for('admin.user_management'))
@@ -90,6 +92,7 @@ def edit_user(user_id):
             user.set_password(password)
         
         db.session.commit()
+        ConfigCache.get_instance().invalidate()
         flash('User updated successfully.', 'success')
         return redirect(url_for('admin.user_management'))
     
@@ -109,6 +112,7 @@ def delete_user(user_id):
     
     db.session.delete(user)
     db.session.commit()
+    ConfigCache.get_instance().invalidate()
     
     flash('User deleted successfully.', 'success')
     return redirect(url_for('admin.user_management'))
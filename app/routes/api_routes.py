@@ -13,8 +13,18 @@ from app import db
 from app.models.camera import Camera
 from app.models.recording import Recording
 from app.models.detection import Detection
+from app.models.event import Event
 from app.models.roi import ROI
+from app.utils.config_cache import ConfigCache
+from app.utils.database import insert_many
 from app.utils.decorators import admin_required, api_key_required
+from app.utils.detection_archive import (archive_horizon, archived_counts, count_archived_detections,
+                                         query_archived_detections)
+from app.utils.event_store import assign_events, set_best_detections, update_track_event
+from app.utils.image_store import acquire_images, release_images
+from app.utils.object_store import ObjectOffloader, ObjectStore
+from app.utils.preview_store import sprite_path_for
+from app.utils.settings import MAX_CLIP_LENGTH, load_settings
 from app.utils.system_monitor import get_system_stats
 
 # Create blueprint
@@ -22,6 +32,108 @@ api_bp = Blueprint('api', __name__, url_prefix='/api')
 
 # --- Camera API Endpoints ---
 
+def store_detections(session, camera_id, detections_data):
+    """
+    Persist a batch of detections from the camera processor
+    
+    Args:
+        session: SQLAlchemy session to write with (the pipeline writer session
+            or db.session)
+        camera_id: ID of the camera the detections belong to
+        detections_data: List of detection dictionaries
+        
+    Returns:
+        tuple: (camera, list of new Detection objects), camera is None if not found
+    """
+    camera = ConfigCache.get_instance().get_camera(camera_id, session)
+    if not camera or not detections_data:
+        return camera, []
+        
+    # Link detections to their segment by the file they were recorded into. Open
+    # segments have no row yet, register_segment links those when they close.
+    video_paths = {det_data['video_path'] for det_data in detections_data if det_data.get('video_path')}
+    recording_ids = {}
+    if video_paths:
+        recording_ids = dict(session.query(Recording.file_path, Recording.id).filter(
+            Recording.file_path.in_(video_paths),
+            Recording.camera_id == camera_id
+        ).all())
+    
+    # Build all rows first, then insert them in one batched statement
+    rows = []
+    for det_data in detections_data:
+        rows.append({
+            'camera_id': camera_id,
+            'recording_id': recording_ids.get(det_data.get('video_path')),
+            'roi_id': det_data.get('roi_id'),
+            'track_id': det_data.get('track_id'),
+            'timestamp': det_data.get('timestamp', datetime.now()) if isinstance(det_data.get('timestamp'), datetime) else datetime.now(),
+            'class_name': det_data.get('class_name', 'unknown'),
+            'confidence': det_data.get('confidence', 0.0),
+            'bbox_x': det_data.get('bbox_x', 0),
+            'bbox_y': det_data.get('bbox_y', 0),
+            'bbox_width': det_data.get('bbox_width', 0),
+            'bbox_height': det_data.get('bbox_height', 0),
+            'image_path': det_data.get('image_path'),
+            'video_path': det_data.get('video_path'),
+            'video_offset': det_data.get('video_offset'),
+            'frame_offset': det_data.get('frame_offset'),
+            'notified': False
+        })
+    
+    # Extend or start the camera's events before the rows are written
+    best_rows = assign_events(session, camera_id, rows)
+    acquire_images(session, camera_id, [row['image_path'] for row in rows])
+    new_detections = insert_many(session, Detection, rows)
+    set_best_detections(best_rows, new_detections)
+    return camera, new_detections
+
+def update_track_detections(session, camera_id, updates):
+    """
+    Replace the box, confidence and snapshot of tracked detections with a better frame
+    and extend their events to the time the objects were last seen
+    
+    The row keeps the time and recording position of the track's first frame. A
+    replaced snapshot is released in the image store.
+    
+    Args:
+        session: SQLAlchemy session to write with
+        camera_id: ID of the camera the tracks belong to
+        updates: List of dictionaries with track_id, optionally last_seen and
+            the new column values
+        
+    Returns:
+        int: Number of rows updated
+    """
+    updated = 0
+    for update in updates:
+        values = {key: value for key, value in update.items() if key not in ('track_id', 'last_seen')}
+        if values:
+            track_rows = session.query(Detection).filter(
+                Detection.camera_id == camera_id,
+                Detection.track_id == update['track_id']
+            )
+            if values.get('image_path'):
+                # Every row moving to the new snapshot takes a reference and drops its old one
+                released = [path for (path,) in track_rows.with_entities(Detection.image_path)
+                            if path != values['image_path']]
+                acquire_images(session, camera_id, [values['image_path']] * len(released))
+                release_images(session, released)
+            updated += track_rows.update(values, synchronize_session=False)
+        update_track_event(session, camera_id, update['track_id'],
+                           last_seen=update.get('last_seen'), confidence=values.get('confidence'))
+    return updated
+
+def notify_detections(camera, detections):
+    """Send notifications for stored detections if configured"""
+    from app.utils.notifications import send_detection_email
+    
+    for detection in detections:
+        try:
+            send_detection_email(camera, detection)
+        except Exception as e:
+            print(f"Error sending notification: {str(e)}")
+
 # Function to handle detection reports from camera processor
 def report_detection(request):
     """
@@ -38,7 +150,7 @@ def report_detection(request):
             }), 400
             
         camera_id = data['camera_id']
-        camera = Camera.query.get(camera_id)
+        camera, new_detections = store_detections(db.session, camera_id, data['detections'])
         
         if not camera:
             return jsonify({
@@ -46,65 +158,18 @@ def report_detection(request):
                 'message': f'Camera not found: {camera_id}'
             }), 404
             
-        detections_data = data['detections']
-        
-        if not detections_data:
+        if not new_detections:
             # No detections to process
             return jsonify({
                 'success': True,
                 'message': 'No detections to process'
             })
-            
-        # Get or create recording based on timestamp of first detection
-        recording = None
-        detection_timestamp = None
-        
-        if detections_data and 'timestamp' in detections_data[0]:
-            detection_timestamp = detections_data[0]['timestamp']
-            if isinstance(detection_timestamp, str):
-                detection_timestamp = datetime.fromisoformat(detection_timestamp)
-                
-            # Look for existing recording in the last minute
-            recent_recording = Recording.query.filter(
-                Recording.camera_id == camera_id,
-                Recording.timestamp >= detection_timestamp - timedelta(minutes=1)
-            ).order_by(Recording.timestamp.desc()).first()
-            
-            recording = recent_recording
-        
-        # Process each detection
-        new_detections = []
-        for det_data in detections_data:
-            # Create detection object
-            detection = Detection(
-                camera_id=camera_id,
-                recording_id=recording.id if recording else None,
-                roi_id=det_data.get('roi_id'),
-                timestamp=det_data.get('timestamp', datetime.now()) if isinstance(det_data.get('timestamp'), datetime) else datetime.now(),
-                class_name=det_data.get('class_name', 'unknown'),
-                confidence=det_data.get('confidence', 0.0),
-                bbox_x=det_data.get('bbox_x', 0),
-                bbox_y=det_data.get('bbox_y', 0),
-                bbox_width=det_data.get('bbox_width', 0),
-                bbox_height=det_data.get('bbox_height', 0),
-                image_path=det_data.get('image_path'),
-                video_path=det_data.get('video_path'),
-                notified=False
-            )
-            
-            db.session.add(detection)
-            new_detections.append(detection)
         
         db.session.commit()
         
         # Send notifications for new detections if configured
         # We do this after commit to ensure IDs are available
-        for detection in new_detections:
-            try:
-                from app.utils.notifications import send_detection_email
-                send_detection_email(camera, detection)
-            except Exception as e:
-                print(f"Error sending notification: {str(e)}")
+        notify_detections(camera, new_detections)
         
         return jsonify({
             'success': True,
@@ -132,7 +197,7 @@ def get_cameras():
 @login_required
 def get_camera(camera_id):
     """Get camera details"""
-    camera = Camera.query.get_or_404(camera_id)
+    camera = ConfigCache.get_instance().get_camera_or_404(camera_id)
     return jsonify({
         'success': True,
         'camera': camera.to_dict()
@@ -145,7 +210,7 @@ def get_camera_frame(camera_id):
     from app.utils.camera_processor import CameraManager
     import cv2
     
-    camera = Camera.query.get_or_404(camera_id)
+    camera = ConfigCache.get_instance().get_camera_or_404(camera_id)
     
     # Get camera processor or start it if not running
     manager = CameraManager.get_instance()
@@ -190,7 +255,7 @@ def get_camera_stream(camera_id):
     from app.utils.camera_processor import CameraManager
     import cv2
     
-    camera = Camera.query.get_or_404(camera_id)
+    camera = ConfigCache.get_instance().get_camera_or_404(camera_id)
     
     # Get camera processor or start it if not running
     manager = CameraManager.get_instance()
@@ -246,14 +311,23 @@ def get_camera_snapshot(camera_id):
 @login_required
 def get_camera_roi(camera_id):
     """Get camera regions of interest"""
-    camera = Camera.query.get_or_404(camera_id)
-    rois = ROI.query.filter_by(camera_id=camera.id).all()
+    cache = ConfigCache.get_instance()
+    camera = cache.get_camera_or_404(camera_id)
+    rois = cache.get_rois(camera.id)
     
     return jsonify({
         'success': True,
         'roi': [roi.to_dict() for roi in rois]
     })
 
+def reload_camera_rois(camera_id):
+    """Push changed ROIs to a running camera processor without restarting its stream"""
+    try:
+        from app.utils.camera_processor import CameraManager
+        CameraManager.get_instance().reconfigure_camera(camera_id)
+    except Exception as e:
+        print(f"Error reloading ROIs for camera {camera_id}: {str(e)}")
+
 @api_bp.route('/cameras/<int:camera_id>/roi', methods=['POST'])
 @login_required
 def create_camera_roi(camera_id):
@@ -284,6 +358,8 @@ def create_camera_roi(camera_id):
     
     db.session.add(roi)
     db.session.commit()
+    ConfigCache.get_instance().invalidate()
+    reload_camera_rois(camera.id)
     
     return jsonify({
         'success': True,
@@ -314,6 +390,8 @@ def update_camera_roi(camera_id, roi_id):
         roi.is_active = data['is_active']
     
     db.session.commit()
+    ConfigCache.get_instance().invalidate()
+    reload_camera_rois(camera_id)
     
     return jsonify({
         'success': True,
@@ -328,6 +406,8 @@ def delete_camera_roi(camera_id, roi_id):
     
     db.session.delete(roi)
     db.session.commit()
+    ConfigCache.get_instance().invalidate()
+    reload_camera_rois(camera_id)
     
     return jsonify({
         'success': True,
@@ -339,7 +419,7 @@ def delete_camera_roi(camera_id, roi_id):
 def get_latest_camera_detections(camera_id):
     """Get latest detections for a specific camera"""
     # Verify camera exists
-    camera = Camera.query.get_or_404(camera_id)
+    camera = ConfigCache.get_instance().get_camera_or_404(camera_id)
     
     try:
         # Get real-time detections directly from camera processor
@@ -351,7 +431,13 @@ def get_latest_camera_detections(camera_id):
             # If processor has real-time detections, use those
             detections = processor.get_latest_detections()
             if detections:
-                return jsonify(detections)
+                # Live boxes are in pixels of the decoded stream (the substream if set), as is the live view
+                return jsonify([dict(det, coordinates={
+                    'x_min': float(det['bbox_x']),
+                    'y_min': float(det['bbox_y']),
+                    'x_max': float(det['bbox_x'] + det['bbox_width']),
+                    'y_max': float(det['bbox_y'] + det['bbox_height'])
+                }) for det in detections])
     except Exception as e:
         print(f"Error getting real-time detections: {str(e)}")
     
@@ -404,7 +490,7 @@ def get_latest_camera_detections(camera_id):
 def get_camera_recordings(camera_id):
     """Get recordings for a specific camera with filters"""
     # Verify camera exists
-    camera = Camera.query.get_or_404(camera_id)
+    camera = ConfigCache.get_instance().get_camera_or_404(camera_id)
     
     # Get query parameters
     date = request.args.get('date')  # Format: YYYY-MM-DD
@@ -427,20 +513,13 @@ def get_camera_recordings(camera_id):
                 'message': 'Invalid date format. Use YYYY-MM-DD'
             }), 400
     
-    # Filter by recording type (events only)
-    if events_only:
-        # Join with detections to find recordings with events
-        detections_subquery = db.session.query(Detection.recording_id).distinct().subquery()
-        query = query.filter(Recording.id.in_(detections_subquery))
-    
-    # Filter by object type
+    # Events of the same period, one row per burst of detections
+    event_query = Event.query.filter(Event.camera_id == camera_id)
+    if date:
+        event_query = event_query.filter(Event.end_time >= date_obj, Event.start_time < next_day)
     if object_type:
-        # Join with detections to filter by object type
-        recording_ids = db.session.query(Detection.recording_id).filter(
-            Detection.class_name == object_type
-        ).distinct().all()
-        recording_ids = [r[0] for r in recording_ids]
-        query = query.filter(Recording.id.in_(recording_ids))
+        event_query = event_query.filter(Event.class_name == object_type)
+    events = event_query.order_by(Event.start_time.desc()).all()
     
     # Order by timestamp
     query = query.order_by(Recording.timestamp.desc())
@@ -448,19 +527,16 @@ def get_camera_recordings(camera_id):
     # Execute query
     recordings = query.all()
     
+    # Filter by events (and their object type): keep segments overlapping an event
+    if events_only or object_type:
+        spans = [(event.start_time, event.end_time) for event in events]
+        recordings = [rec for rec in recordings if any(
+            start <= rec.timestamp + timedelta(seconds=rec.duration or 0) and end >= rec.timestamp
+            for start, end in spans)]
+    
     # Format results
     results = []
     for rec in recordings:
-        # Get detections for this recording if any
-        detections = []
-        for det in rec.detections:
-            detections.append({
-                'id': det.id,
-                'class_name': det.class_name,
-                'confidence': det.confidence,
-                'timestamp': det.timestamp.isoformat() if det.timestamp else None
-            })
-            
         results.append({
             'id': rec.id,
             'timestamp': rec.timestamp.isoformat() if rec.timestamp else None,
@@ -470,12 +546,94 @@ def get_camera_recordings(camera_id):
             'recording_type': rec.recording_type,
             'is_flagged': rec.is_flagged,
             'file_size': rec.file_size,
+            'frame_count': rec.frame_count,
             'video_url': f'/api/recordings/{rec.id}/video',
             'thumbnail_url': f'/api/recordings/{rec.id}/thumbnail',
-            'detections': detections
+            'preview': dict(json.loads(rec.sprite_info), sprite_url=f'/api/recordings/{rec.id}/sprite')
+                       if rec.sprite_info else None
         })
     
-    return jsonify(results)
+    return jsonify({
+        'success': True,
+        'recordings': results,
+        'events': [event.to_dict() for event in events]
+    })
+
+@api_bp.route('/cameras/<int:camera_id>/export')
+@login_required
+def export_camera_clip(camera_id):
+    """Export a time range of a camera as one MP4 without re-encoding
+    
+    Query parameters start and end are ISO timestamps. The clip starts on the
+    keyframe at or before start (reported in the X-Clip-Start header) and is
+    streamed while ffmpeg produces it.
+    """
+    from flask import current_app
+    from app.utils.clip_export import ExportError, plan_export, stream_export
+    
+    camera = ConfigCache.get_instance().get_camera_or_404(camera_id)
+    
+    try:
+        start = datetime.fromisoformat(request.args.get('start', ''))
+        end = datetime.fromisoformat(request.args.get('end', ''))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'start and end must be ISO timestamps'
+        }), 400
+    
+    max_seconds = current_app.config.get('EXPORT_MAX_SECONDS', 3600)
+    if end <= start or (end - start).total_seconds() > max_seconds:
+        return jsonify({
+            'success': False,
+            'message': f'end must be after start and the clip at most {max_seconds} seconds long'
+        }), 400
+    
+    # Segments are at most MAX_CLIP_LENGTH long, event files add their pre-roll and
+    # segments end on a keyframe, so the time index bounds the lookup
+    pre_seconds = int(load_settings()['recording'].get('pre_event_seconds', 10))
+    lookback = timedelta(seconds=MAX_CLIP_LENGTH + max(0, pre_seconds) + 60)
+    recordings = Recording.query.filter(
+        Recording.camera_id == camera_id,
+        Recording.timestamp >= start - lookback,
+        Recording.timestamp < end
+    ).order_by(Recording.timestamp.asc()).all()
+    
+    store = ObjectStore.get_instance()
+    segments = []
+    for recording in recordings:
+        if recording.end_time and recording.end_time <= start:
+            continue
+        file_path = recording_file_path(recording)
+        if not file_path and recording.object_key and store.enabled():
+            file_path = store.fetch(recording.object_key)
+        if file_path:
+            segments.append((recording, file_path))
+    
+    ffmpeg_path = current_app.config.get('FFMPEG_PATH', 'ffmpeg')
+    parts, clip_start = plan_export(segments, start, end, ffmpeg_path)
+    if not parts:
+        abort(404, description="No recordings in the requested time range")
+    
+    # ffmpeg has produced the start of the clip before the status is sent
+    try:
+        clip = stream_export(parts, ffmpeg_path)
+    except ExportError as e:
+        print(f"Error exporting clip for camera {camera_id}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'Clip export failed'
+        }), 500
+    
+    filename = f"{camera.name}-{clip_start.strftime('%Y%m%d-%H%M%S')}.mp4"
+    return Response(
+        clip,
+        mimetype='video/mp4',
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Clip-Start': clip_start.isoformat()
+        }
+    )
 
 # --- Recordings API Endpoints ---
 
@@ -558,17 +716,36 @@ def get_recording(recording_id):
         'recording': recording.to_dict()
     })
 
+def recording_file_path(recording):
+    """Get the recording's file path, following a move to another storage tier
+    
+    The tier mover may switch file_path after this request loaded the row, so
+    a missing file is looked up once more before giving up.
+    """
+    if os.path.exists(recording.file_path):
+        return recording.file_path
+    
+    db.session.refresh(recording)
+    if os.path.exists(recording.file_path):
+        return recording.file_path
+    return None
+
 @api_bp.route('/recordings/<int:recording_id>/video')
 @login_required
 def get_recording_video(recording_id):
     """Stream recording video"""
     recording = Recording.query.get_or_404(recording_id)
     
-    if not os.path.exists(recording.file_path):
+    file_path = recording_file_path(recording)
+    if not file_path:
+        # Local copy evicted, serve the offloaded segment
+        store = ObjectStore.get_instance()
+        if recording.object_key and store.enabled():
+            return store.send(recording.object_key, mimetype='video/mp4')
         abort(404, description="Recording file not found")
     
     # Stream the video file
-    return send_file(recording.file_path, conditional=True)
+    return send_file(file_path, conditional=True)
 
 @api_bp.route('/recordings/<int:recording_id>/thumbnail')
 @login_required
@@ -582,13 +759,49 @@ def get_recording_thumbnail(recording_id):
     # Return default thumbnail if none exists
     return send_file('static/img/no-thumbnail.png', mimetype='image/jpeg')
 
+@api_bp.route('/recordings/<int:recording_id>/preview')
+@login_required
+def get_recording_preview(recording_id):
+    """Get the scrub sprite layout of a recording
+    
+    Tile i of the sprite covers the segment from offsets[i] seconds and sits at
+    column i % columns, row i // columns.
+    """
+    recording = Recording.query.get_or_404(recording_id)
+    
+    if not recording.sprite_info:
+        abort(404, description="Recording has no preview")
+    
+    layout = json.loads(recording.sprite_info)
+    layout['sprite_url'] = f'/api/recordings/{recording.id}/sprite'
+    
+    return jsonify({
+        'success': True,
+        'preview': layout
+    })
+
+@api_bp.route('/recordings/<int:recording_id>/sprite')
+@login_required
+def get_recording_sprite(recording_id):
+    """Get the scrub sprite sheet of a recording"""
+    recording = Recording.query.get_or_404(recording_id)
+    
+    sprite_path = sprite_path_for(recording.thumbnail_path) if recording.thumbnail_path else None
+    if not sprite_path or not os.path.exists(sprite_path):
+        abort(404, description="Recording has no preview")
+    
+    # Sprites never change once written
+    return send_file(sprite_path, mimetype='image/jpeg', max_age=86400)
+
 @api_bp.route('/recordings/<int:recording_id>/download')
 @login_required
 def download_recording(recording_id):
     """Download recording file"""
     recording = Recording.query.get_or_404(recording_id)
     
-    if not os.path.exists(recording.file_path):
+    file_path = recording_file_path(recording)
+    store = ObjectStore.get_instance()
+    if not file_path and not (recording.object_key and store.enabled()):
         abort(404, description="Recording file not found")
     
     # Generate a download filename based on camera name and timestamp
@@ -597,8 +810,11 @@ def download_recording(recording_id):
     timestamp = recording.timestamp.strftime('%Y%m%d-%H%M%S')
     filename = f"{camera_name}-{timestamp}.mp4"
     
+    if not file_path:
+        return store.send(recording.object_key, mimetype='video/mp4', download_name=filename)
+    
     return send_file(
-        recording.file_path,
+        file_path,
         as_attachment=True,
         download_name=filename,
         mimetype='video/mp4'
@@ -640,12 +856,25 @@ def delete_recording(recording_id):
     if recording.file_path and os.path.exists(recording.file_path):
         os.remove(recording.file_path)
     
-    # Delete thumbnail if it exists
-    if recording.thumbnail_path and os.path.exists(recording.thumbnail_path):
-        os.remove(recording.thumbnail_path)
-    
-    # Delete from database
-    db.session.delete(recording)
+    # Delete thumbnail and scrub sprite if they exist
+    if recording.thumbnail_path:
+        for preview_path in (recording.thumbnail_path, sprite_path_for(recording.thumbnail_path)):
+            if os.path.exists(preview_path):
+                os.remove(preview_path)
+    
+    # Delete the offloaded copy
+    store = ObjectStore.get_instance()
+    if recording.object_key and store.enabled():
+        store.delete_keys([recording.object_key])
+    
+    # Delete from database. Detections and events are kept without the recording, as
+    # the storage janitor does, so events keep their best detection and snapshot
+    # references stay with their rows until the detections are purged.
+    Detection.query.filter_by(recording_id=recording.id).update(
+        {Detection.recording_id: None}, synchronize_session=False)
+    Event.query.filter_by(recording_id=recording.id).update(
+        {Event.recording_id: None}, synchronize_session=False)
+    Recording.query.filter_by(id=recording.id).delete(synchronize_session=False)
     db.session.commit()
     
     return jsonify({
@@ -669,10 +898,8 @@ def get_detections():
     query = Detection.query
     
     if camera_id:
-        # Need to join with recordings to filter by camera
-        recordings = Recording.query.filter_by(camera_id=camera_id).all()
-        recording_ids = [r.id for r in recordings]
-        query = query.filter(Detection.recording_id.in_(recording_ids))
+        # Detections carry their camera, also once their recording has been deleted
+        query = query.filter(Detection.camera_id == camera_id)
     
     if class_name:
         query = query.filter_by(class_name=class_name)
@@ -703,15 +930,31 @@ def get_detections():
     
     pagination = query.order_by(Detection.timestamp.desc()).paginate(
         page=page, per_page=per_page, error_out=False)
+    detections = [detection.to_dict() for detection in pagination.items]
+    total = pagination.total
+    
+    # Archived partitions are older than every database row, so they follow the
+    # database results and are only opened when the requested range reaches them
+    horizon = archive_horizon()
+    if horizon and (not date_from or date_from < horizon):
+        archive_end = min(date_to, horizon) if date_to else horizon
+        archived_total = count_archived_detections(date_from or None, archive_end, camera_id, class_name)
+        total += archived_total
+        
+        offset = (page - 1) * per_page
+        if archived_total and offset + per_page > pagination.total:
+            archive_offset = max(0, offset - pagination.total)
+            detections += query_archived_detections(date_from or None, archive_end, camera_id, class_name,
+                                                    offset=archive_offset, limit=per_page - len(detections))
     
     return jsonify({
         'success': True,
-        'detections': [detection.to_dict() for detection in pagination.items],
+        'detections': detections,
         'pagination': {
-            'total': pagination.total,
-            'pages': pagination.pages,
-            'page': pagination.page,
-            'per_page': pagination.per_page
+            'total': total,
+            'pages': (total + per_page - 1) // per_page if per_page else 0,
+            'page': page,
+            'per_page': per_page
         }
     })
 
@@ -739,9 +982,7 @@ def get_detection_summary():
         Camera.name,
         db.func.count(Detection.id)
     ).join(
-        Recording, Camera.id == Recording.camera_id
-    ).join(
-        Detection, Recording.id == Detection.recording_id
+        Detection, Camera.id == Detection.camera_id
     ).filter(
         Detection.timestamp >= start_date
     ).group_by(
@@ -752,11 +993,21 @@ def get_detection_summary():
     class_summary = {name: count for name, count in class_counts}
     camera_summary = {name: count for id, name, count in camera_counts}
     
+    # Add archived partitions covered by the time range
+    horizon = archive_horizon()
+    if horizon and start_date < horizon:
+        camera_names = {id: name for id, name in db.session.query(Camera.id, Camera.name).all()}
+        for (camera_id, class_name), count in archived_counts(start=start_date, end=horizon).items():
+            class_summary[class_name] = class_summary.get(class_name, 0) + count
+            camera_name = camera_names.get(camera_id)
+            if camera_name:
+                camera_summary[camera_name] = camera_summary.get(camera_name, 0) + count
+    
     return jsonify({
         'success': True,
         'class_summary': class_summary,
         'camera_summary': camera_summary,
-        'total': sum(count for _, count in class_counts),
+        'total': sum(class_summary.values()),
         'time_range': {
             'days': days,
             'start_date': start_date.strftime('%Y-%m-%d')
@@ -774,6 +1025,64 @@ def get_detection(detection_id):
         'detection': detection.to_dict()
     })
 
+def seek_response(camera_id, timestamp, recording=None, video_offset=None, frame_offset=None, **ids):
+    """
+    Build the response pointing playback at a moment of a camera's recordings
+    
+    Args:
+        camera_id: Camera ID
+        timestamp: Wall clock time of the moment
+        recording: Recording linked at ingest, looked up by time if None
+        video_offset: Seconds into the linked recording, recorded at ingest
+        frame_offset: Frame index in the linked recording
+        ids: Extra fields identifying the resolved item
+    """
+    linked = recording is not None
+    if recording is None:
+        # Stored before segments were linked, take the segment covering the time
+        recording = Recording.query.filter(
+            Recording.camera_id == camera_id,
+            Recording.timestamp <= timestamp
+        ).order_by(Recording.timestamp.desc()).first()
+        if recording and recording.timestamp + timedelta(seconds=recording.duration or 0) < timestamp:
+            recording = None
+    
+    if recording is None:
+        # The segment is still being written or was deleted
+        return jsonify({
+            'success': False,
+            'message': 'No recording available for this time'
+        }), 404
+    
+    if linked and video_offset is not None:
+        seek_seconds = video_offset
+    else:
+        seek_seconds = (timestamp - recording.timestamp).total_seconds()
+    seek_seconds = min(max(0.0, seek_seconds), recording.duration or 0.0)
+    
+    return jsonify(dict(ids, **{
+        'success': True,
+        'recording_id': recording.id,
+        'video_url': f'/api/recordings/{recording.id}/video',
+        'seek_seconds': round(seek_seconds, 3),
+        'frame_offset': frame_offset if linked else None,
+        'recording': recording.to_dict()
+    }))
+
+@api_bp.route('/detections/<int:detection_id>/seek')
+@login_required
+def seek_detection(detection_id):
+    """Resolve a detection to its recording segment and the offset to seek to"""
+    row = db.session.query(Detection, Recording).outerjoin(
+        Recording, Recording.id == Detection.recording_id
+    ).filter(Detection.id == detection_id).first()
+    if not row:
+        abort(404, description="Detection not found")
+    detection, recording = row
+    
+    return seek_response(detection.camera_id, detection.timestamp, recording,
+                         detection.video_offset, detection.frame_offset, detection_id=detection.id)
+
 @api_bp.route('/detections/<int:detection_id>/image')
 @login_required
 def get_detection_image(detection_id):
@@ -783,9 +1092,142 @@ def get_detection_image(detection_id):
     if detection.image_path and os.path.exists(detection.image_path):
         return send_file(detection.image_path, mimetype='image/jpeg')
     
+    # Local copy evicted, serve the offloaded image
+    offloader = ObjectOffloader.get_instance()
+    if detection.image_path and offloader.enabled() and offloader.image_uploaded(detection.image_path):
+        return offloader.store.send(offloader.store.key_for(detection.image_path), mimetype='image/jpeg')
+    
     # Return default image if none exists
     return send_file('static/img/no-detection.png', mimetype='image/jpeg')
 
+# --- Event API Endpoints ---
+
+def parse_time_range():
+    """Read the date or start/end query parameters shared by the event endpoints
+    
+    Returns:
+        tuple: (start, end) datetimes or None, raises ValueError on bad input
+    """
+    date = request.args.get('date')  # Format: YYYY-MM-DD
+    if date:
+        start = datetime.strptime(date, '%Y-%m-%d')
+        return start, start + timedelta(days=1)
+    
+    start = request.args.get('start')
+    end = request.args.get('end')
+    return (datetime.fromisoformat(start) if start else None,
+            datetime.fromisoformat(end) if end else None)
+
+@api_bp.route('/events')
+@login_required
+def get_events():
+    """Get events with filters, newest first"""
+    camera_id = request.args.get('camera_id', type=int)
+    class_name = request.args.get('class_name')
+    
+    try:
+        start, end = parse_time_range()
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid date format. Use date=YYYY-MM-DD or ISO start/end'
+        }), 400
+    
+    query = Event.query
+    if camera_id:
+        query = query.filter(Event.camera_id == camera_id)
+    if class_name:
+        query = query.filter(Event.class_name == class_name)
+    if start:
+        # Events overlapping the range, not only those starting in it
+        query = query.filter(Event.end_time >= start)
+    if end:
+        query = query.filter(Event.start_time < end)
+    
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 50, type=int)
+    pagination = query.order_by(Event.start_time.desc()).paginate(
+        page=page, per_page=per_page, error_out=False)
+    
+    return jsonify({
+        'success': True,
+        'events': [event.to_dict() for event in pagination.items],
+        'pagination': {
+            'total': pagination.total,
+            'pages': pagination.pages,
+            'page': page,
+            'per_page': per_page
+        }
+    })
+
+@api_bp.route('/events/summary')
+@login_required
+def get_event_summary():
+    """Get event counts by class and camera for dashboards"""
+    days = request.args.get('days', 7, type=int)
+    start_date = datetime.now() - timedelta(days=days)
+    
+    class_counts = db.session.query(
+        Event.class_name,
+        db.func.count(Event.id),
+        db.func.sum(Event.detection_count)
+    ).filter(
+        Event.start_time >= start_date
+    ).group_by(
+        Event.class_name
+    ).all()
+    
+    camera_counts = db.session.query(
+        Camera.name,
+        db.func.count(Event.id)
+    ).join(
+        Event, Camera.id == Event.camera_id
+    ).filter(
+        Event.start_time >= start_date
+    ).group_by(
+        Camera.id
+    ).all()
+    
+    class_summary = {name: count for name, count, _ in class_counts}
+    
+    return jsonify({
+        'success': True,
+        'class_summary': class_summary,
+        'camera_summary': {name: count for name, count in camera_counts},
+        'detection_summary': {name: detections or 0 for name, _, detections in class_counts},
+        'total': sum(class_summary.values()),
+        'time_range': {
+            'days': days,
+            'start_date': start_date.strftime('%Y-%m-%d')
+        }
+    })
+
+@api_bp.route('/events/<int:event_id>')
+@login_required
+def get_event(event_id):
+    """Get event details with its detections"""
+    event = Event.query.get_or_404(event_id)
+    detections = Detection.query.filter_by(event_id=event.id).order_by(Detection.timestamp.asc()).all()
+    
+    return jsonify({
+        'success': True,
+        'event': event.to_dict(),
+        'detections': [detection.to_dict() for detection in detections]
+    })
+
+@api_bp.route('/events/<int:event_id>/seek')
+@login_required
+def seek_event(event_id):
+    """Resolve an event to the recording segment and offset it starts at"""
+    row = db.session.query(Event, Recording).outerjoin(
+        Recording, Recording.id == Event.recording_id
+    ).filter(Event.id == event_id).first()
+    if not row:
+        abort(404, description="Event not found")
+    event, recording = row
+    
+    return seek_response(event.camera_id, event.start_time, recording, event.video_offset, event_id=event.id)
+
 # --- System API Endpoints ---
 
 @api_bp.route('/system/stats')
@@ -825,10 +1267,66 @@ def get_storage():
             'size': size or 0
         })
     
+    from app.utils.storage_janitor import StorageJanitor
+    from app.utils.storage_tiers import TierMover
+    
     return jsonify({
         'success': True,
         'total_size': total_size,
-        'camera_storage': camera_storage
+        'camera_storage': camera_storage,
+        'janitor': StorageJanitor.get_instance().get_stats(),
+        'tier_mover': TierMover.get_instance().get_stats(),
+        'object_store': ObjectOffloader.get_instance().get_stats()
+    })
+
+@api_bp.route('/system/cache')
+@login_required
+def get_cache_stats():
+    """Get config cache hit rates and database writer statistics"""
+    from app.utils.database import DatabaseWriter
+    
+    return jsonify({
+        'success': True,
+        'config_cache': ConfigCache.get_instance().get_stats(),
+        'database_writer': DatabaseWriter.get_instance().get_stats()
+    })
+
+@api_bp.route('/system/recording')
+@login_required
+def get_recording_stats():
+    """Get recording engine status and CPU cost per running camera"""
+    from app.utils.camera_processor import CameraManager
+    
+    manager = CameraManager.get_instance()
+    recorders = [processor.get_recording_stats() for processor in list(manager.cameras.values())]
+    
+    return jsonify({
+        'success': True,
+        'recorders': recorders
+    })
+
+@api_bp.route('/system/detection')
+@login_required
+def get_detection_stats():
+    """Get object tracking state and persisted detection output per running camera"""
+    from app.utils.camera_processor import CameraManager
+    from app.utils.image_store import ImageStore
+    from app.utils.inference_scheduler import InferenceScheduler
+    from app.utils.model_cascade import ConfirmationQueue
+    from app.utils.notifications import DetectionNotifier
+    from app.utils.snapshot_writer import SnapshotWriter
+    
+    manager = CameraManager.get_instance()
+    cameras = [processor.get_detection_stats() for processor in list(manager.cameras.values())]
+    
+    return jsonify({
+        'success': True,
+        'cameras': cameras,
+        'snapshots': SnapshotWriter.get_instance().get_stats(),
+        'images': ImageStore.get_instance().get_stats(),
+        'confirmation': ConfirmationQueue.get_instance().get_stats(),
+        'scheduler': InferenceScheduler.get_instance().get_stats(),
+        'notifications': DetectionNotifier.get_instance().get_stats()
     })
 
 @api_bp.route('/system/info')
@@ -1000,25 +1498,17 @@ def hook_detection():
             'message': 'Invalid timestamp format'
         }), 400
     
-    # Find or create recording
-    recording = None
-    
-    # TODO: Find existing recording or create a new one based on the timestamp
-    # This is a placeholder implementation
-    
-    # Create detection
-    detection = Detection(
-        recording_id=recording.id if recording else None,
-        timestamp=timestamp,
-        class_name=data['class_name'],
-        confidence=float(data['confidence']),
-        bbox_x=data['bbox'][0],
-        bbox_y=data['bbox'][1],
-        bbox_width=data['bbox'][2],
-        bbox_height=data['bbox'][3],
-    )
-    
-    db.session.add(detection)
+    # Store like the camera processor's detections so the camera's events are extended
+    _, new_detections = store_detections(db.session, camera.id, [{
+        'timestamp': timestamp,
+        'class_name': data['class_name'],
+        'confidence': float(data['confidence']),
+        'bbox_x': data['bbox'][0],
+        'bbox_y': data['bbox'][1],
+        'bbox_width': data['bbox'][2],
+        'bbox_height': data['bbox'][3]
+    }])
+    detection = new_detections[0]
     db.session.commit()
     
     return jsonify({
@@ -5,6 +5,7 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, current_user, login_required
 from app import db
 from app.models.user import User
+from app.utils.config_cache import ConfigCache
 
 # Create blueprint
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
@@ -71,6 +72,7 @@ def register():
             user.set_password(password)
             db.session.add(user)
             db.session.commit()
+            ConfigCache.get_instance().invalidate()
             flash('Registration successful! You can now log in.', 'success')
             return redirect(url_for('auth.login'))
     
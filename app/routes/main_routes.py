@@ -1,10 +1,17 @@
 """
 Main routes for SmartNVR application
 """
+import os
+import logging
 from flask import Blueprint, render_template, redirect, url_for
 from flask_login import login_required, current_user
 from app.models.camera import Camera
 from app.models.ai_model import AIModel
+from app.utils.class_filter import parse_class_list
+from app.utils.config_cache import ConfigCache
+from app.utils.settings import MAX_CLIP_LENGTH, load_settings, save_settings as store_settings
+
+logger = logging.getLogger(__name__)
 
 # Create blueprint
 main_bp = Blueprint('main', __name__)
@@ -60,24 +67,40 @@ def add_camera():
     
     name = request.form.get('name')
     rtsp_url = request.form.get('rtsp_url')
+    sub_rtsp_url = request.form.get('sub_rtsp_url') or None
     username = request.form.get('username')
     password = request.form.get('password')
     model_id = request.form.get('model_id')
     confidence = request.form.get('confidence', 0.45)
+    confirm_model_id = request.form.get('confirm_model_id') or None
+    inference_tiles = request.form.get('inference_tiles') or None
     
     # Validate inputs
     if not name or not rtsp_url:
         flash('Camera name and RTSP URL are required', 'danger')
         return redirect(url_for('main.camera_management'))
     
+    try:
+        detection_classes = _detection_classes_json(request.form.get('detection_classes'))
+    except ValueError as e:
+        flash(f'Invalid detection classes: {str(e)}', 'danger')
+        return redirect(url_for('main.camera_management'))
+    
     # Create new camera
     camera = Camera(
         name=name,
         rtsp_url=rtsp_url,
+        sub_rtsp_url=sub_rtsp_url,
         username=username,
         password=password,
         model_id=model_id,
         confidence_threshold=confidence,
+        detection_classes=detection_classes,
+        confirm_model_id=confirm_model_id,
+        inference_tiles=inference_tiles,
+        tile_motion_only='tile_motion_only' in request.form,
+        inference_priority=request.form.get('inference_priority', 1, type=int),
+        max_detection_latency=request.form.get('max_detection_latency', type=float),
         is_active=True
     )
     
@@ -85,6 +108,7 @@ def add_camera():
     from app import db
     db.session.add(camera)
     db.session.commit()
+    ConfigCache.get_instance().invalidate()
     
     # Start camera processor after adding the camera
     try:
@@ -99,6 +123,13 @@ def add_camera():
     
     return redirect(url_for('main.camera_management'))
 
+def _detection_classes_json(value):
+    """Convert a class list such as 'person, car:0.6' to the JSON stored on the camera, None for all classes"""
+    import json
+    
+    classes = parse_class_list(value)
+    return json.dumps({str(name): threshold for name, threshold in classes.items()}) if classes else None
+
 @main_bp.route('/edit-camera/<int:camera_id>', methods=['POST'])
 @login_required
 def edit_camera(camera_id):
@@ -108,12 +139,15 @@ def edit_camera(camera_id):
     # Find camera
     camera = Camera.query.get_or_404(camera_id)
     
-    # Store old active state to check if we need to start/stop the camera
+    # Store old active state and stream settings to check if we need to start/stop the camera
     old_is_active = camera.is_active
+    old_stream = (camera.rtsp_url, camera.sub_rtsp_url, camera.username, camera.password)
     
     # Update camera details
     camera.name = request.form.get('name', camera.name)
     camera.rtsp_url = request.form.get('rtsp_url', camera.rtsp_url)
+    if 'sub_rtsp_url' in request.form:
+        camera.sub_rtsp_url = request.form.get('sub_rtsp_url') or None
     camera.username = request.form.get('username')
     camera.password = request.form.get('password')
     camera.location = request.form.get('location')
@@ -127,17 +161,54 @@ def edit_camera(camera_id):
     if request.form.get('confidence'):
         camera.confidence_threshold = float(request.form.get('confidence'))
     
+    # Allowed classes with optional thresholds, an empty list detects all classes
+    if 'detection_classes' in request.form:
+        try:
+            camera.detection_classes = _detection_classes_json(request.form.get('detection_classes'))
+        except ValueError as e:
+            flash(f'Invalid detection classes: {str(e)}', 'danger')
+            return redirect(url_for('main.camera_management'))
+    
+    # Two-stage cascade, an empty value detects with the camera's model alone
+    if 'confirm_model_id' in request.form:
+        camera.confirm_model_id = request.form.get('confirm_model_id') or None
+    
+    # Tiled inference for wide-angle cameras, an empty grid runs on full frames
+    if 'inference_tiles' in request.form:
+        camera.inference_tiles = request.form.get('inference_tiles') or None
+        camera.tile_motion_only = 'tile_motion_only' in request.form
+    
+    # Inference scheduling, an empty latency uses the default
+    if 'inference_priority' in request.form:
+        camera.inference_priority = max(1, request.form.get('inference_priority', 1, type=int))
+    if 'max_detection_latency' in request.form:
+        camera.max_detection_latency = request.form.get('max_detection_latency', type=float)
+    
+    # Snapshot encoding overrides, an empty value falls back to the detection settings
+    if 'snapshot_quality' in request.form:
+        camera.snapshot_quality = request.form.get('snapshot_quality', type=int)
+    if 'snapshot_max_width' in request.form:
+        camera.snapshot_max_width = request.form.get('snapshot_max_width', type=int)
+    if 'snapshot_crop' in request.form:
+        camera.snapshot_crop = {'true': True, 'false': False}.get(request.form.get('snapshot_crop').lower())
+    
     # Save to database
     from app import db
     db.session.commit()
+    ConfigCache.get_instance().invalidate()
     
     # Restart camera processor if needed
     try:
         from app.utils.camera_processor import CameraManager
         manager = CameraManager.get_instance()
         
+        stream_changed = (camera.rtsp_url, camera.sub_rtsp_url, camera.username, camera.password) != old_stream
+        
+        # Same stream on a running camera: swap settings in place without reconnecting
+        if camera.is_active and not stream_changed and manager.reconfigure_camera(camera.id, camera):
+            flash(f'Camera {camera.name} updated successfully', 'success')
         # If camera was active and still is, or settings changed, restart it
-        if camera.is_active:
+        elif camera.is_active:
             # Stop camera if it's running
             manager.stop_camera(camera.id)
             
@@ -178,12 +249,17 @@ def delete_camera(camera_id):
     # Import models and db
     from app import db
     from app.models.detection import Detection
+    from app.models.event import Event
     from app.models.recording import Recording
     from app.models.roi import ROI
+    from app.utils.image_store import release_camera_images
+    from app.utils.object_store import ObjectStore
     
     try:
-        # Delete related detections first
+        # Delete related detections, then the events they belong to and the image rows they referenced
         Detection.query.filter_by(camera_id=camera_id).delete()
+        Event.query.filter_by(camera_id=camera_id).delete()
+        image_paths = release_camera_images(db.session, camera_id)
         
         # Delete related recordings
         Recording.query.filter_by(camera_id=camera_id).delete()
@@ -194,6 +270,19 @@ def delete_camera(camera_id):
         # Now delete the camera
         db.session.delete(camera)
         db.session.commit()
+        ConfigCache.get_instance().invalidate()
+        
+        # No row references the snapshots any more, remove them and their offloaded copies
+        for path in image_paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Error deleting snapshot {path}: {str(e)}")
+        store = ObjectStore.get_instance()
+        if store.enabled() and image_paths:
+            store.delete_keys([store.key_for(path) for path in image_paths])
         
         flash(f'Camera {camera_name} deleted successfully', 'success')
     except Exception as e:
@@ -206,101 +295,33 @@ def delete_camera(camera_id):
 @login_required
 def settings():
     """System settings route"""
-    # Load current settings
-    import os
-    import json
-    settings_file = os.path.join('config', 'settings.json')
-    if os.path.exists(settings_file):
-        try:
-            with open(settings_file, 'r') as f:
-                settings = json.load(f)
-            
-            # Ensure all required sections exist in settings
-            if 'recording' not in settings:
-                settings['recording'] = {
-                    'retention_days': 30,
-                    'storage_path': 'storage/recordings',
-                    'clip_length': 60,
-                    'format': 'mp4'
-                }
-                
-            if 'notifications' not in settings:
-                settings['notifications'] = {
-                    'email_enabled': False,
-                    'smtp_server': '',
-                    'smtp_port': 587,
-                    'smtp_username': '',
-                    'smtp_password': '',
-                    'from_email': '',
-                    'email_to': ''
-                }
-                
-            if 'system' not in settings:
-                settings['system'] = {
-                    'log_level': 'info'
-                }
-                
-            if 'detection' not in settings:
-                settings['detection'] = {
-                    'default_confidence': 0.45,
-                    'default_model': 'yolov5s'
-                }
-        except Exception as e:
-            print(f"Error loading settings: {str(e)}")
-            # Default settings if JSON is invalid
-            settings = create_default_settings()
-    else:
-        # Default settings if file doesn't exist
-        settings = create_default_settings()
-        
+    # Load current settings, missing sections are filled with defaults
+    settings = load_settings()
+    
     # Get available AI models
     from app.models.ai_model import AIModel
     ai_models = AIModel.query.all()
     
     return render_template('settings.html', title='Settings', settings=settings, ai_models=ai_models)
 
-def create_default_settings():
-    """Create default settings dictionary"""
-    return {
-        'recording': {
-            'retention_days': 30,
-            'storage_path': 'storage/recordings',
-            'clip_length': 60,
-            'format': 'mp4'
-        },
-        'notifications': {
-            'email_enabled': False,
-            'smtp_server': '',
-            'smtp_port': 587,
-            'smtp_username': '',
-            'smtp_password': '',
-            'from_email': '',
-            'email_to': ''
-        },
-        'system': {
-            'log_level': 'info'
-        },
-        'detection': {
-            'default_confidence': 0.45,
-            'default_model': 'yolov5s'
-        }
-    }
-
 @main_bp.route('/save-settings', methods=['POST'])
 @login_required
 def save_settings():
     """Save system settings"""
     from flask import request, flash
-    import os
-    import json
     
     # Get form data
     settings = {
         'recording': {
             'retention_days': int(request.form.get('retention_days', 30)),
             'storage_path': request.form.get('storage_path', 'storage/recordings'),
-            'clip_length': int(request.form.get('clip_length', 60)),
-            'format': request.form.get('format', 'mp4')
+            'clip_length': min(MAX_CLIP_LENGTH, max(10, int(request.form.get('clip_length', 60)))),
+            'format': request.form.get('format', 'mp4'),
+            'mode': request.form.get('recording_mode', 'continuous'),
+            'pre_event_seconds': int(request.form.get('pre_event_seconds', 10)),
+            'post_event_seconds': int(request.form.get('post_event_seconds', 20)),
+            'event_classes': request.form.get('event_classes', ''),
+            'event_roi_only': 'event_roi_only' in request.form
         },
         'notifications': {
             'email_enabled': 'email_enabled' in request.form,
@@ -316,31 +337,19 @@ def save_settings():
         },
         'detection': {
             'default_confidence': float(request.form.get('default_confidence', 0.45)),
-            'default_model': request.form.get('default_model', 'yolov5s')
+            'default_model': request.form.get('default_model', 'yolov5s'),
+            'snapshot_quality': int(request.form.get('snapshot_quality', 80)),
+            'snapshot_max_width': int(request.form.get('snapshot_max_width', 1280)),
+            'snapshot_crop': 'snapshot_crop' in request.form
         }
     }
     
-    # Only update password if provided
+    # Only update password if provided, otherwise the stored one is kept
     if request.form.get('smtp_password'):
         settings['notifications']['smtp_password'] = request.form.get('smtp_password')
-    else:
-        # Preserve existing password if it exists
-        settings_file = os.path.join('config', 'settings.json')
-        if os.path.exists(settings_file):
-            try:
-                with open(settings_file, 'r') as f:
-                    old_settings = json.load(f)
-                    if 'notifications' in old_settings and 'smtp_password' in old_settings['notifications']:
-                        settings['notifications']['smtp_password'] = old_settings['notifications']['smtp_password']
-            except:
-                pass
-    
-    # Ensure config directory exists
-    os.makedirs('config', exist_ok=True)
     
-    # Save settings to JSON file
-    with open(os.path.join('config', 'settings.json'), 'w') as f:
-        json.dump(settings, f, indent=4)
+    # Save settings to JSON file, keeping sections not edited on this page
+    store_settings(settings)
     
     flash('Settings saved successfully', 'success')
     return redirect(url_for('main.settings'))
\ No newline at end of file
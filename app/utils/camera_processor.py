@@ -3,17 +3,37 @@ import numpy as np
 import torch
 import time
 import os
+import math
 import json
 import threading
 import queue
 import logging
 from datetime import datetime, timedelta
-import uuid
 from shapely.geometry import Point, Polygon
+import psutil
 import requests
 
+from app.utils.class_filter import ClassFilter, model_class_names, parse_class_list
+from app.utils.event_recorder import EventRecorder
+from app.utils.image_store import ImageStore
+from app.utils.inference_scheduler import InferenceScheduler
+from app.utils.inference_tiles import MotionGate, merge_detections, parse_grid, rects_overlap, tile_layout
+from app.utils.model_cascade import (CONFIRM_MIN_IOU, REJECT_HOLD, REJECT_MIN_IOU, ConfirmationQueue,
+                                     confirmation_crop, crop_images)
+from app.utils.object_tracker import ObjectTracker, iou
+from app.utils.preview_store import PreviewBuilder
+from app.utils.recording_store import open_segment, segment_finished
+from app.utils.settings import MAX_CLIP_LENGTH, load_settings
+from app.utils.stream_recorder import StreamRecorder, find_ffmpeg
+
 logger = logging.getLogger(__name__)
 
+RECORDING_FPS = 20.0  # Fixed frame rate of the OpenCV writer
+ROI_CROP_PADDING = 0.1  # Share of an ROI's size added around it when cropping for inference
+ROI_CROP_MIN_PADDING = 32  # Minimum padding in pixels, keeps objects on the ROI edge whole
+ROI_CROP_MAX_CROPS = 4  # Inference crops per frame, nearby ROIs are merged beyond this
+ROI_CROP_MAX_COVERAGE = 0.8  # Crops covering more of the frame than this run on the full frame
+
 class CameraProcessor:
     """Process RTSP camera streams with YOLOv5 object detection"""
     
@@ -25,7 +45,11 @@ class CameraProcessor:
             model_path: Path to YOLOv5 model file (if None, use camera's model)
             confidence_threshold: Detection confidence threshold (if None, use camera's threshold)
         """
-        self.camera = camera
+        from app import app
+        from app.utils.config_cache import detached_copy
+        
+        # Keep a detached copy so worker threads never touch an expired session object
+        self.camera = detached_copy(camera)
         self.model_path = model_path or self._get_model_path()
         self.confidence_threshold = confidence_threshold or camera.confidence_threshold or 0.45
         self.cap = None
@@ -34,18 +58,75 @@ class CameraProcessor:
         self.recording = False
         self.thread = None
         self.recording_thread = None
-        self.detection_thread = None
-        self.frame_queue = queue.Queue(maxsize=10)  # Queue for frames to process
         self.recording_queue = queue.Queue(maxsize=30)  # Queue for frames to record
         self.last_frame = None
+        self.frame_size = None  # (width, height) of the decoded stream
+        self.record_size = None  # (width, height) of the main stream when detecting on a substream
         self.fps = 0
         self.last_detection_time = None
         self.current_video_path = None
         self.video_writer = None
         self.video_start_time = None
+        self.video_frame_count = 0
+        self.clip_length = 60  # Segment length in seconds, from recording.clip_length in settings
+        self.recording_engine = app.config.get('RECORDING_ENGINE', 'ffmpeg')
+        self.ffmpeg_path = app.config.get('FFMPEG_PATH', 'ffmpeg')
+        self.recording_format = app.config.get('RECORDING_FORMAT', 'fmp4')
+        self.event_buffer_bytes = app.config.get('EVENT_BUFFER_MAX_MB', 32) * 1024 * 1024
+        self.recording_type = 'continuous'  # 'motion' while event recording is used
+        self.event_classes = set()  # Class names that trigger events, empty for all
+        self.event_roi_only = False
+        self.stream_recorder = None  # Stream-copy recorder when the ffmpeg engine is used
+        # Thumbnail and scrub sprite tiles taken from the frames decoded for detection
+        self.previews = PreviewBuilder(self.camera.id,
+                                       interval=app.config.get('PREVIEW_TILE_INTERVAL', 5),
+                                       tile_width=app.config.get('PREVIEW_TILE_WIDTH', 160),
+                                       thumbnail_width=app.config.get('PREVIEW_THUMBNAIL_WIDTH', 320))
+        # Detections are persisted per track lifecycle instead of per inference
+        self.tracker = ObjectTracker(iou_threshold=app.config.get('TRACKER_IOU_THRESHOLD', 0.3),
+                                     min_hits=app.config.get('TRACKER_MIN_HITS', 2),
+                                     max_age=app.config.get('TRACKER_MAX_AGE', 2.0),
+                                     best_interval=app.config.get('TRACKER_BEST_INTERVAL', 10.0))
+        self.rows_written = 0
+        self.images_written = 0
+        self.snapshot_options = self._load_snapshot_options()
         self.detection_regions = self._load_detection_regions()
+        self.class_filter = None  # Allowed classes and per-class thresholds, built once the model is loaded
+        self.roi_crop = app.config.get('ROI_CROP_INFERENCE', True)
+        self.crop_cache = None  # (regions, frame size, scale, crops) of the last crop layout
+        self.tile_overlap = app.config.get('INFERENCE_TILE_OVERLAP', 0.2)
+        self.tile_cache = None  # (grid, frame size, tiles) of the last tile layout
+        self.motion_gate = MotionGate()
+        self.tiles_inferred = 0
+        self.tiles_skipped = 0
+        self.inference_pixels = 0  # Pixels sent to the model
+        self.frame_pixels = 0  # Pixels of the frames detection ran on
+        self.confirm_model_path = None  # Confirmation model of the two-stage cascade, None for single-model detection
+        self.confirm_timeout = app.config.get('CASCADE_CONFIRM_TIMEOUT', 2.0)
+        self.baseline_interval = app.config.get('CASCADE_BASELINE_INTERVAL', 100)
+        self.cascade_counts = self._new_cascade_counts()
+        self.rejected = []  # (class name, box, hold until) of candidates the confirmation model rejected
         self.current_detections = []  # Store current detections for API access
         self.detection_lock = threading.Lock()  # Lock for thread-safe detection updates
+        self.config_lock = threading.Lock()  # Lock for swapping model, ROIs and threshold at runtime
+        self.pending_model_path = None  # Model being loaded in the background to replace self.model
+        self.model_generation = 0  # Bumped on every model change, loads started for an older one are discarded
+        self.pending_confirm_path = None  # Confirmation model being loaded in the background
+        self.confirm_generation = 0
+        
+    def _load_snapshot_options(self):
+        """Get this camera's snapshot encoding, falling back to the detection settings"""
+        defaults = load_settings()['detection']
+        quality = self.camera.snapshot_quality or defaults.get('snapshot_quality', 80)
+        max_width = self.camera.snapshot_max_width or defaults.get('snapshot_max_width', 1280)
+        crop = self.camera.snapshot_crop
+        if crop is None:
+            crop = defaults.get('snapshot_crop', False)
+        return {
+            'quality': max(10, min(100, int(quality))),
+            'max_width': int(max_width) or None,
+            'crop': bool(crop)
+        }
         
     def _get_model_path(self):
         """Get path to YOLOv5 model file from camera config or use default"""
@@ -67,10 +148,10 @@ class CameraProcessor:
         
     def _load_detection_regions(self):
         """Load detection regions (ROIs) for this camera"""
-        from app.models.roi import ROI
+        from app.utils.config_cache import ConfigCache
         
         regions = []
-        rois = ROI.query.filter_by(camera_id=self.camera.id).all()
+        rois = ConfigCache.get_instance().get_rois(self.camera.id)
         
         for roi in rois:
             if not roi.is_active:
@@ -79,13 +160,15 @@ class CameraProcessor:
             try:
                 # Parse ROI coordinates and allowed classes
                 coords = json.loads(roi.coordinates)
-                classes = json.loads(roi.detection_classes) if roi.detection_classes else None
+                classes = parse_class_list(roi.detection_classes)
                 
                 if len(coords) >= 3:  # Need at least 3 points for a polygon
                     regions.append({
                         'id': roi.id,
                         'name': roi.name,
                         'polygon': Polygon(coords),
+                        # The ROI editor stores fractions of the frame, API clients may send main stream pixels
+                        'normalized': all(0 <= value <= 1 for point in coords for value in point[:2]),
                         'classes': classes
                     })
             except Exception as e:
@@ -93,33 +176,446 @@ class CameraProcessor:
                 
         return regions
         
-    def start(self):
-        """Start processing camera stream"""
-        if self.running:
-            return False
+    def _apply_class_filter(self, model):
+        """Build the camera's class filter for a model and push it into the model's NMS"""
+        try:
+            camera_classes = parse_class_list(self.camera.detection_classes)
+        except ValueError as e:
+            logger.error(f"Invalid detection classes of camera {self.camera.name}, detecting all classes: {str(e)}")
+            camera_classes = {}
+        class_filter = ClassFilter(model_class_names(model), self.confidence_threshold,
+                                   camera_classes, self.detection_regions)
+        class_filter.apply(model)
+        return class_filter
+        
+    def _get_confirm_model_path(self):
+        """Get path to the camera's confirmation model, None if it has none or the file is missing"""
+        from app.models.ai_model import AIModel
+        
+        if not self.camera.confirm_model_id:
+            return None
+        model = AIModel.query.get(self.camera.confirm_model_id)
+        if model and os.path.exists(model.file_path):
+            return model.file_path
+        logger.warning(f"Confirmation model of camera {self.camera.name} not found, detecting with one model")
+        return None
+        
+    def _new_cascade_counts(self):
+        """Get zeroed two-stage cascade counters"""
+        return {
+            'frames': 0,  # Frames the camera's model ran on
+            'images': 0,  # Images (frames, crops or tiles) the camera's model ran on
+            'frames_escalated': 0,  # Frames with candidates sent to the confirmation model
+            'candidates_escalated': 0,
+            'candidates_confirmed': 0,
+            'candidates_tracked': 0,  # Candidates on an already confirmed track, not escalated again
+            'candidates_held': 0,  # Candidates on a recently rejected box, dropped without escalation
+            'timeouts': 0,
+            'detect_seconds': 0.0,
+            'confirm_seconds': 0.0,
+            'baseline_frames': 0,  # Sampled frames the confirmation model also ran on alone
+            'baseline_seconds': 0.0  # Confirmation model time on those frames
+        }
+        
+    def _load_confirm_model(self, model_path, generation):
+        """Load the confirmation model in the shared queue and switch the cascade to it
+        
+        Args:
+            model_path: Confirmation model path, None to detect with one model
+            generation: confirm_generation when the load was requested, a newer
+                        change discards the result
+        """
+        if model_path:
+            try:
+                ConfirmationQueue.get_instance().load(model_path, self._load_model)
+            except Exception as e:
+                logger.error(f"Failed to load confirmation model {model_path}, detecting with one model: {str(e)}")
+                model_path = None
+                
+        with self.config_lock:
+            if generation != self.confirm_generation:
+                logger.info(f"Confirmation model {model_path} for camera {self.camera.name} was superseded")
+                return
+            self.pending_confirm_path = None
+            self.confirm_model_path = model_path
+            self.cascade_counts = self._new_cascade_counts()
+            self.rejected = []
+            
+        if model_path:
+            logger.info(f"Camera {self.camera.name} confirms detections with {model_path}")
+        
+    def _load_model(self, model_path):
+        """Load a YOLOv5 model and move it to the GPU if available
+        
+        Args:
+            model_path: Path to YOLOv5 model file
+            
+        Returns:
+            Loaded model with the current confidence threshold applied
+        """
+        logger.info(f"Loading YOLOv5 model from {model_path}")
+        
+        # Try loading model directly if it's a local file
+        if os.path.exists(model_path) and model_path.endswith('.pt'):
+            try:
+                # Use local model file with direct YOLOv5 loading
+                # Check if we're in the yolov5 models directory or root directory
+                if os.path.basename(model_path) in ["yolov5n.pt", "yolov5s.pt", "yolov5m.pt", "yolov5l.pt", "yolov5x.pt"]:
+                    # Standard YOLOv5 model - use the appropriate size
+                    model_size = os.path.basename(model_path).replace('yolov5', '').replace('.pt', '')
+                    logger.info(f"Loading standard YOLOv5 model size: {model_size}")
+                    model = torch.hub.load('ultralytics/yolov5', f'yolov5{model_size}', 
+                                              pretrained=True, 
+                                              trust_repo=True)
+                else:
+                    # Custom model - try direct loading
+                    logger.info(f"Loading custom model from {model_path}")
+                    model = torch.hub.load('ultralytics/yolov5', 'custom', 
+                                              path=model_path,
+                                              trust_repo=True)
+            except Exception as e:
+                logger.warning(f"Direct YOLOv5 loading failed: {str(e)}")
+                
+                # Get the basename of the model file for simpler handling
+                model_basename = os.path.basename(model_path)
+                
+                # Check if it's a standard YOLOv5 model by name
+                if model_basename in ["yolov5n.pt", "yolov5s.pt", "yolov5m.pt", "yolov5l.pt", "yolov5x.pt"]:
+                    model_size = model_basename.replace('yolov5', '').replace('.pt', '')
+                    logger.info(f"Falling back to YOLOv5 {model_size} from PyTorch Hub")
+                    model = torch.hub.load('ultralytics/yolov5', f'yolov5{model_size}', 
+                                              pretrained=True, 
+                                              trust_repo=True,
+                                              force_reload=True)
+                else:
+                    # Last resort - use default YOLOv5s
+                    logger.warning("Falling back to default YOLOv5s model")
+                    model = torch.hub.load('ultralytics/yolov5', 'yolov5s', 
+                                              pretrained=True, 
+                                              trust_repo=True)
+        else:
+            # Model path doesn't exist or isn't a .pt file - use default YOLOv5s
+            logger.warning(f"Model path {model_path} not valid, using default YOLOv5s")
+            model = torch.hub.load('ultralytics/yolov5', 'yolov5s', 
+                                       pretrained=True, 
+                                       trust_repo=True)
             
-        # Initialize video capture
-        rtsp_url = self.camera.rtsp_url
+        # Set confidence threshold
+        model.conf = self.confidence_threshold
+        
+        # Use GPU if available
+        if torch.cuda.is_available():
+            model.cuda()
+            logger.info("Using CUDA for inference")
+        else:
+            logger.info("Using CPU for inference")
+        
+        logger.info("Successfully loaded YOLOv5 model")
+        return model
+
+    def _stream_url(self, url=None):
+        """Get a camera stream URL (the main stream by default) with credentials inserted if needed"""
+        rtsp_url = url or self.camera.rtsp_url
         if self.camera.username and self.camera.password:
             # Insert credentials into RTSP URL if needed
             if '://' in rtsp_url:
                 protocol, rest = rtsp_url.split('://', 1)
                 rtsp_url = f"{protocol}://{self.camera.username}:{self.camera.password}@{rest}"
+        return rtsp_url
+        
+    def _capture_url(self):
+        """Get the stream decoded for detection and live view, the substream when one is set"""
+        return self._stream_url(self.camera.sub_rtsp_url or self.camera.rtsp_url)
         
+    def _open_capture(self, url):
+        """Open a video capture with the options that keep the FFmpeg backend stable"""
         # Set OpenCV backend to FFMPEG with specific parameters to avoid threading issues
         os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = "rtsp_transport;tcp|buffer_size;10485760|stimeout;1000000"
         
         # Open video capture with optimized parameters
-        if rtsp_url.startswith('rtsp://'):
+        if url.startswith('rtsp://'):
             # For RTSP streams, use these specific parameters to avoid the async_lock crash
-            self.cap = cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG)
+            cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG)
             # Important: Disable multi-threading in FFmpeg which causes the crash
-            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M','J','P','G'))  # Use MJPEG
-            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 3)  # Small buffer 
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M','J','P','G'))  # Use MJPEG
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 3)  # Small buffer 
         else:
             # For other sources (like local files or HTTP streams)
-            self.cap = cv2.VideoCapture(rtsp_url)
-            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 2)
+            cap = cv2.VideoCapture(url)
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 2)
+        return cap
+        
+    def _probe_size(self, source):
+        """Read the frame size of a stream or file from its headers
+        
+        Returns:
+            tuple or None: (width, height), None if it cannot be opened
+        """
+        cap = cv2.VideoCapture(source)
+        try:
+            if not cap.isOpened():
+                return None
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0)
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0)
+            return (width, height) if width > 0 and height > 0 else None
+        finally:
+            cap.release()
+        
+    def _record_scale(self):
+        """Get the factors from decoded frame to main stream pixels"""
+        if not self.record_size or not self.frame_size:
+            return 1.0, 1.0
+        return self.record_size[0] / self.frame_size[0], self.record_size[1] / self.frame_size[1]
+        
+    def _to_record_space(self, detection):
+        """Copy a detection with its box in main stream pixels, the space stored detections use"""
+        scale_x, scale_y = self._record_scale()
+        scaled = dict(detection)
+        if scale_x != 1.0 or scale_y != 1.0:
+            scaled['bbox_x'] = int(round(detection['bbox_x'] * scale_x))
+            scaled['bbox_y'] = int(round(detection['bbox_y'] * scale_y))
+            scaled['bbox_width'] = int(round(detection['bbox_width'] * scale_x))
+            scaled['bbox_height'] = int(round(detection['bbox_height'] * scale_y))
+        return scaled
+        
+    def _inference_crops(self, regions, frame_width, frame_height):
+        """Get the padded rectangles around the active ROIs that inference runs on
+        
+        Overlapping rectangles are merged so no object is detected twice, and
+        the closest ones are merged until at most ROI_CROP_MAX_CROPS are left.
+        
+        Returns:
+            list or None: (x1, y1, x2, y2) crops in frame pixels, None to run on the whole frame
+        """
+        if not regions or not self.roi_crop:
+            return None
+            
+        scale = self._record_scale()
+        cached = self.crop_cache
+        if cached and cached[0] is regions and cached[1] == (frame_width, frame_height) and cached[2] == scale:
+            return cached[3]
+            
+        rects = []
+        for region in regions:
+            min_x, min_y, max_x, max_y = region['polygon'].bounds
+            if region['normalized']:
+                min_x, max_x = min_x * frame_width, max_x * frame_width
+                min_y, max_y = min_y * frame_height, max_y * frame_height
+            else:
+                min_x, max_x = min_x / scale[0], max_x / scale[0]
+                min_y, max_y = min_y / scale[1], max_y / scale[1]
+            pad_x = max(ROI_CROP_MIN_PADDING, (max_x - min_x) * ROI_CROP_PADDING)
+            pad_y = max(ROI_CROP_MIN_PADDING, (max_y - min_y) * ROI_CROP_PADDING)
+            rect = (max(0, int(min_x - pad_x)), max(0, int(min_y - pad_y)),
+                    min(frame_width, int(math.ceil(max_x + pad_x))), min(frame_height, int(math.ceil(max_y + pad_y))))
+            if rect[2] > rect[0] and rect[3] > rect[1]:
+                rects.append(rect)
+                
+        def area(rect):
+            return (rect[2] - rect[0]) * (rect[3] - rect[1])
+            
+        def union(a, b):
+            return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+            
+        # Merging can make a rectangle overlap others, so repeat until stable
+        while True:
+            pair = None
+            for i in range(len(rects)):
+                for j in range(i + 1, len(rects)):
+                    if rects_overlap(rects[i], rects[j]):
+                        pair = (i, j)
+                        break
+                if pair:
+                    break
+            if pair is None and len(rects) > ROI_CROP_MAX_CROPS:
+                # Too many crops: merge the pair that adds the least area
+                pair = min(((i, j) for i in range(len(rects)) for j in range(i + 1, len(rects))),
+                           key=lambda p: area(union(rects[p[0]], rects[p[1]])) - area(rects[p[0]]) - area(rects[p[1]]))
+            if pair is None:
+                break
+            i, j = pair
+            merged = union(rects[i], rects[j])
+            rects = [rect for k, rect in enumerate(rects) if k not in pair] + [merged]
+            
+        crops = rects or None
+        if crops and sum(area(rect) for rect in crops) > ROI_CROP_MAX_COVERAGE * frame_width * frame_height:
+            crops = None
+        self.crop_cache = (regions, (frame_width, frame_height), scale, crops)
+        return crops
+        
+    def _inference_tiles(self, frame, regions, grid, motion_only=False):
+        """Get the tiles of a tiled inference camera that need inference on this frame
+        
+        Tiles outside the ROI crops are left out, and with motion_only so are
+        tiles without motion or a live track.
+        
+        Returns:
+            list: (x1, y1, x2, y2) tiles in frame pixels, empty when nothing needs inference
+        """
+        frame_height, frame_width = frame.shape[:2]
+        cached = self.tile_cache
+        if cached and cached[0] == grid and cached[1] == (frame_width, frame_height):
+            tiles = cached[2]
+        else:
+            tiles = tile_layout(frame_width, frame_height, grid[0], grid[1], self.tile_overlap)
+            self.tile_cache = (grid, (frame_width, frame_height), tiles)
+            
+        selected = tiles
+        crops = self._inference_crops(regions, frame_width, frame_height)
+        if crops:
+            selected = [tile for tile in selected if any(rects_overlap(tile, crop) for crop in crops)]
+        if motion_only:
+            selected = self.motion_gate.moving_tiles(frame, selected, self.tracker.predicted_boxes())
+            
+        self.tiles_inferred += len(selected)
+        self.tiles_skipped += len(tiles) - len(selected)
+        return selected
+        
+    def _run_inference(self, model, frame, crops):
+        """Run the model on the whole frame or on crops or tiles of it
+        
+        Returns:
+            list: (x offset, y offset, detections table) per image the model saw
+        """
+        frame_height, frame_width = frame.shape[:2]
+        self.frame_pixels += frame_width * frame_height
+        if crops is None:
+            self.inference_pixels += frame_width * frame_height
+            return [(0, 0, model(frame).pandas().xyxy[0])]
+        if not crops:
+            return []
+            
+        # One batched call for all crops
+        images = crop_images(frame, crops)
+        self.inference_pixels += sum(image.shape[0] * image.shape[1] for image in images)
+        tables = model(images).pandas().xyxy
+        return [(x1, y1, table) for (x1, y1, _, _), table in zip(crops, tables)]
+        
+    def _confirm_detections(self, frame, detections, confirm_path, class_filter):
+        """Keep the detections the confirmation model agrees with
+        
+        Detections on a live track were confirmed before and pass without a
+        second look, detections where the confirmation model recently found
+        nothing are dropped the same way. The others are cropped with some
+        context and confirmed in one request to the shared queue; a confirmed
+        detection takes the box and confidence of the confirmation model.
+        
+        Returns:
+            list: Confirmed detections
+        """
+        counts = self.cascade_counts
+        now = time.time()
+        self.rejected = [rejected for rejected in self.rejected if rejected[2] > now]
+        kept, pending = [], []
+        for detection in detections:
+            class_name = detection['class_name']
+            box = (detection['bbox_x'], detection['bbox_y'],
+                   detection['bbox_x'] + detection['bbox_width'], detection['bbox_y'] + detection['bbox_height'])
+            if self.tracker.is_tracked(class_name, box):
+                kept.append(detection)
+                counts['candidates_tracked'] += 1
+            elif any(name == class_name and iou(rejected, box) >= REJECT_MIN_IOU
+                     for name, rejected, _ in self.rejected):
+                counts['candidates_held'] += 1
+            else:
+                pending.append((detection, box))
+        if not pending:
+            return kept
+            
+        frame_height, frame_width = frame.shape[:2]
+        crops = [confirmation_crop(box, frame_width, frame_height) for _, box in pending]
+        counts['frames_escalated'] += 1
+        counts['candidates_escalated'] += len(pending)
+        try:
+            request = ConfirmationQueue.get_instance().confirm(confirm_path, crop_images(frame, crops),
+                                                               timeout=self.confirm_timeout)
+        except TimeoutError:
+            # Unconfirmed candidates are dropped, a real object is seen again on the next frames
+            counts['timeouts'] += 1
+            logger.warning(f"Confirmation of {len(pending)} detections on camera {self.camera.name} timed out")
+            return kept
+        counts['confirm_seconds'] += request.seconds
+        
+        for (detection, box), (offset_x, offset_y, _, _), table in zip(pending, crops, request.future.result()):
+            threshold = class_filter.threshold(detection['class_id'], detection['roi_id'])
+            best = None
+            for _, row in table.iterrows():
+                conf = float(row['confidence'])
+                # Models may number their classes differently, names are compared
+                if row['name'] != detection['class_name'] or conf < threshold:
+                    continue
+                confirmed = (int(row['xmin']) + offset_x, int(row['ymin']) + offset_y,
+                             int(row['xmax']) + offset_x, int(row['ymax']) + offset_y)
+                if iou(confirmed, box) >= CONFIRM_MIN_IOU and (best is None or conf > best[0]):
+                    best = (conf, confirmed)
+            if best is None:
+                self.rejected.append((detection['class_name'], box, now + REJECT_HOLD))
+                continue
+            conf, (x1, y1, x2, y2) = best
+            detection.update({'confidence': conf, 'bbox_x': x1, 'bbox_y': y1,
+                              'bbox_width': x2 - x1, 'bbox_height': y2 - y1})
+            kept.append(detection)
+            counts['candidates_confirmed'] += 1
+        return kept
+        
+    def _measure_baseline(self, confirm_path, frame, rects):
+        """Time the confirmation model alone on the images the camera's model just saw
+        
+        Runs on every baseline_interval-th frame, so that single-model cost
+        is measured on the same frames, crops or tiles instead of estimated
+        from batched confirmation crops.
+        """
+        counts = self.cascade_counts
+        if self.baseline_interval <= 0 or (counts['frames'] - 1) % self.baseline_interval:
+            return
+        images = [frame] if rects is None else crop_images(frame, rects)
+        try:
+            request = ConfirmationQueue.get_instance().confirm(confirm_path, images, timeout=self.confirm_timeout,
+                                                               alone=True)
+        except Exception as e:
+            logger.warning(f"Baseline run of the confirmation model on camera {self.camera.name} failed: {str(e)}")
+            return
+        counts['baseline_frames'] += 1
+        counts['baseline_seconds'] += request.seconds
+        
+    def _cascade_stats(self):
+        """Get the escalated share of frames and the cascade's cost against the confirmation model alone
+        
+        Both costs are per frame: the cascade's over all frames, the
+        confirmation model's over the sampled frames it also ran on alone.
+        """
+        if not self.confirm_model_path:
+            return None
+        counts = dict(self.cascade_counts)
+        cascade_seconds = counts['detect_seconds'] + counts['confirm_seconds']
+        cascade_per_frame = cascade_seconds / counts['frames'] if counts['frames'] else None
+        single_per_frame = (counts['baseline_seconds'] / counts['baseline_frames']
+                            if counts['baseline_frames'] else None)
+        counts.update({
+            'confirm_model': self.confirm_model_path,
+            'escalated_fraction': round(counts['frames_escalated'] / counts['frames'], 3) if counts['frames'] else None,
+            'detect_seconds': round(counts['detect_seconds'], 3),
+            'confirm_seconds': round(counts['confirm_seconds'], 3),
+            'baseline_seconds': round(counts['baseline_seconds'], 3),
+            'cascade_seconds_per_frame': round(cascade_per_frame, 4) if cascade_per_frame is not None else None,
+            'single_model_seconds_per_frame': round(single_per_frame, 4) if single_per_frame is not None else None,
+            'cost_ratio': (round(cascade_per_frame / single_per_frame, 3)
+                           if cascade_per_frame is not None and single_per_frame else None)
+        })
+        return counts
+        
+    def _video_dir(self):
+        """Get the recordings directory for this camera"""
+        return os.path.join('storage', 'recordings', 'videos', str(self.camera.id))
+        
+    def start(self):
+        """Start processing camera stream"""
+        if self.running:
+            return False
+            
+        # Initialize video capture, on the substream if the camera has one
+        rtsp_url = self._capture_url()
+        self.cap = self._open_capture(rtsp_url)
         
         # Check if stream opened successfully
         if not self.cap.isOpened():
@@ -128,71 +624,29 @@ class CameraProcessor:
             
         logger.info(f"Successfully opened camera stream: {rtsp_url}")
         
+        # Boxes found on the substream are stored in main stream pixels
+        self.record_size = None
+        if self.camera.sub_rtsp_url:
+            self.record_size = self._probe_size(self._stream_url())
+            if self.record_size:
+                logger.info(f"Camera {self.camera.name} detects on its substream, main stream is "
+                            f"{self.record_size[0]}x{self.record_size[1]}")
+            else:
+                logger.warning(f"Could not read the main stream size of camera {self.camera.name}, "
+                               f"using the size of the first recorded segment")
+        
         # Initialize YOLOv5 model
         try:
-            logger.info(f"Loading YOLOv5 model from {self.model_path}")
-            
-            # Try loading model directly if it's a local file
-            if os.path.exists(self.model_path) and self.model_path.endswith('.pt'):
-                try:
-                    # Use local model file with direct YOLOv5 loading
-                    # Check if we're in the yolov5 models directory or root directory
-                    if os.path.basename(self.model_path) in ["yolov5n.pt", "yolov5s.pt", "yolov5m.pt", "yolov5l.pt", "yolov5x.pt"]:
-                        # Standard YOLOv5 model - use the appropriate size
-                        model_size = os.path.basename(self.model_path).replace('yolov5', '').replace('.pt', '')
-                        logger.info(f"Loading standard YOLOv5 model size: {model_size}")
-                        self.model = torch.hub.load('ultralytics/yolov5', f'yolov5{model_size}', 
-                                                  pretrained=True, 
-                                                  trust_repo=True)
-                    else:
-                        # Custom model - try direct loading
-                        logger.info(f"Loading custom model from {self.model_path}")
-                        self.model = torch.hub.load('ultralytics/yolov5', 'custom', 
-                                                  path=self.model_path,
-                                                  trust_repo=True)
-                except Exception as e:
-                    logger.warning(f"Direct YOLOv5 loading failed: {str(e)}")
-                    
-                    # Get the basename of the model file for simpler handling
-                    model_basename = os.path.basename(self.model_path)
-                    
-                    # Check if it's a standard YOLOv5 model by name
-                    if model_basename in ["yolov5n.pt", "yolov5s.pt", "yolov5m.pt", "yolov5l.pt", "yolov5x.pt"]:
-                        model_size = model_basename.replace('yolov5', '').replace('.pt', '')
-                        logger.info(f"Falling back to YOLOv5 {model_size} from PyTorch Hub")
-                        self.model = torch.hub.load('ultralytics/yolov5', f'yolov5{model_size}', 
-                                                  pretrained=True, 
-                                                  trust_repo=True,
-                                                  force_reload=True)
-                    else:
-                        # Last resort - use default YOLOv5s
-                        logger.warning(f"Falling back to default YOLOv5s model")
-                        self.model = torch.hub.load('ultralytics/yolov5', 'yolov5s', 
-                                                  pretrained=True, 
-                                                  trust_repo=True)
-            else:
-                # Model path doesn't exist or isn't a .pt file - use default YOLOv5s
-                logger.warning(f"Model path {self.model_path} not valid, using default YOLOv5s")
-                self.model = torch.hub.load('ultralytics/yolov5', 'yolov5s', 
-                                           pretrained=True, 
-                                           trust_repo=True)
-                
-            # Set confidence threshold
-            self.model.conf = self.confidence_threshold
-            
-            # Use GPU if available
-            if torch.cuda.is_available():
-                self.model.cuda()
-                logger.info("Using CUDA for inference")
-            else:
-                logger.info("Using CPU for inference")
-            
-            logger.info(f"Successfully loaded YOLOv5 model")
+            self.model = self._load_model(self.model_path)
+            self.class_filter = self._apply_class_filter(self.model)
         except Exception as e:
             logger.error(f"Failed to load YOLOv5 model: {str(e)}")
             self.cap.release()
             return False
             
+        # The confirmation model is shared by all cameras of the cascade
+        self._load_confirm_model(self._get_confirm_model_path(), self.confirm_generation)
+            
         # Start processing thread
         self.running = True
         self.thread = threading.Thread(target=self._process_frames)
@@ -204,24 +658,189 @@ class CameraProcessor:
         
         # Start recording thread if enabled
         if self.camera.recording_enabled:
-            self.recording = True
-            self.recording_thread = threading.Thread(target=self._record_frames)
-            self.recording_thread.daemon = True
-            self.recording_thread.start()
+            self._start_recording()
             
-        # Start detection thread if enabled
+        # Serve detection from the shared inference scheduler if enabled
         if self.camera.detection_enabled:
-            self.detection_thread = threading.Thread(target=self._detect_objects)
-            self.detection_thread.daemon = True
-            self.detection_thread.start()
+            self._start_detection()
             
         logger.info(f"Started processing camera: {self.camera.name}")
         return True
         
+    def _start_recording(self):
+        """Start recording with the configured engine if it is not already running"""
+        recording_settings = load_settings()['recording']
+        try:
+            self.clip_length = min(MAX_CLIP_LENGTH, max(10, int(recording_settings.get('clip_length', 60))))
+        except (TypeError, ValueError):
+            self.clip_length = 60
+        # Tiles must outlive the longest segment (events add their pre-roll and remux time)
+        self.previews.retention = self.clip_length * 2 + 60
+            
+        event_mode = recording_settings.get('mode') == 'event'
+        self.event_classes = {name.strip().lower() for name in str(recording_settings.get('event_classes') or '').split(',')
+                              if name.strip()}
+        self.event_roi_only = bool(recording_settings.get('event_roi_only', False))
+            
+        if self.recording_engine == 'ffmpeg':
+            if self.stream_recorder and self.stream_recorder.running:
+                self.recording = True
+                return
+                
+            if find_ffmpeg(self.ffmpeg_path):
+                if event_mode:
+                    # Keep a bounded pre-event buffer and only write around detections
+                    self.recording_type = 'motion'
+                    recorder = EventRecorder(self.camera.id, self._stream_url(), self._video_dir(),
+                                             pre_seconds=int(recording_settings.get('pre_event_seconds', 10)),
+                                             post_seconds=int(recording_settings.get('post_event_seconds', 20)),
+                                             max_buffer_bytes=self.event_buffer_bytes,
+                                             segment_seconds=self.clip_length,
+                                             ffmpeg_path=self.ffmpeg_path,
+                                             on_segment_start=self._segment_started,
+                                             on_segment=self._segment_finished)
+                else:
+                    # Remux the camera's own packets, no decoding or re-encoding needed
+                    self.recording_type = 'continuous'
+                    recorder = StreamRecorder(self.camera.id, self._stream_url(), self._video_dir(),
+                                              segment_seconds=self.clip_length,
+                                              ffmpeg_path=self.ffmpeg_path,
+                                              container=self.recording_format,
+                                              on_segment_start=self._segment_started,
+                                              on_segment=self._segment_finished)
+                if recorder.start():
+                    self.stream_recorder = recorder
+                    self.recording = True
+                    return
+            logger.warning(f"ffmpeg recording unavailable for camera {self.camera.name}, using OpenCV recording")
+            if self.camera.sub_rtsp_url:
+                logger.warning(f"OpenCV recording of camera {self.camera.name} writes the decoded substream")
+            
+        if event_mode:
+            logger.warning(f"Event recording needs ffmpeg, camera {self.camera.name} records continuously")
+        self.recording_type = 'continuous'
+            
+        if self.recording and self.recording_thread and self.recording_thread.is_alive():
+            return
+        
+        # Let a thread that is just shutting down finish before starting a new one
+        if self.recording_thread and self.recording_thread.is_alive():
+            self.recording_thread.join(timeout=2.0)
+            
+        self.recording = True
+        self.recording_thread = threading.Thread(target=self._record_frames)
+        self.recording_thread.daemon = True
+        self.recording_thread.start()
+        
+    def _stop_recording(self):
+        """Stop recording while the stream keeps running"""
+        self.recording = False
+        if self.stream_recorder:
+            self.stream_recorder.stop()
+            self.stream_recorder = None
+            
+    def _start_detection(self):
+        """Register with the shared inference scheduler if not already registered"""
+        InferenceScheduler.get_instance().register(self)
+        
+    def reconfigure(self, camera=None):
+        """Apply changed camera settings without reopening the stream
+        
+        ROIs, confidence threshold, model and the recording/detection toggles are
+        swapped in place, so the RTSP connection and the current recording file
+        keep running. A new model is loaded in the background and replaces the
+        old one once ready; detection keeps using the old model until then.
+        
+        Args:
+            camera: Updated Camera object (if None, only ROIs are reloaded)
+        """
+        from app.utils.config_cache import detached_copy
+        
+        if camera is not None:
+            with self.config_lock:
+                self.camera = detached_copy(camera)
+                
+        regions = self._load_detection_regions()
+        
+        with self.config_lock:
+            self.detection_regions = regions
+            if camera is not None:
+                self.snapshot_options = self._load_snapshot_options()
+                self.confidence_threshold = self.camera.confidence_threshold or 0.45
+            if self.model is not None:
+                self.class_filter = self._apply_class_filter(self.model)
+                    
+        if camera is not None:
+            model_path = self._get_model_path()
+            confirm_path = self._get_confirm_model_path()
+            loads = []
+            
+            # A load already running for the requested model is not started again, and
+            # any change makes the result of a load for an older request stale
+            with self.config_lock:
+                if model_path != (self.pending_model_path or self.model_path):
+                    self.model_generation += 1
+                    self.pending_model_path = None
+                    if model_path != self.model_path:
+                        self.pending_model_path = model_path
+                        loads.append((self._swap_model, model_path, self.model_generation))
+                        
+                if confirm_path != (self.pending_confirm_path or self.confirm_model_path):
+                    self.confirm_generation += 1
+                    self.pending_confirm_path = None
+                    if confirm_path != self.confirm_model_path:
+                        self.pending_confirm_path = confirm_path
+                        loads.append((self._load_confirm_model, confirm_path, self.confirm_generation))
+                        
+            for target, path, generation in loads:
+                loader = threading.Thread(target=target, args=(path, generation))
+                loader.daemon = True
+                loader.start()
+                
+            if self.running:
+                if self.camera.recording_enabled:
+                    self._start_recording()
+                else:
+                    self._stop_recording()
+                    
+                if self.camera.detection_enabled:
+                    self._start_detection()
+                    
+        logger.info(f"Reconfigured camera: {self.camera.name}")
+        return True
+        
+    def _swap_model(self, model_path, generation):
+        """Load a new model and swap it in once it is ready
+        
+        Args:
+            model_path: Path of the new model
+            generation: model_generation when the load was requested, a newer
+                        change discards the result
+        """
+        try:
+            model = self._load_model(model_path)
+        except Exception as e:
+            logger.error(f"Failed to load YOLOv5 model {model_path}, keeping current model: {str(e)}")
+            with self.config_lock:
+                if generation == self.model_generation:
+                    self.pending_model_path = None
+            return
+            
+        with self.config_lock:
+            if generation != self.model_generation:
+                logger.info(f"Model {model_path} for camera {self.camera.name} was superseded, not switching")
+                return
+            self.class_filter = self._apply_class_filter(model)
+            self.model = model
+            self.model_path = model_path
+            self.pending_model_path = None
+            
+        logger.info(f"Switched camera {self.camera.name} to model {model_path}")
+        
     def stop(self):
         """Stop processing camera stream"""
         self.running = False
-        self.recording = False
+        self._stop_recording()
         
         if self.thread and self.thread.is_alive():
             self.thread.join(timeout=1.0)
@@ -229,12 +848,13 @@ class CameraProcessor:
         if self.recording_thread and self.recording_thread.is_alive():
             self.recording_thread.join(timeout=1.0)
             
-        if self.detection_thread and self.detection_thread.is_alive():
-            self.detection_thread.join(timeout=1.0)
+        # Waits for an inference of this camera that is still running
+        InferenceScheduler.get_instance().unregister(self.camera.id)
             
-        if self.video_writer:
-            self.video_writer.release()
-            self.video_writer = None
+        self._close_video_file()
+        
+        # Persist better frames of tracks that were still in view
+        self._persist_tracks({'appeared': [], 'updated': [], 'ended': self.tracker.flush()})
             
         if self.cap:
             self.cap.release()
@@ -269,6 +889,69 @@ class CameraProcessor:
         
         return frame
         
+    def get_current_video_path(self):
+        """Get the path of the recording file currently being written"""
+        if self.stream_recorder:
+            return self.stream_recorder.current_path
+        return self.current_video_path
+        
+    def get_video_position(self, timestamp=None):
+        """Locate a moment in the recording file currently being written
+        
+        Taken from the writer's own state: the OpenCV writer counts the frames it
+        has written at a fixed rate, the ffmpeg recorders know the wall clock
+        start of their open file.
+        
+        Returns:
+            tuple: (absolute file path, seconds into the file, frame index), parts
+                   that are unknown are None
+        """
+        timestamp = timestamp or datetime.now()
+        
+        if self.stream_recorder:
+            recorder = self.stream_recorder
+            path = recorder.current_path
+            if isinstance(recorder, EventRecorder):
+                # An event file named by a trigger is only opened on the next chunk
+                start = recorder.event_start if recorder.event_file is not None else None
+            else:
+                start = recorder.segment_start
+            if not path:
+                return None, None, None
+            offset = max(0.0, (timestamp - start).total_seconds()) if start else None
+            return os.path.abspath(path), offset, None
+        
+        path, frame_index = self.current_video_path, self.video_frame_count
+        if not path or not self.video_writer:
+            return None, None, None
+        return os.path.abspath(path), frame_index / RECORDING_FPS, frame_index
+        
+    def get_recording_stats(self):
+        """Get recording engine status and the CPU time spent on recording"""
+        if self.stream_recorder:
+            stats = self.stream_recorder.get_stats()
+        else:
+            stats = {
+                'engine': 'opencv',
+                'running': self.recording,
+                'current_path': self.current_video_path,
+                'cpu_seconds': 0
+            }
+            # Encoding happens on the recording thread, so its CPU time is the recording cost
+            thread = self.recording_thread
+            if thread and thread.is_alive() and thread.native_id:
+                try:
+                    for thread_times in psutil.Process().threads():
+                        if thread_times.id == thread.native_id:
+                            stats['cpu_seconds'] = round(thread_times.user_time + thread_times.system_time, 2)
+                            break
+                except psutil.Error:
+                    pass
+                    
+        stats['camera_id'] = self.camera.id
+        stats['camera_name'] = self.camera.name
+        return stats
+        
     def get_latest_detections(self):
         """Get the latest detections"""
         with self.detection_lock:
@@ -289,9 +972,11 @@ class CameraProcessor:
                     
                     # Try to reconnect
                     self.cap.release()
-                    self.cap = cv2.VideoCapture(self.camera.rtsp_url)
+                    self.cap = self._open_capture(self._capture_url())
                     continue
                 
+                self.frame_size = (frame.shape[1], frame.shape[0])
+                
                 # Update FPS calculation every 30 frames
                 frame_count += 1
                 if frame_count >= 30:
@@ -300,28 +985,33 @@ class CameraProcessor:
                     frame_count = 0
                     start_time = time.time()
                 
+                # Take preview tiles before the overlays are drawn
+                if self.recording:
+                    self.previews.add_frame(frame)
+                
+                # Overlays go on a copy, detection sees the camera image (motion gating
+                # would otherwise pick up the ticking clock)
+                display = frame.copy()
+                
                 # Add timestamp overlay
                 timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                cv2.putText(frame, timestamp, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 
+                cv2.putText(display, timestamp, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 
                             0.8, (0, 255, 0), 2, cv2.LINE_AA)
                 
                 # Add camera name overlay
-                cv2.putText(frame, self.camera.name, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 
+                cv2.putText(display, self.camera.name, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 
                             0.8, (0, 255, 0), 2, cv2.LINE_AA)
                 
                 # Store current frame
-                self.last_frame = frame.copy()
+                self.last_frame = display
                 
-                # Add frame to queues for processing and recording
-                try:
-                    if not self.frame_queue.full() and self.camera.detection_enabled:
-                        self.frame_queue.put(frame, block=False)
-                except queue.Full:
-                    pass
+                # Hand the newest frame to the inference scheduler and queue it for recording
+                if self.camera.detection_enabled:
+                    InferenceScheduler.get_instance().offer(self.camera.id, frame)
                     
                 try:
-                    if not self.recording_queue.full() and self.recording:
-                        self.recording_queue.put(frame, block=False)
+                    if not self.recording_queue.full() and self.recording and not self.stream_recorder:
+                        self.recording_queue.put(display, block=False)
                 except queue.Full:
                     pass
                     
@@ -329,105 +1019,144 @@ class CameraProcessor:
                 logger.error(f"Error processing frame: {str(e)}")
                 time.sleep(1)
                 
-    def _detect_objects(self):
-        """Process frames for object detection"""
-        while self.running:
-            try:
-                # Get frame from queue
-                frame = self.frame_queue.get(timeout=1.0)
+    def detect_frame(self, frame, captured_at=None):
+        """Run object detection on one frame, called by the inference scheduler
+        
+        Args:
+            frame: Camera frame without overlays
+            captured_at: Time the frame was read, used as the detection time
+        """
+        # Take a consistent view of the settings for this frame
+        with self.config_lock:
+            model = self.model
+            camera = self.camera
+            detection_regions = self.detection_regions
+            class_filter = self.class_filter
+            confirm_path = self.confirm_model_path
+        
+        # Skip detection if no regions are defined
+        if not detection_regions and not self.camera.detection_enabled:
+            return
+        
+        frame_height, frame_width = frame.shape[:2]
+        scale_x, scale_y = self._record_scale()
+        
+        # Perform inference with YOLOv5, on tiles or only around the ROIs when configured
+        grid = parse_grid(camera.inference_tiles)
+        if grid:
+            rects = self._inference_tiles(frame, detection_regions, grid, camera.tile_motion_only)
+        else:
+            rects = self._inference_crops(detection_regions, frame_width, frame_height)
+        started = time.perf_counter()
+        tables = self._run_inference(model, frame, rects)
+        self.cascade_counts['detect_seconds'] += time.perf_counter() - started
+        self.cascade_counts['frames'] += 1
+        self.cascade_counts['images'] += len(tables)
+        if confirm_path and tables:
+            self._measure_baseline(confirm_path, frame, rects)
+        
+        # Map crop and tile coordinates back to the frame
+        candidates = []
+        for index, (offset_x, offset_y, detections) in enumerate(tables):
+            for _, detection in detections.iterrows():
+                conf = float(detection['confidence'])
+                class_id = int(detection['class'])
                 
-                # Skip detection if no regions are defined
-                if not self.detection_regions and not self.camera.detection_enabled:
+                # Skip classes the camera does not detect and boxes below every threshold of the class
+                if not class_filter.allows(class_id) or conf < class_filter.min_threshold(class_id):
                     continue
-                
-                # Perform inference with YOLOv5
-                results = self.model(frame)
-                detections = results.pandas().xyxy[0]
-                
-                detected_objects = []
-                
-                # Process detection results
-                for _, detection in detections.iterrows():
-                    x1, y1, x2, y2 = int(detection['xmin']), int(detection['ymin']), int(detection['xmax']), int(detection['ymax'])
-                    conf = float(detection['confidence'])
-                    class_id = int(detection['class'])
-                    class_name = detection['name']
-                    
-                    # Skip if confidence is below threshold
-                    if conf < self.confidence_threshold:
-                        continue
-                    
-                    # Check if object center is within any region
-                    object_center = Point((x1 + x2) / 2, (y1 + y2) / 2)
-                    in_region = False
-                    roi_id = None
-                    
-                    for region in self.detection_regions:
-                        # Skip if region has class filters and this class is not included
-                        if region['classes'] and class_id not in region['classes']:
-                            continue
-                            
-                        if region['polygon'].contains(object_center):
-                            # Object is within this ROI
-                            in_region = True
-                            roi_id = region['id']
-                            break  # Only count once even if in multiple regions
-                    
-                    # If no regions defined, detect everywhere
-                    if not self.detection_regions:
-                        in_region = True
-                    
-                    if in_region or not self.detection_regions:
-                        # Add to detected objects
-                        detected_objects.append({
-                            'camera_id': self.camera.id,
-                            'class_name': class_name,  # Updated from class_id/class_name
-                            'confidence': conf,
-                            'bbox_x': x1,
-                            'bbox_y': y1,
-                            'bbox_width': x2 - x1,  # Updated from bbox_w
-                            'bbox_height': y2 - y1,  # Updated from bbox_h
-                            'roi_id': roi_id
-                        })
-                        
-                        # Draw detection rectangle on frame
-                        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                        cv2.putText(frame, f"{class_name} {conf:.2f}", (x1, y1 - 10), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-                
-                # If objects detected, save frame and send notification
-                if detected_objects:
-                    self.last_detection_time = datetime.now()
-                    
-                    # Save detection image
-                    detection_time = self.last_detection_time.strftime("%Y%m%d_%H%M%S")
-                    image_dir = os.path.join('storage', 'recordings', 'images', str(self.camera.id))
-                    os.makedirs(image_dir, exist_ok=True)
-                    image_path = os.path.join(image_dir, f"{detection_time}_{uuid.uuid4().hex[:8]}.jpg")
-                    cv2.imwrite(image_path, frame)
-                    
-                    # Set video path if we're recording
-                    video_path = self.current_video_path if self.recording else None
-                    
-                    # Add image path to detections
-                    for obj in detected_objects:
-                        obj['image_path'] = image_path
-                        obj['video_path'] = video_path
-                        obj['timestamp'] = self.last_detection_time
                     
-                    # Update current detections for API
-                    with self.detection_lock:
-                        self.current_detections = detected_objects
-                    
-                    # Report detection to API
-                    self._report_detection(detected_objects)
+                candidates.append([int(detection['xmin']) + offset_x, int(detection['ymin']) + offset_y,
+                                   int(detection['xmax']) + offset_x, int(detection['ymax']) + offset_y,
+                                   conf, class_id, detection['name'], index])
+        if grid:
+            # Objects on tile borders are found by two tiles
+            candidates = merge_detections(candidates)
+        
+        detected_objects = []
+        
+        # Process detection results
+        for x1, y1, x2, y2, conf, class_id, class_name, _ in candidates:
+            # Check if object center is within any region, in the coordinate space of each ROI
+            center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+            normalized_center = Point(center_x / frame_width, center_y / frame_height)
+            stream_center = Point(center_x * scale_x, center_y * scale_y)
+            in_region = False
+            roi_id = None
+            
+            for region in detection_regions:
+                # Skip if the region does not detect this class or the box is below the region's threshold
+                if not class_filter.allows(class_id, region['id']) or \
+                        conf < class_filter.threshold(class_id, region['id']):
+                    continue
                     
-            except queue.Empty:
-                continue
-            except Exception as e:
-                logger.error(f"Error in object detection: {str(e)}")
-                time.sleep(1)
-    
+                object_center = normalized_center if region['normalized'] else stream_center
+                if region['polygon'].contains(object_center):
+                    # Object is within this ROI
+                    in_region = True
+                    roi_id = region['id']
+                    break  # Only count once even if in multiple regions
+            
+            # If no regions defined, detect everywhere
+            if not detection_regions:
+                in_region = conf >= class_filter.threshold(class_id)
+            
+            if in_region:
+                # Add to detected objects
+                detected_objects.append({
+                    'camera_id': self.camera.id,
+                    'class_id': class_id,
+                    'class_name': class_name,  # Updated from class_id/class_name
+                    'confidence': conf,
+                    'bbox_x': x1,
+                    'bbox_y': y1,
+                    'bbox_width': x2 - x1,  # Updated from bbox_w
+                    'bbox_height': y2 - y1,  # Updated from bbox_h
+                    'roi_id': roi_id
+                })
+        
+        # Only detections the larger model agrees with are tracked and stored
+        if confirm_path and detected_objects:
+            detected_objects = self._confirm_detections(frame, detected_objects, confirm_path, class_filter)
+        
+        # Draw detection rectangles on the frame once confirmation has seen it
+        for obj in detected_objects:
+            x1, y1 = obj['bbox_x'], obj['bbox_y']
+            x2, y2 = x1 + obj['bbox_width'], y1 + obj['bbox_height']
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(frame, f"{obj['class_name']} {obj['confidence']:.2f}", (x1, y1 - 10), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        
+        # Detections are dated by their frame, which the scheduler may have held for a moment
+        now = captured_at or datetime.now()
+        if detected_objects:
+            self.last_detection_time = now
+            
+            # Start or extend an event recording before looking up the file
+            if self.recording:
+                self._trigger_event(detected_objects)
+            
+            # Locate the detection in the file being recorded
+            video_path, video_offset, frame_offset = None, None, None
+            if self.recording:
+                video_path, video_offset, frame_offset = self.get_video_position(now)
+            
+            for obj in detected_objects:
+                obj['video_path'] = video_path
+                obj['video_offset'] = video_offset
+                obj['frame_offset'] = frame_offset
+                obj['timestamp'] = now
+        
+        # Tracks are updated on empty inferences too, that is how they end
+        changes = self.tracker.update(detected_objects, frame, now)
+        
+        if detected_objects:
+            # Update current detections for API
+            with self.detection_lock:
+                self.current_detections = detected_objects
+        
+        self._persist_tracks(changes)
+        
     def _record_frames(self):
         """Record video from camera frames"""
         while self.running and self.recording:
@@ -435,9 +1164,9 @@ class CameraProcessor:
                 # Check if we need to create a new video file
                 current_time = datetime.now()
                 
-                # Create new file every hour or if no current file
+                # Create new file every clip_length seconds or if no current file
                 if (not self.video_writer or not self.video_start_time or 
-                        (current_time - self.video_start_time).total_seconds() > 3600):
+                        (current_time - self.video_start_time).total_seconds() >= self.clip_length):
                     self._rotate_video_file(current_time)
                 
                 # Get frame from queue
@@ -446,12 +1175,18 @@ class CameraProcessor:
                 # Write frame to video
                 if self.video_writer:
                     self.video_writer.write(frame)
+                    self.video_frame_count += 1
                     
             except queue.Empty:
                 continue
             except Exception as e:
                 logger.error(f"Error recording video: {str(e)}")
                 time.sleep(1)
+                
+        # Close the file if recording was switched off while the stream keeps running
+        if self.running and self.video_writer:
+            self._close_video_file()
+            logger.info(f"Stopped recording for camera: {self.camera.name}")
     
     def _rotate_video_file(self, current_time=None):
         """Create a new video file for recording"""
@@ -459,12 +1194,10 @@ class CameraProcessor:
             current_time = datetime.now()
             
         # Close current writer if exists
-        if self.video_writer:
-            self.video_writer.release()
-            self.video_writer = None
+        self._close_video_file(current_time)
         
         # Create recordings directory for this camera
-        video_dir = os.path.join('storage', 'recordings', 'videos', str(self.camera.id))
+        video_dir = self._video_dir()
         os.makedirs(video_dir, exist_ok=True)
         
         # Create video filename with timestamp
@@ -485,18 +1218,163 @@ class CameraProcessor:
         
         # Create video writer
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # Use mp4v codec
-        fps = 20.0  # Fixed recording FPS
-        self.video_writer = cv2.VideoWriter(video_path, fourcc, fps, (width, height))
+        self.video_writer = cv2.VideoWriter(video_path, fourcc, RECORDING_FPS, (width, height))
         
         # Update video information
         self.current_video_path = video_path
         self.video_start_time = current_time
+        self.video_frame_count = 0
+        open_segment(self.camera.id, video_path, current_time)
         
         logger.info(f"Created new recording file: {video_path}")
         return video_path
     
+    def _close_video_file(self, end_time=None):
+        """Close the OpenCV writer and register the finished segment"""
+        if not self.video_writer:
+            return
+            
+        self.video_writer.release()
+        self.video_writer = None
+        
+        if self.current_video_path and self.video_start_time:
+            segment_finished(self.camera.id, self.current_video_path, self.video_start_time,
+                             end_time or datetime.now(), self.video_frame_count, previews=self.previews)
+            
+    def _segment_started(self, file_path, start_time):
+        """Journal a segment opened by the stream-copy recorder"""
+        open_segment(self.camera.id, file_path, start_time, self.recording_type)
+        
+    def _segment_finished(self, file_path, start_time, end_time, source_path=None, offset_shift=None):
+        """Register a segment finished by the stream-copy recorder"""
+        if self.camera.sub_rtsp_url and not self.record_size:
+            self.record_size = self._probe_size(file_path)
+        segment_finished(self.camera.id, file_path, start_time, end_time,
+                         recording_type=self.recording_type, source_path=source_path, previews=self.previews,
+                         offset_shift=offset_shift)
+        
+    def _save_snapshot(self, frame, box):
+        """Store a detection snapshot of the object in box in the image store
+        
+        Returns:
+            str or None: Path of the JPEG (new or a recent near-duplicate), None if the writer is saturated
+        """
+        options = self.snapshot_options
+        image_path, reused = ImageStore.get_instance().store(
+            self.camera.id, frame, quality=options['quality'], max_width=options['max_width'],
+            crop=box if options['crop'] else None, region=box)
+        if image_path and not reused:
+            self.images_written += 1
+        return image_path
+        
+    def _persist_tracks(self, changes):
+        """Store track lifecycle changes: a row per new track, updates while it stays in view"""
+        def snapshot(track):
+            if track.best_frame is None:
+                return None
+            best = track.best
+            box = (best['bbox_x'], best['bbox_y'], best['bbox_width'], best['bbox_height'])
+            return self._save_snapshot(track.best_frame, box)
+        
+        new_rows = []
+        for track in changes['appeared']:
+            track.image_path = snapshot(track)
+            row = dict(self._to_record_space(track.best), track_id=track.id, image_path=track.image_path)
+            # The row keeps the time and recording position of the track's first frame
+            for key in ('timestamp', 'video_path', 'video_offset', 'frame_offset'):
+                row[key] = track.first_detection.get(key)
+            new_rows.append(row)
+            self.tracker.mark_written(track, best=track.image_path is not None)
+        
+        updates = []
+        for track in changes['updated'] + changes['ended']:
+            # The last seen time extends the track's event
+            update = {'track_id': track.id, 'last_seen': track.last_seen}
+            image_path = snapshot(track) if track.pending_best else None
+            if image_path:
+                best = self._to_record_space(track.best)
+                update.update({
+                    'confidence': best['confidence'],
+                    'bbox_x': best['bbox_x'],
+                    'bbox_y': best['bbox_y'],
+                    'bbox_width': best['bbox_width'],
+                    'bbox_height': best['bbox_height'],
+                    'image_path': image_path
+                })
+                track.image_path = image_path
+            updates.append(update)
+            # A better frame whose snapshot was dropped is offered again on the next update
+            self.tracker.mark_written(track, best=image_path is not None or not track.pending_best)
+        
+        if new_rows:
+            self._report_detection(new_rows)
+        if updates:
+            self._update_tracks(updates)
+        
+    def _update_tracks(self, updates):
+        """Point the stored rows of tracks at their better frames, releasing the old snapshots
+        
+        The write is queued on the camera's writer shard so the inference worker never waits for the commit.
+        """
+        try:
+            from app.routes.api_routes import update_track_detections
+            from app.utils.database import DatabaseWriter
+            
+            future = DatabaseWriter.get_instance().submit(
+                update_track_detections, self.camera.id, updates, timeout=0, shard=self.camera.id)
+            future.add_done_callback(self._tracks_updated)
+        except queue.Full:
+            logger.warning(f"Database writer queue full, dropped {len(updates)} track updates for camera {self.camera.id}")
+        except Exception as e:
+            logger.error(f"Error updating tracked detections: {str(e)}")
+            
+    def _tracks_updated(self, future):
+        """Count the rows of a committed track update (runs on the writer thread)"""
+        if future.exception() is not None:
+            logger.error(f"Error updating tracked detections: {str(future.exception())}")
+            return
+        self.rows_written += future.result()
+        
+    def get_detection_stats(self):
+        """Get tracker state and how much detection output was persisted"""
+        return {
+            'camera_id': self.camera.id,
+            'tracker': self.tracker.get_stats(),
+            'rows_written': self.rows_written,
+            'images_written': self.images_written,
+            'substream': bool(self.camera.sub_rtsp_url),
+            'frame_size': self.frame_size,
+            'record_size': self.record_size or self.frame_size,
+            'inference_crops': self.crop_cache[3] if self.crop_cache else None,
+            'inference_tiles': self.camera.inference_tiles,
+            'tiles_inferred': self.tiles_inferred,
+            'tiles_skipped': self.tiles_skipped,
+            'inference_pixel_ratio': round(self.inference_pixels / self.frame_pixels, 3) if self.frame_pixels else None,
+            'cascade': self._cascade_stats(),
+            'scheduling': InferenceScheduler.get_instance().camera_stats(self.camera.id),
+            'snapshot_options': self.snapshot_options
+        }
+        
+    def _trigger_event(self, detections):
+        """Start or extend an event recording if any detection passes the event filters"""
+        if not isinstance(self.stream_recorder, EventRecorder):
+            return
+            
+        for detection in detections:
+            if self.event_classes and detection['class_name'].lower() not in self.event_classes:
+                continue
+            if self.event_roi_only and detection.get('roi_id') is None:
+                continue
+            self.stream_recorder.trigger()
+            return
+        
     def _report_detection(self, detections):
-        """Report detection to the API for database storage and notifications"""
+        """Report detection to the API for database storage and notifications
+        
+        The insert is queued on the camera's writer shard and notifications are sent
+        by the DetectionNotifier once it commits, so the inference worker never waits
+        for the database or the mail server.
+        """
         try:
             from app import app
             
@@ -508,31 +1386,41 @@ class CameraProcessor:
             # Use direct database access if we're running in the same process
             # Otherwise make API call to detection endpoint
             if app:
-                # We're in the Flask app context
-                from app.routes.api_routes import report_detection
-                
-                # Create mock request with JSON payload
-                class MockRequest:
-                    def get_json(self):
-                        return payload
-                    
-                    @property
-                    def headers(self):
-                        return {'X-API-Key': app.config.get('API_KEY', '')}
+                # Route the write through the pipeline writer connection so camera
+                # threads never contend with API readers for the database lock
+                from app.routes.api_routes import store_detections
+                from app.utils.database import DatabaseWriter
                 
-                # Call the API function directly within the app context
-                with app.app_context():
-                    report_detection(MockRequest())
+                try:
+                    future = DatabaseWriter.get_instance().submit(
+                        store_detections, self.camera.id, detections, timeout=0, shard=self.camera.id)
+                except queue.Full:
+                    logger.warning(f"Database writer queue full, dropped {len(detections)} detections for camera {self.camera.id}")
+                    return
+                future.add_done_callback(self._detections_stored)
             else:
                 # Make external API call
-                api_url = f"http://localhost:8000/api/detections"
+                api_url = "http://localhost:8000/api/detections"
                 headers = {'X-API-Key': 'YOUR_API_KEY'}  # This should be properly configured
                 requests.post(api_url, json=payload, headers=headers, timeout=2.0)
-            
-            logger.info(f"Reported {len(detections)} detections for camera {self.camera.id}")
+                logger.info(f"Reported {len(detections)} detections for camera {self.camera.id}")
             
         except Exception as e:
             logger.error(f"Error reporting detection: {str(e)}")
+            
+    def _detections_stored(self, future):
+        """Count committed detections and queue their notifications (runs on the writer thread)"""
+        if future.exception() is not None:
+            logger.error(f"Error reporting detection: {str(future.exception())}")
+            return
+        
+        from app.utils.notifications import DetectionNotifier
+        
+        camera, new_detections = future.result()
+        self.rows_written += len(new_detections)
+        logger.info(f"Reported {len(new_detections)} detections for camera {self.camera.id}")
+        if camera and new_detections:
+            DetectionNotifier.get_instance().submit(camera, new_detections)
 
 # Camera Manager to handle multiple camera instances
 class CameraManager:
@@ -550,7 +1438,7 @@ class CameraManager:
     def __init__(self):
         """Initialize camera manager"""
         self.cameras = {}  # Map camera_id to CameraProcessor
-        self.lock = threading.Lock()
+        self.lock = threading.RLock()  # Re-entrant: start_camera stops an existing processor
     
     def get_camera_processor(self, camera_id):
         """Get camera processor by ID"""
@@ -570,6 +1458,13 @@ class CameraManager:
                 return True
             return False
     
+    def reconfigure_camera(self, camera_id, camera=None):
+        """Apply changed settings to a running camera without restarting it"""
+        processor = self.cameras.get(camera_id)
+        if not processor:
+            return False
+        return processor.reconfigure(camera)
+    
     def stop_camera(self, camera_id):
         """Stop processing a camera"""
         with self.lock:
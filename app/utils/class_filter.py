@@ -0,0 +1,154 @@
+"""
+Per-class detection filtering
+
+A camera can limit detection to a list of classes, each with its own
+confidence threshold (e.g. "person, car:0.6, dog:0.3"). ROIs filter classes
+too; the ROI editor stores COCO class ids, API clients may send names, and
+both are accepted everywhere. The classes a camera can report at all are the
+camera's list intersected with the union of its ROI filters. They are pushed
+into YOLOv5 (model.classes and model.conf) so other classes and boxes below
+every applicable threshold are already dropped by the model's NMS instead of
+reaching the detection loop.
+"""
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+def normalize_class(value):
+    """Get a class id as int or a class name in lower case"""
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid class {value!r}")
+    if isinstance(value, int):
+        return value
+    text = str(value).strip()
+    return int(text) if text.isdigit() else text.lower()
+
+def parse_class_list(value):
+    """Parse a class list into {class id or name: confidence threshold or None}
+
+    Accepts a list, a {class: threshold} dict, their JSON or comma separated
+    text where a class can be followed by ':threshold'.
+    """
+    if value is None or value == '':
+        return {}
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            items = {}
+            for part in value.split(','):
+                name, _, threshold = part.partition(':')
+                if name.strip():
+                    items[name] = threshold.strip() or None
+            value = items
+
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, (list, tuple, set)):
+        items = ((item, None) for item in value)
+    else:
+        items = [(value, None)]
+
+    classes = {}
+    for name, threshold in items:
+        threshold = float(threshold) if threshold is not None else None
+        if threshold is not None and not 0 <= threshold <= 1:
+            raise ValueError(f"Confidence threshold {threshold} of class {name} is not between 0 and 1")
+        classes[normalize_class(name)] = threshold
+    return classes
+
+def format_class_list(classes):
+    """Format a parsed class list as comma separated text"""
+    return ', '.join(f"{name}:{threshold:g}" if threshold is not None else str(name)
+                     for name, threshold in classes.items())
+
+def model_class_names(model):
+    """Get {class id: lower case name} of a YOLOv5 model"""
+    names = getattr(model, 'names', None) or {}
+    if isinstance(names, (list, tuple)):
+        names = dict(enumerate(names))
+    return {int(class_id): str(name).lower() for class_id, name in names.items()}
+
+class ClassFilter:
+    """Allowed classes and confidence thresholds of one camera, in the class ids of its model"""
+
+    def __init__(self, names, default_threshold, camera_classes=None, regions=()):
+        """Initialize class filter
+
+        Args:
+            names: {class id: name} of the model
+            default_threshold: Threshold of classes without their own
+            camera_classes: Parsed class list of the camera, empty for all classes
+            regions: Detection regions with a parsed 'classes' list, empty for all classes
+        """
+        self.ids = {name: class_id for class_id, name in names.items()}
+        self.default_threshold = default_threshold
+
+        camera = self._resolve(camera_classes or {})
+        self.thresholds = {class_id: threshold for class_id, threshold in camera.items() if threshold is not None}
+        allowed = set(camera) if camera_classes else None
+
+        # Region filters: per ROI id the allowed classes and their own thresholds
+        self.region_classes = {}
+        union = set()
+        for region in regions:
+            if not region['classes']:
+                union = None
+                continue
+            resolved = self._resolve(region['classes'])
+            self.region_classes[region['id']] = resolved
+            if union is not None:
+                union.update(resolved)
+        if regions and union is not None:
+            allowed = union if allowed is None else allowed & union
+        self.allowed = allowed
+
+        if allowed is not None and not allowed:
+            logger.warning("Camera and ROI class filters leave no class to detect")
+
+    def _resolve(self, classes):
+        """Map a parsed class list to the model's class ids, skipping unknown names"""
+        resolved = {}
+        for name, threshold in classes.items():
+            class_id = name if isinstance(name, int) else self.ids.get(name)
+            if class_id is None:
+                logger.warning(f"Class {name} is not known to the model and is ignored")
+                continue
+            resolved[class_id] = threshold
+        return resolved
+
+    def threshold(self, class_id, roi_id=None):
+        """Get the confidence threshold of a class, in an ROI if given"""
+        region = self.region_classes.get(roi_id, {})
+        if region.get(class_id) is not None:
+            return region[class_id]
+        return self.thresholds.get(class_id, self.default_threshold)
+
+    def min_threshold(self, class_id):
+        """Get the lowest threshold a class has in any ROI or on the camera"""
+        thresholds = [self.threshold(class_id)]
+        thresholds.extend(region[class_id] for region in self.region_classes.values()
+                          if region.get(class_id) is not None)
+        return min(thresholds)
+
+    def allows(self, class_id, roi_id=None):
+        """Check whether a class is detected on the camera, or in an ROI if given"""
+        if self.allowed is not None and class_id not in self.allowed:
+            return False
+        region = self.region_classes.get(roi_id)
+        return region is None or class_id in region
+
+    def apply(self, model):
+        """Push the allowed classes and the lowest threshold into the model's NMS"""
+        if self.allowed is None:
+            candidates = set(self.thresholds) | {class_id for region in self.region_classes.values()
+                                                 for class_id in region}
+            model.classes = None
+        else:
+            candidates = self.allowed
+            model.classes = sorted(self.allowed)
+        thresholds = [self.min_threshold(class_id) for class_id in candidates]
+        if self.allowed is None or not thresholds:
+            thresholds.append(self.default_threshold)
+        model.conf = min(thresholds)
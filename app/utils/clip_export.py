@@ -0,0 +1,354 @@
+"""
+Time-range clip export without re-encoding
+
+When a segment is registered, its keyframe index is read from the fragmented
+MP4 box headers (one moof per keyframe, the media data is skipped with a seek)
+and stored on the Recording row. An export looks up the segments overlapping
+the requested range, snaps the in point to the keyframe at or before the
+requested start, and has ffmpeg concatenate the pieces with stream copy into
+fragmented MP4 written to a pipe, so the response streams while it is being
+produced. ffmpeg seeks inside each segment, so the data read is about the
+size of the clip, not of the segments it touches.
+
+Segments without a keyframe index (MPEG-TS, plain MP4 and the OpenCV
+fallback) are probed with ffprobe, which lists the keyframe packets up to the
+requested start without decoding anything. If that is not possible the clip
+starts at the beginning of the segment, so it always starts on a keyframe.
+"""
+import os
+import json
+import struct
+import logging
+import shutil
+import tempfile
+import subprocess
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+PROBE_TIMEOUT = 30  # Seconds ffprobe may take to list a segment's keyframes
+
+class ExportError(RuntimeError):
+    """ffmpeg could not produce a clip"""
+
+def _boxes(f, start, end):
+    """Iterate over (type, position, header size, box size) of the boxes in a file range"""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size:
+            return
+        yield kind, position, header_size, size
+        position += size
+
+def _find_box(f, start, end, path):
+    """Find a nested box by its type path, returns (payload start, payload end) or None"""
+    for kind, position, header_size, size in _boxes(f, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return position + header_size, position + size
+            found = _find_box(f, position + header_size, position + size, path[1:])
+            if found:
+                return found
+    return None
+
+def _read_full_box(f, payload):
+    """Read a full box payload, returns (version, flags, body bytes)"""
+    f.seek(payload[0])
+    data = f.read(payload[1] - payload[0])
+    return data[0], int.from_bytes(data[1:4], 'big'), data[4:]
+
+def _video_timing(f, moov):
+    """Get the video track's timescale and edit list media time from the moov box
+
+    The media time is None without an edit list, players then start the
+    timeline at the first sample's composition time.
+    """
+    for kind, position, header_size, size in _boxes(f, moov[0], moov[1]):
+        if kind != b'trak':
+            continue
+        trak = (position + header_size, position + size)
+
+        handler = _find_box(f, trak[0], trak[1], [b'mdia', b'hdlr'])
+        if not handler or _read_full_box(f, handler)[2][4:8] != b'vide':
+            continue
+
+        version, _, body = _read_full_box(f, _find_box(f, trak[0], trak[1], [b'mdia', b'mdhd']))
+        timescale = struct.unpack('>I', body[16:20] if version == 1 else body[8:12])[0]
+
+        # An edit list shifts presentation times, as applied by players and ffmpeg
+        media_time = None
+        edit_list = _find_box(f, trak[0], trak[1], [b'edts', b'elst'])
+        if edit_list:
+            version, _, body = _read_full_box(f, edit_list)
+            if struct.unpack('>I', body[:4])[0] > 0:
+                media_time = struct.unpack('>q', body[12:20])[0] if version == 1 else \
+                    struct.unpack('>i', body[8:12])[0]
+                media_time = max(0, media_time)
+
+        return timescale, media_time
+    return None, None
+
+def _fragment_start(f, moof):
+    """Get the decode time and first sample composition offset of a movie fragment"""
+    traf = _find_box(f, moof[0], moof[1], [b'traf'])
+    if not traf:
+        return None, 0
+
+    tfdt = _find_box(f, traf[0], traf[1], [b'tfdt'])
+    if not tfdt:
+        return None, 0
+    version, _, body = _read_full_box(f, tfdt)
+    decode_time = struct.unpack('>Q', body[:8])[0] if version == 1 else struct.unpack('>I', body[:4])[0]
+
+    composition_offset = 0
+    trun = _find_box(f, traf[0], traf[1], [b'trun'])
+    if trun:
+        version, flags, body = _read_full_box(f, trun)
+        if flags & 0x800 and struct.unpack('>I', body[:4])[0] > 0:
+            # Skip sample_count, then optional data_offset and first_sample_flags
+            position = 4 + (4 if flags & 0x1 else 0) + (4 if flags & 0x4 else 0)
+            # Per-sample fields before the composition offset: duration, size, flags
+            position += 4 * sum(1 for bit in (0x100, 0x200, 0x400) if flags & bit)
+            composition_offset = struct.unpack('>i' if version == 1 else '>I', body[position:position + 4])[0]
+
+    return decode_time, composition_offset
+
+def index_segment(file_path):
+    """Build the keyframe index of a fragmented MP4 segment from its box headers
+
+    Fragments are written with frag_keyframe, so every moof starts with a
+    keyframe. Only box headers and the small moov/moof boxes are read.
+
+    Returns:
+        list: [presentation time in seconds, byte offset of the moof] per keyframe,
+              None if the file is not a readable fragmented MP4
+    """
+    if not file_path.endswith('.mp4'):
+        return None
+
+    try:
+        size = os.path.getsize(file_path)
+        keyframes = []
+        with open(file_path, 'rb') as f:
+            timescale, media_time = None, None
+            for kind, position, header_size, box_size in _boxes(f, 0, size):
+                if kind == b'moov':
+                    timescale, media_time = _video_timing(f, (position + header_size, position + box_size))
+                elif kind == b'moof' and timescale:
+                    decode_time, composition_offset = _fragment_start(f, (position + header_size, position + box_size))
+                    if decode_time is not None:
+                        if media_time is None:
+                            media_time = decode_time + composition_offset
+                        pts = (decode_time + composition_offset - media_time) / timescale
+                        keyframes.append([round(pts, 3), position])
+        return keyframes or None
+    except Exception as e:
+        logger.error(f"Error indexing segment {file_path}: {str(e)}")
+        return None
+
+def keyframe_before(keyframes, offset):
+    """Get the time of the last keyframe at or before an offset into the segment"""
+    best = None
+    for pts, _ in keyframes or []:
+        if pts <= offset + 0.001:
+            best = pts
+        else:
+            break
+    return best
+
+def find_ffprobe(ffmpeg_path='ffmpeg'):
+    """Get the ffprobe binary next to ffmpeg, or from PATH"""
+    from app.utils.stream_recorder import find_ffmpeg
+
+    ffmpeg = find_ffmpeg(ffmpeg_path)
+    if ffmpeg:
+        name = 'ffprobe.exe' if ffmpeg.endswith('.exe') else 'ffprobe'
+        ffprobe = shutil.which(os.path.join(os.path.dirname(ffmpeg), name))
+        if ffprobe:
+            return ffprobe
+    return shutil.which('ffprobe')
+
+def probe_keyframes(file_path, until, ffprobe):
+    """List the video keyframes of a segment without an index
+
+    Only packet headers up to until seconds into the file are read, nothing is decoded.
+
+    Returns:
+        tuple: (file start time, [time relative to the start, None] per keyframe, shaped
+               like the keyframe index) or None on failure
+    """
+    command = [ffprobe, '-v', 'error', '-select_streams', 'v:0',
+               '-read_intervals', f'%+{until + 1:.3f}',
+               '-show_entries', 'format=start_time:packet=pts_time,flags',
+               '-of', 'json', file_path]
+    try:
+        result = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True, timeout=PROBE_TIMEOUT)
+        if result.returncode != 0:
+            logger.warning(f"Could not probe keyframes of {file_path}: "
+                           f"{result.stderr.decode('utf-8', errors='replace').strip()}")
+            return None
+        info = json.loads(result.stdout or b'{}')
+    except Exception as e:
+        logger.warning(f"Could not probe keyframes of {file_path}: {str(e)}")
+        return None
+
+    packets = [packet for packet in info.get('packets', []) if packet.get('pts_time') not in (None, 'N/A')]
+    start_time = info.get('format', {}).get('start_time')
+    if start_time in (None, 'N/A'):
+        start_time = float(packets[0]['pts_time']) if packets else 0.0
+    start_time = float(start_time)
+
+    keyframes = sorted([round(float(packet['pts_time']) - start_time, 3), None]
+                       for packet in packets if 'K' in packet.get('flags', ''))
+    return start_time, keyframes
+
+def plan_export(segments, start, end, ffmpeg_path='ffmpeg'):
+    """Work out which part of every segment goes into a clip
+
+    Args:
+        segments: (Recording, readable local file path) of one camera, ordered by timestamp
+        start: Requested clip start
+        end: Requested clip end
+        ffmpeg_path: ffmpeg binary name or path, ffprobe is looked up next to it
+
+    Returns:
+        tuple: (list of (file path, inpoint seconds or None, outpoint seconds or None),
+                actual clip start datetime)
+    """
+    parts = []
+    clip_start = None
+    ffprobe = None
+    for recording, path in segments:
+        segment_start = recording.timestamp
+        segment_end = segment_start + timedelta(seconds=recording.duration or 0)
+        if segment_end <= start or segment_start >= end:
+            continue
+
+        offset = (start - segment_start).total_seconds() if start > segment_start else None
+        outpoint = (end - segment_start).total_seconds() if end < segment_end else None
+
+        # ffmpeg reads in and out points in the file's own timestamps
+        file_start = 0.0
+        keyframes = json.loads(recording.keyframe_index) if recording.keyframe_index else None
+        if keyframes is None and (offset is not None or outpoint is not None):
+            ffprobe = ffprobe or find_ffprobe(ffmpeg_path)
+            probed = probe_keyframes(path, offset or 0.0, ffprobe) if ffprobe else None
+            if probed:
+                file_start, keyframes = probed
+            elif offset is not None:
+                logger.warning(f"No keyframe times for {path}, exporting it from its start")
+
+        inpoint = None
+        first_part_start = segment_start
+        if offset is not None:
+            # Starting exactly on a keyframe keeps frames before the range out of the
+            # clip, and stream copy can only start on one
+            inpoint = keyframe_before(keyframes, offset)
+            if inpoint is not None:
+                first_part_start = segment_start + timedelta(seconds=inpoint)
+                inpoint += file_start
+
+        if outpoint is not None:
+            outpoint += file_start
+
+        if clip_start is None:
+            clip_start = first_part_start
+        parts.append((path, inpoint, outpoint))
+
+    return parts, clip_start
+
+def _concat_line(path):
+    """Quote a path for an ffmpeg concat list"""
+    return "file '" + path.replace("'", "'\\''") + "'"
+
+def stream_export(parts, ffmpeg_path='ffmpeg'):
+    """Start ffmpeg on a clip and wait for its first bytes
+
+    Nothing has been sent to the client yet when this returns or raises, so a
+    failing export can still be answered with an error status.
+
+    Returns:
+        generator: The bytes of the clip as ffmpeg produces them; the ffmpeg
+            process is killed if the client disconnects
+
+    Raises:
+        ExportError: If ffmpeg is missing or fails before producing any output
+    """
+    from app.utils.stream_recorder import find_ffmpeg
+
+    ffmpeg = find_ffmpeg(ffmpeg_path)
+    if not ffmpeg:
+        raise ExportError("ffmpeg not found")
+
+    fd, list_path = tempfile.mkstemp(prefix='export_', suffix='.txt')
+    with os.fdopen(fd, 'w') as f:
+        f.write("ffconcat version 1.0\n")
+        for path, inpoint, outpoint in parts:
+            f.write(_concat_line(os.path.abspath(path)) + "\n")
+            if inpoint is not None:
+                f.write(f"inpoint {inpoint:.3f}\n")
+            if outpoint is not None:
+                f.write(f"outpoint {outpoint:.3f}\n")
+
+    command = [ffmpeg, '-hide_banner', '-nostdin', '-loglevel', 'error',
+               '-f', 'concat', '-safe', '0', '-i', list_path,
+               '-map', '0:v:0', '-c', 'copy',
+               '-avoid_negative_ts', 'make_zero',
+               # Fragmented output can be written to a pipe and played while downloading
+               '-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+               '-f', 'mp4', 'pipe:1']
+
+    # Errors go to a file: a stderr pipe nobody reads until stdout ends could fill up and stall ffmpeg
+    errors = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=errors)
+
+    def error_message():
+        errors.seek(0)
+        return errors.read().decode('utf-8', errors='replace').strip() or f"ffmpeg exited with {process.returncode}"
+
+    def cleanup():
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        errors.close()
+        os.remove(list_path)
+
+    try:
+        first_chunk = process.stdout.read(EXPORT_CHUNK_SIZE)
+        # A short first read means ffmpeg is done, its exit status decides the response
+        if len(first_chunk) < EXPORT_CHUNK_SIZE and process.wait() != 0:
+            raise ExportError(error_message())
+        if not first_chunk:
+            raise ExportError("ffmpeg produced no output")
+    except BaseException:
+        cleanup()
+        raise
+
+    def generate():
+        try:
+            chunk = first_chunk
+            while chunk:
+                yield chunk
+                chunk = process.stdout.read(EXPORT_CHUNK_SIZE)
+            if process.wait() != 0:
+                message = error_message()
+                logger.error(f"Clip export failed: {message}")
+                # Raising aborts the response instead of ending a truncated clip as if it were complete
+                raise ExportError(message)
+        finally:
+            cleanup()
+
+    return generate()
@@ -0,0 +1,266 @@
+"""
+Process-wide cache for nearly static configuration: cameras, ROIs, users and API keys
+
+Cached rows are kept as detached copies and re-attached to the caller's session
+with ``merge(load=False)``, which issues no SQL. Mutation routes call
+``invalidate()``, which clears the local cache and bumps the shared
+``config_version`` row; other worker processes notice the new version within
+CONFIG_CACHE_CHECK_INTERVAL seconds and drop their caches too.
+"""
+import time
+import logging
+import threading
+from datetime import datetime
+
+from flask import abort
+from sqlalchemy.orm import make_transient_to_detached
+
+logger = logging.getLogger(__name__)
+
+CACHE_KINDS = ('camera', 'roi', 'user', 'api_key')
+
+def detached_copy(obj):
+    """Copy a loaded row into a detached instance that can be merged without SQL"""
+    mapper = obj.__mapper__
+    copy = mapper.class_(**{attr.key: getattr(obj, attr.key) for attr in mapper.column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+class ConfigCache:
+    """Cache cameras, ROIs, users and API keys with version-based invalidation"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """Get singleton instance"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from app import app
+                    cls._instance = ConfigCache(app.config.get('CONFIG_CACHE_CHECK_INTERVAL', 2.0))
+        return cls._instance
+
+    def __init__(self, check_interval=2.0):
+        """Initialize config cache
+
+        Args:
+            check_interval: Seconds between reads of the shared version counter
+        """
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.version = None
+        self.last_check = 0
+        self.enabled = True
+        self.cameras = {}  # camera_id -> Camera
+        self.rois = {}  # camera_id -> [ROI]
+        self.users = {}  # user_id -> User
+        self.api_keys = {}  # api_key -> user_id
+        self.hits = {kind: 0 for kind in CACHE_KINDS}
+        self.misses = {kind: 0 for kind in CACHE_KINDS}
+        self.invalidations = 0
+        self.generation = 0  # Bumped on every clear so loads racing an invalidation are not stored
+
+    def check_schema(self, engine):
+        """Disable the cache if the config_version table has not been created yet"""
+        from sqlalchemy import inspect
+
+        if not inspect(engine).has_table('config_version'):
+            logger.warning("config_version table missing, run add_config_version_table.py to enable the config cache")
+            self.enabled = False
+        return self.enabled
+
+    def _clear(self):
+        """Drop all cached entries"""
+        with self.lock:
+            self.generation += 1
+            self.cameras.clear()
+            self.rois.clear()
+            self.users.clear()
+            self.api_keys.clear()
+
+    def _sync(self, session):
+        """Drop local entries if another process bumped the config version"""
+        now = time.time()
+        if now - self.last_check < self.check_interval:
+            return
+        self.last_check = now
+
+        if not self.enabled:
+            return
+
+        from app.models.config_version import ConfigVersion
+        try:
+            row = session.get(ConfigVersion, 1, populate_existing=True)
+            version = row.version if row else 0
+        except Exception as e:
+            # Without a shared version the cache cannot stay correct across processes
+            logger.warning(f"Config cache disabled, cannot read config version: {str(e)}")
+            self.enabled = False
+            self._clear()
+            return
+
+        if version != self.version:
+            self._clear()
+            self.version = version
+
+    def _record(self, kind, hit):
+        if hit:
+            self.hits[kind] += 1
+        else:
+            self.misses[kind] += 1
+
+    def get_camera(self, camera_id, session=None):
+        """Get a camera attached to the given session (db.session by default)"""
+        from app import db
+        from app.models.camera import Camera
+
+        session = session or db.session
+        self._sync(session)
+
+        cached = self.cameras.get(camera_id)
+        self._record('camera', cached is not None)
+        if cached is not None:
+            return session.merge(cached, load=False)
+
+        generation = self.generation
+        camera = session.get(Camera, camera_id)
+        if camera is not None and self.enabled:
+            with self.lock:
+                if generation == self.generation:
+                    self.cameras[camera_id] = detached_copy(camera)
+        return camera
+
+    def get_camera_or_404(self, camera_id):
+        """Get a camera from the cache or abort with 404"""
+        camera = self.get_camera(camera_id)
+        if camera is None:
+            abort(404)
+        return camera
+
+    def get_rois(self, camera_id, session=None):
+        """Get the ROIs of a camera as read-only detached instances"""
+        from app import db
+        from app.models.roi import ROI
+
+        session = session or db.session
+        self._sync(session)
+
+        cached = self.rois.get(camera_id)
+        self._record('roi', cached is not None)
+        if cached is not None:
+            return list(cached)
+
+        generation = self.generation
+        rois = [detached_copy(roi) for roi in session.query(ROI).filter_by(camera_id=camera_id).all()]
+        if self.enabled:
+            with self.lock:
+                if generation == self.generation:
+                    self.rois[camera_id] = rois
+        return list(rois)
+
+    def get_user(self, user_id, session=None):
+        """Get a user attached to the given session (db.session by default)"""
+        from app import db
+        from app.models.user import User
+
+        session = session or db.session
+        self._sync(session)
+
+        cached = self.users.get(user_id)
+        self._record('user', cached is not None)
+        if cached is not None:
+            return session.merge(cached, load=False)
+
+        generation = self.generation
+        user = session.get(User, user_id)
+        if user is not None and self.enabled:
+            with self.lock:
+                if generation == self.generation:
+                    self.users[user_id] = detached_copy(user)
+        return user
+
+    def get_user_by_api_key(self, api_key, session=None):
+        """Get the active user owning an API key, or None"""
+        from app import db
+        from app.models.user import User
+
+        session = session or db.session
+        self._sync(session)
+
+        user_id = self.api_keys.get(api_key)
+        self._record('api_key', user_id is not None)
+        if user_id is not None:
+            user = self.get_user(user_id, session)
+            # The key must still belong to an active user, otherwise look it up again
+            if user is not None and user.is_active and user.api_key == api_key:
+                return user
+            with self.lock:
+                self.api_keys.pop(api_key, None)
+
+        generation = self.generation
+        user = session.query(User).filter_by(api_key=api_key, is_active=True).first()
+        if user is not None and self.enabled:
+            with self.lock:
+                if generation == self.generation:
+                    self.api_keys[api_key] = user.id
+                    self.users[user.id] = detached_copy(user)
+        return user
+
+    def invalidate(self, session=None):
+        """Drop cached configuration in this and every other process
+
+        Call after committing a change to cameras, ROIs or users.
+        """
+        from app import db
+        from app.models.config_version import ConfigVersion
+
+        session = session or db.session
+        self._clear()
+        self.invalidations += 1
+
+        try:
+            # One atomic increment, so concurrent invalidations in two processes never
+            # both write the same version; the row is locked until the commit, so the
+            # value read back is this process's own
+            updated = session.query(ConfigVersion).filter(ConfigVersion.id == 1).update(
+                {ConfigVersion.version: ConfigVersion.version + 1, ConfigVersion.updated_at: datetime.utcnow()},
+                synchronize_session=False)
+            if updated:
+                version = session.query(ConfigVersion.version).filter(ConfigVersion.id == 1).scalar()
+            session.commit()
+            if updated:
+                self.version = version
+            else:
+                logger.warning("config_version row missing, run add_config_version_table.py")
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error bumping config version: {str(e)}")
+
+        # Let camera processors pick up the change right away
+        self.last_check = 0
+
+    def get_stats(self):
+        """Get hit rates per cached kind"""
+        stats = {}
+        for kind in CACHE_KINDS:
+            total = self.hits[kind] + self.misses[kind]
+            stats[kind] = {
+                'hits': self.hits[kind],
+                'misses': self.misses[kind],
+                'hit_rate': round(self.hits[kind] / total, 4) if total else 0
+            }
+
+        return {
+            'enabled': self.enabled,
+            'version': self.version,
+            'invalidations': self.invalidations,
+            'entries': {
+                'camera': len(self.cameras),
+                'roi': len(self.rois),
+                'user': len(self.users),
+                'api_key': len(self.api_keys)
+            },
+            'kinds': stats
+        }
@@ -0,0 +1,343 @@
+"""
+Database engine layer for SmartNVR
+
+Tunes SQLite connections (WAL journal, relaxed fsync, larger page cache and
+memory map), sizes the connection pools used by the web API and runs the
+writer threads that own dedicated connections for camera pipeline writes.
+SQLite deployments always get exactly one writer; server databases such as
+PostgreSQL can use several.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import sessionmaker
+
+logger = logging.getLogger(__name__)
+
+# PRAGMA values applied to every new SQLite connection (set by configure_database)
+_sqlite_pragmas = {
+    'wal': True,
+    'synchronous': 'NORMAL',
+    'cache_size_kb': 64 * 1024,
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout_ms': 10000,
+}
+
+def normalize_database_uri(uri):
+    """Map legacy URI schemes to the names SQLAlchemy understands"""
+    if uri.startswith('postgres://'):
+        return 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+def is_sqlite_uri(uri):
+    """Check whether a database URI points to SQLite"""
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+def sqlite_file_path(uri):
+    """Get the database file path of a SQLite URI, or None for in-memory databases"""
+    url = make_url(uri)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    return url.database
+
+def engine_options(config):
+    """Build SQLALCHEMY_ENGINE_OPTIONS for the reader pool used by Flask request threads"""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if not is_sqlite_uri(uri):
+        # Server database: size the pool for web threads plus camera-side reads
+        return {
+            'pool_size': config.get('DB_READER_POOL_SIZE', 10),
+            'max_overflow': config.get('DB_READER_MAX_OVERFLOW', 10),
+            'pool_timeout': 30,
+            'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+            'pool_pre_ping': True
+        }
+
+    if sqlite_file_path(uri) is None:
+        # In-memory databases use a singleton pool and cannot be shared between threads
+        return {}
+
+    return {
+        'pool_size': config.get('DB_READER_POOL_SIZE', 10),
+        'max_overflow': config.get('DB_READER_MAX_OVERFLOW', 10),
+        'pool_timeout': 30,
+        'connect_args': {
+            'check_same_thread': False,
+            'timeout': config.get('SQLITE_BUSY_TIMEOUT_MS', 10000) / 1000.0
+        }
+    }
+
+def writer_engine_options(uri, writer_threads=1, busy_timeout_ms=10000, pool_recycle=1800):
+    """Build engine options for the dedicated writer connections"""
+    if is_sqlite_uri(uri) and sqlite_file_path(uri) is None:
+        return {}
+
+    options = {
+        'pool_size': writer_threads,
+        'max_overflow': 0,
+    }
+    if is_sqlite_uri(uri):
+        options['connect_args'] = {
+            'check_same_thread': False,
+            'timeout': busy_timeout_ms / 1000.0
+        }
+    else:
+        options['pool_recycle'] = pool_recycle
+        options['pool_pre_ping'] = True
+    return options
+
+def configure_database(app):
+    """Apply database tuning from the app config; call before creating SQLAlchemy(app)"""
+    uri = normalize_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    
+    if is_sqlite_uri(uri):
+        # SQLite allows one writer at a time, more writer threads only add lock waits
+        app.config['DB_WRITER_THREADS'] = 1
+    
+    _sqlite_pragmas.update({
+        'wal': app.config.get('SQLITE_WAL_MODE', True),
+        'synchronous': app.config.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'cache_size_kb': app.config.get('SQLITE_CACHE_SIZE_KB', 64 * 1024),
+        'mmap_size': app.config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'busy_timeout_ms': app.config.get('SQLITE_BUSY_TIMEOUT_MS', 10000),
+    })
+
+    if 'SQLALCHEMY_ENGINE_OPTIONS' not in app.config:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+
+@event.listens_for(Engine, 'connect')
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune each new SQLite connection as it is opened"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    cursor = dbapi_connection.cursor()
+    try:
+        if _sqlite_pragmas['wal']:
+            # Readers no longer block the writer and vice versa
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={_sqlite_pragmas['synchronous']}")
+        cursor.execute(f"PRAGMA cache_size=-{int(_sqlite_pragmas['cache_size_kb'])}")
+        cursor.execute(f"PRAGMA mmap_size={int(_sqlite_pragmas['mmap_size'])}")
+        cursor.execute(f"PRAGMA busy_timeout={int(_sqlite_pragmas['busy_timeout_ms'])}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    except Exception as e:
+        logger.error(f"Error applying SQLite pragmas: {str(e)}")
+    finally:
+        cursor.close()
+
+def insert_many(session, model, rows):
+    """Insert rows of one model as a single batched statement
+
+    Uses executemany with RETURNING (batched multi-row VALUES on PostgreSQL and
+    recent SQLite) so the caller still gets ORM objects with their IDs, sorted
+    back into the order of rows (PostgreSQL may return a batch in any order).
+    Falls back to a regular unit-of-work flush on backends without that support.
+
+    Args:
+        session: SQLAlchemy session
+        model: Mapped model class
+        rows: List of column dictionaries
+
+    Returns:
+        list: New model instances in the order of rows
+    """
+    if not rows:
+        return []
+
+    dialect = session.get_bind().dialect
+    if getattr(dialect, 'insert_executemany_returning_sort_by_parameter_order', False):
+        return list(session.scalars(insert(model).returning(model, sort_by_parameter_order=True), rows))
+
+    objects = [model(**row) for row in rows]
+    session.add_all(objects)
+    session.flush()
+    return objects
+
+class DatabaseWriter:
+    """Serialize camera pipeline writes through dedicated database connections
+
+    Jobs are callables taking a SQLAlchemy session as first argument. Every
+    writer thread has its own queue; jobs submitted with the same shard (the
+    camera ID) always go to the same thread, so they commit in the order they
+    were submitted, e.g. a segment's recording row is never registered while
+    detections recorded into it are still being inserted by another thread.
+    Pending jobs of a thread are grouped into one transaction (group commit)
+    and each job's return value is delivered through a Future. If a grouped transaction fails, its
+    jobs are retried one by one so a bad job only fails itself. Objects returned
+    by a job stay usable after the commit because writer sessions do not expire
+    them.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """Get singleton instance"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from app import app
+                    cls._instance = DatabaseWriter(
+                        app.config['SQLALCHEMY_DATABASE_URI'],
+                        threads=app.config.get('DB_WRITER_THREADS', 1),
+                        batch_size=app.config.get('DB_WRITER_BATCH_SIZE', 50),
+                        queue_size=app.config.get('DB_WRITER_QUEUE_SIZE', 1000),
+                        busy_timeout_ms=app.config.get('SQLITE_BUSY_TIMEOUT_MS', 10000),
+                        pool_recycle=app.config.get('DB_POOL_RECYCLE', 1800)
+                    )
+        return cls._instance
+
+    def __init__(self, uri, threads=1, batch_size=50, queue_size=1000,
+                 busy_timeout_ms=10000, pool_recycle=1800):
+        """Initialize database writer
+
+        Args:
+            uri: Database URI to open the writer connections on
+            threads: Number of writer threads (forced to 1 for SQLite)
+            batch_size: Maximum number of jobs grouped into one commit
+            queue_size: Maximum number of pending write jobs per writer thread
+            busy_timeout_ms: How long SQLite waits on a locked database
+            pool_recycle: Connection recycle time for server databases
+        """
+        uri = normalize_database_uri(uri)
+        self.threads = 1 if is_sqlite_uri(uri) else max(1, threads)
+        self.batch_size = max(1, batch_size)
+        self.engine = create_engine(uri, **writer_engine_options(
+            uri, self.threads, busy_timeout_ms, pool_recycle))
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(self.threads)]
+        self.next_queue = 0  # Unsharded jobs are spread round-robin
+        self.running = False
+        self.workers = []
+        self.lock = threading.Lock()
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.commits = 0
+
+    def start(self):
+        """Start the writer threads"""
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.workers = []
+            for i in range(self.threads):
+                worker = threading.Thread(target=self._process_jobs, args=(self.queues[i],), name=f'db-writer-{i}')
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+        logger.info(f"Started database writer with {self.threads} thread(s)")
+        return True
+
+    def stop(self, timeout=5.0):
+        """Stop the writer threads after draining pending jobs"""
+        self.running = False
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.join(timeout=timeout)
+        self.engine.dispose()
+        logger.info("Stopped database writer")
+        return True
+
+    def submit(self, func, *args, timeout=5.0, shard=None, **kwargs):
+        """Queue a write job
+
+        Args:
+            func: Callable invoked as func(session, *args, **kwargs)
+            timeout: Seconds to wait for room in the queue
+            shard: Jobs with the same shard (e.g. a camera ID) run on the same thread, in order
+
+        Returns:
+            Future: Resolves to the job's return value once committed
+        """
+        if not self.running:
+            self.start()
+
+        if shard is None:
+            with self.lock:
+                index = self.next_queue
+                self.next_queue = (index + 1) % self.threads
+        else:
+            index = hash(shard) % self.threads
+
+        future = Future()
+        self.queues[index].put((func, args, kwargs, future), timeout=timeout)
+        return future
+
+    def execute(self, func, *args, timeout=10.0, shard=None, **kwargs):
+        """Queue a write job and wait for its result"""
+        return self.submit(func, *args, shard=shard, **kwargs).result(timeout=timeout)
+
+    def get_stats(self):
+        """Get writer statistics"""
+        return {
+            'running': self.running,
+            'threads': self.threads,
+            'pending': sum(jobs.qsize() for jobs in self.queues),
+            'completed': self.jobs_completed,
+            'failed': self.jobs_failed,
+            'commits': self.commits,
+            'jobs_per_commit': round(self.jobs_completed / self.commits, 2) if self.commits else 0
+        }
+
+    def _next_batch(self, jobs):
+        """Wait for one job, then take whatever else is already queued up to batch_size"""
+        try:
+            batch = [jobs.get(timeout=1.0)]
+        except queue.Empty:
+            return []
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(jobs.get_nowait())
+            except queue.Empty:
+                break
+
+        return [job for job in batch if job[3].set_running_or_notify_cancel()]
+
+    def _process_jobs(self, jobs):
+        """Writer loop, drains the thread's queue before exiting"""
+        while self.running or not jobs.empty():
+            batch = self._next_batch(jobs)
+            if not batch:
+                continue
+
+            if len(batch) == 1 or not self._commit_batch(batch):
+                for job in batch:
+                    self._commit_batch([job], isolated=True)
+
+    def _commit_batch(self, batch, isolated=False):
+        """Run jobs in one transaction
+
+        Returns:
+            bool: True if committed; on failure the futures are only failed when isolated
+        """
+        session = self.Session()
+        try:
+            results = [func(session, *args, **kwargs) for func, args, kwargs, _ in batch]
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            if isolated:
+                with self.lock:
+                    self.jobs_failed += 1
+                logger.error(f"Database write failed: {str(e)}")
+                batch[0][3].set_exception(e)
+            return False
+        finally:
+            session.close()
+
+        with self.lock:
+            self.commits += 1
+            self.jobs_completed += len(batch)
+        for (_, _, _, future), result in zip(batch, results):
+            future.set_result(result)
+        return True
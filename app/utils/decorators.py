@@ -1,7 +1,7 @@
 from functools import wraps
 from flask import flash, redirect, url_for, request, jsonify
 from flask_login import current_user
-from app.models import User
+from app.utils.config_cache import ConfigCache
 
 def admin_required(f):
     """Decorator for routes that require admin privileges"""
@@ -21,7 +21,7 @@ def api_key_required(f):
         if not api_key:
             return jsonify({'error': 'No API key provided'}), 401
             
-        user = User.query.filter_by(api_key=api_key, is_active=True).first()
+        user = ConfigCache.get_instance().get_user_by_api_key(api_key)
         if not user:
             return jsonify({'error': 'Invalid API key'}), 401
             
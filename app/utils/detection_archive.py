@@ -0,0 +1,486 @@
+"""
+Time-partitioned detection storage
+
+Detections are partitioned by calendar month. Recent months live in the
+indexed ``detection`` table; months older than DETECTION_ARCHIVE_AFTER_DAYS are
+compacted into one columnar file per month under storage/archive/detections
+(Parquet when pyarrow is installed, compressed NumPy columns otherwise) and
+removed from the database. A manifest records which months are archived and
+their row counts per day, camera and class, so counting needs no archive files
+and queries only open the files their page of results reaches. Within a file
+the time, camera and class filters are applied while reading (Parquet
+predicate pushdown, or vectorized over the filter columns of NumPy archives),
+and only the rows of the requested page are converted to Python values.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    has_pyarrow = True
+except ImportError:
+    has_pyarrow = False
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+EXPORT_CHUNK_SIZE = 5000
+
+_manifest_lock = threading.Lock()
+
+def partition_key(timestamp):
+    """Get the monthly partition key (YYYY-MM) for a timestamp"""
+    return timestamp.strftime('%Y-%m')
+
+def partition_bounds(key):
+    """Get the [start, end) datetimes covered by a monthly partition"""
+    start = datetime.strptime(key, '%Y-%m')
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start, end
+
+def _archive_folder():
+    from app import app
+    return app.config.get('DETECTION_ARCHIVE_FOLDER', os.path.join('storage', 'archive', 'detections'))
+
+def load_manifest(folder=None):
+    """Load the archive manifest mapping partition keys to archive files"""
+    folder = folder or _archive_folder()
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"Error loading detection archive manifest: {str(e)}")
+        return {}
+
+def _save_manifest(manifest, folder):
+    """Write the manifest atomically"""
+    os.makedirs(folder, exist_ok=True)
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def archive_horizon(manifest=None):
+    """Get the end of the newest archived partition (older data lives in archives only)"""
+    manifest = load_manifest() if manifest is None else manifest
+    if not manifest:
+        return None
+    return max(partition_bounds(key)[1] for key in manifest)
+
+def _detection_columns():
+    """Get (name, kind) for every detection column, kind is one of datetime/int/float/bool/str"""
+    from app.models.detection import Detection
+
+    columns = []
+    for column in Detection.__table__.columns:
+        python_type = column.type.python_type
+        if python_type is datetime:
+            kind = 'datetime'
+        elif python_type is bool:
+            kind = 'bool'
+        elif python_type is int:
+            kind = 'int'
+        elif python_type is float:
+            kind = 'float'
+        else:
+            kind = 'str'
+        columns.append((column.name, kind))
+    return columns
+
+def _to_numpy(values, kind):
+    """Convert a list of column values to a NumPy array without object dtype"""
+    if kind == 'datetime':
+        return np.array([v if v is not None else 'NaT' for v in values], dtype='datetime64[us]')
+    if kind in ('int', 'float'):
+        return np.array([v if v is not None else np.nan for v in values], dtype=np.float64)
+    if kind == 'bool':
+        return np.array([-1 if v is None else int(bool(v)) for v in values], dtype=np.int8)
+    return np.array(['' if v is None else str(v) for v in values], dtype=str)
+
+def _from_numpy(value, kind):
+    """Convert one archived NumPy value back to a Python value"""
+    if kind == 'datetime':
+        return None if np.isnat(value) else value.astype('datetime64[us]').item()
+    if kind == 'int':
+        return None if np.isnan(value) else int(value)
+    if kind == 'float':
+        return None if np.isnan(value) else float(value)
+    if kind == 'bool':
+        return None if value < 0 else bool(value)
+    return str(value) or None
+
+def _write_partition(path, columns, data):
+    """Write column data to an archive file atomically"""
+    tmp_path = path + '.tmp'
+    if has_pyarrow:
+        # Sorted row groups let time filters skip most of a file from its statistics
+        table = pa.table({name: data[name] for name, _ in columns}).sort_by('timestamp')
+        pq.write_table(table, tmp_path, compression='zstd', row_group_size=EXPORT_CHUNK_SIZE)
+    else:
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **{name: _to_numpy(data[name], kind) for name, kind in columns})
+    os.replace(tmp_path, path)
+
+def _read_partition(path, columns):
+    """Read an archive file back into a dict of Python value lists"""
+    if path.endswith('.parquet'):
+        table = pq.read_table(path)
+        return {name: table.column(name).to_pylist() if name in table.column_names else [None] * table.num_rows
+                for name, _ in columns}
+
+    with np.load(path) as archive:
+        rows = len(archive[columns[0][0]])
+        return {name: [_from_numpy(v, kind) for v in archive[name]] if name in archive.files else [None] * rows
+                for name, kind in columns}
+
+def _day_start(value):
+    """Check whether a datetime falls on midnight, the granularity of manifest counts"""
+    return value == datetime(value.year, value.month, value.day)
+
+def _partition_counts(data):
+    """Count rows per day, camera and class for the manifest
+
+    Returns:
+        dict: YYYY-MM-DD -> list of [camera_id, class_name, rows]
+    """
+    counts = {}
+    for timestamp, camera_id, class_name in zip(data['timestamp'], data['camera_id'], data['class_name']):
+        if timestamp is None:
+            continue
+        day = counts.setdefault(timestamp.strftime('%Y-%m-%d'), {})
+        day[(camera_id, class_name)] = day.get((camera_id, class_name), 0) + 1
+    return {day: [[camera_id, class_name, rows] for (camera_id, class_name), rows in sorted(
+                day_counts.items(), key=lambda item: (item[0][0] or 0, item[0][1] or ''))]
+            for day, day_counts in counts.items()}
+
+def archive_partition(session, key, folder=None):
+    """Compact one monthly partition from the database into its archive file
+
+    Rows already archived for the same month (e.g. late inserts after a previous
+    run) are merged into the existing file, skipping ids the file already holds
+    so rows left in the database by an interrupted run are not archived twice.
+    Database rows are removed only after the archive file and manifest have been
+    written. Events stay in the database; those whose best detection is
+    archived lose the link to it.
+
+    Returns:
+        int: Number of rows moved out of the database
+    """
+    from app.models.detection import Detection
+    from app.models.event import Event
+    from app.utils.image_store import release_images
+
+    folder = folder or _archive_folder()
+    os.makedirs(folder, exist_ok=True)
+    start, end = partition_bounds(key)
+    columns = _detection_columns()
+
+    in_range = (Detection.timestamp >= start, Detection.timestamp < end)
+    row_count = session.query(Detection).filter(*in_range).count()
+    if row_count == 0:
+        return 0
+
+    with _manifest_lock:
+        manifest = load_manifest(folder)
+        entry = manifest.get(key)
+
+        # Start from already archived rows for this month, if any
+        if entry and os.path.exists(os.path.join(folder, entry['file'])):
+            data = _read_partition(os.path.join(folder, entry['file']), columns)
+        else:
+            data = {name: [] for name, _ in columns}
+        archived_ids = set(data['id'])
+
+        query = session.query(Detection).filter(*in_range).order_by(Detection.timestamp)
+        for detection in query.yield_per(EXPORT_CHUNK_SIZE):
+            if detection.id in archived_ids:
+                continue
+            for name, _ in columns:
+                data[name].append(getattr(detection, name))
+
+        extension = 'parquet' if has_pyarrow else 'npz'
+        filename = f"detections_{key}.{extension}"
+        _write_partition(os.path.join(folder, filename), columns, data)
+
+        manifest[key] = {
+            'file': filename,
+            'rows': len(data[columns[0][0]]),
+            'counts': _partition_counts(data),
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'archived_at': datetime.now().isoformat()
+        }
+        _save_manifest(manifest, folder)
+
+        # Remove a previous archive written in the other format
+        if entry and entry['file'] != filename and os.path.exists(os.path.join(folder, entry['file'])):
+            os.remove(os.path.join(folder, entry['file']))
+
+    # Delete in chunks so the write lock is only held briefly at a time
+    while True:
+        batch = session.query(Detection.id, Detection.image_path).filter(*in_range).limit(EXPORT_CHUNK_SIZE).all()
+        if not batch:
+            break
+        ids = [row.id for row in batch]
+        session.query(Detection).filter(Detection.id.in_(ids)).delete(synchronize_session=False)
+        # Archived rows no longer hold their snapshots, so events cannot show them either
+        release_images(session, [row.image_path for row in batch])
+        session.query(Event).filter(Event.best_detection_id.in_(ids)).update(
+            {Event.best_detection_id: None}, synchronize_session=False)
+        session.commit()
+
+    logger.info(f"Archived {row_count} detections for partition {key}")
+    return row_count
+
+def backfill_manifest_counts(folder=None):
+    """Add per-day camera and class counts to partitions archived without them
+
+    Returns:
+        int: Number of partitions updated
+    """
+    folder = folder or _archive_folder()
+    columns = _detection_columns()
+    updated = 0
+
+    with _manifest_lock:
+        manifest = load_manifest(folder)
+        for key, entry in manifest.items():
+            path = os.path.join(folder, entry['file'])
+            if 'counts' in entry or not os.path.exists(path):
+                continue
+            entry['counts'] = _partition_counts(_read_partition(path, columns))
+            updated += 1
+        if updated:
+            _save_manifest(manifest, folder)
+
+    return updated
+
+def archive_old_partitions(session, older_than_days, folder=None):
+    """Archive every monthly partition that ends before the retention cutoff
+
+    Returns:
+        dict: Rows archived per partition key
+    """
+    from app.models.detection import Detection
+
+    backfill_manifest_counts(folder)
+
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    oldest = session.query(Detection.timestamp).order_by(Detection.timestamp.asc()).limit(1).scalar()
+    if oldest is None:
+        return {}
+
+    archived = {}
+    key = partition_key(oldest)
+    while True:
+        start, end = partition_bounds(key)
+        # Only whole months are archived so a partition is either hot or cold
+        if end > cutoff:
+            break
+        rows = archive_partition(session, key, folder)
+        if rows:
+            archived[key] = rows
+        key = partition_key(end)
+
+    return archived
+
+def _overlapping_partitions(manifest, start, end):
+    """Yield (key, entry, start, end) for partitions overlapping [start, end), newest first
+
+    The yielded range is clipped to the partition's month.
+    """
+    for key in sorted(manifest, reverse=True):
+        part_start, part_end = partition_bounds(key)
+        if (start and part_end <= start) or (end and part_start >= end):
+            continue
+        yield (key, manifest[key],
+               max(start, part_start) if start else part_start,
+               min(end, part_end) if end else part_end)
+
+def _counted_rows(entry, start, end):
+    """Get (camera_id, class_name) -> rows of a partition in [start, end) from the manifest
+
+    Returns None when the manifest has no counts for the partition or the range
+    does not fall on day boundaries, in which case the file has to be read.
+    """
+    if 'counts' not in entry or not _day_start(start) or not _day_start(end):
+        return None
+
+    day_from, day_to = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+    totals = {}
+    for day, rows in entry['counts'].items():
+        if day_from <= day < day_to:
+            for camera_id, class_name, count in rows:
+                totals[(camera_id, class_name)] = totals.get((camera_id, class_name), 0) + count
+    return totals
+
+def _read_matching(path, columns, start, end, camera_id=None, class_name=None, offset=0, limit=None):
+    """Read one page of the rows of an archive file matching the filters, newest first
+
+    Returns:
+        tuple: (list of row dictionaries from offset, at most limit of them, number of matching rows)
+    """
+    if path.endswith('.parquet'):
+        filters = [('timestamp', '>=', start), ('timestamp', '<', end)]
+        if camera_id:
+            filters.append(('camera_id', '=', camera_id))
+        if class_name:
+            filters.append(('class_name', '=', class_name))
+        table = pq.read_table(path, filters=filters)
+        page = table.sort_by([('timestamp', 'descending')]).slice(offset, limit)
+        data = {name: page.column(name).to_pylist() if name in page.column_names else [None] * page.num_rows
+                for name, _ in columns}
+        return [{name: data[name][i] for name, _ in columns} for i in range(page.num_rows)], table.num_rows
+
+    with np.load(path) as archive:
+        timestamps = archive['timestamp']
+        mask = (timestamps >= np.datetime64(start, 'us')) & (timestamps < np.datetime64(end, 'us'))
+        if camera_id:
+            mask &= archive['camera_id'] == camera_id
+        if class_name:
+            mask &= archive['class_name'] == class_name
+        matches = np.flatnonzero(mask)
+        matches = matches[np.argsort(timestamps[matches], kind='stable')[::-1]]
+        page = matches[offset:offset + limit if limit is not None else None]
+        data = {name: [_from_numpy(v, kind) for v in archive[name][page]] if name in archive.files else [None] * len(page)
+                for name, kind in columns}
+    return [{name: data[name][i] for name, _ in columns} for i in range(len(page))], len(matches)
+
+def _read_groups(path, start, end):
+    """Count the rows of an archive file in [start, end) per camera and class, reading only those columns"""
+    if path.endswith('.parquet'):
+        table = pq.read_table(path, columns=['camera_id', 'class_name'],
+                              filters=[('timestamp', '>=', start), ('timestamp', '<', end)])
+        groups = zip(table.column('camera_id').to_pylist(), table.column('class_name').to_pylist())
+    else:
+        with np.load(path) as archive:
+            timestamps = archive['timestamp']
+            mask = (timestamps >= np.datetime64(start, 'us')) & (timestamps < np.datetime64(end, 'us'))
+            groups = zip([_from_numpy(v, 'int') for v in archive['camera_id'][mask]],
+                         [_from_numpy(v, 'str') for v in archive['class_name'][mask]])
+
+    counted = {}
+    for group in groups:
+        counted[group] = counted.get(group, 0) + 1
+    return counted
+
+def _filtered_total(totals, camera_id=None, class_name=None):
+    """Sum manifest counts matching the camera and class filters"""
+    return sum(count for (count_camera, count_class), count in totals.items()
+               if (not camera_id or count_camera == camera_id) and (not class_name or count_class == class_name))
+
+def query_archived_detections(start=None, end=None, camera_id=None, class_name=None, folder=None,
+                              offset=0, limit=None):
+    """Read archived detections matching the filters
+
+    Only partitions whose month overlaps [start, end) are opened. Partitions
+    never overlap in time, so they are read newest first: whole partitions
+    before ``offset`` are skipped using the manifest counts and reading stops
+    once ``limit`` rows have been collected.
+
+    Returns:
+        list: Detection dictionaries in the Detection.to_dict format, newest first
+    """
+    folder = folder or _archive_folder()
+    manifest = load_manifest(folder)
+    if not manifest:
+        return []
+
+    columns = _detection_columns()
+    results = []
+
+    for key, entry, part_start, part_end in _overlapping_partitions(manifest, start, end):
+        if limit is not None and len(results) >= limit:
+            break
+
+        if offset:
+            totals = _counted_rows(entry, part_start, part_end)
+            if totals is not None:
+                matched = _filtered_total(totals, camera_id, class_name)
+                if matched <= offset:
+                    offset -= matched
+                    continue
+
+        path = os.path.join(folder, entry['file'])
+        if not os.path.exists(path):
+            logger.warning(f"Archived partition file missing: {path}")
+            continue
+
+        remaining = limit - len(results) if limit is not None else None
+        rows, matched = _read_matching(path, columns, part_start, part_end, camera_id, class_name,
+                                       offset=offset, limit=remaining)
+        offset -= min(offset, matched)
+        results.extend(_archived_to_dict(row) for row in rows)
+
+    return results[:limit] if limit is not None else results
+
+def archived_counts(start=None, end=None, folder=None):
+    """Count archived detections in [start, end) per camera and class
+
+    Counts come from the manifest; a partition's file is only read when the
+    range cuts through a day or the partition was archived without counts.
+
+    Returns:
+        dict: (camera_id, class_name) -> number of archived detections
+    """
+    folder = folder or _archive_folder()
+    manifest = load_manifest(folder)
+    totals = {}
+
+    for key, entry, part_start, part_end in _overlapping_partitions(manifest, start, end):
+        counted = _counted_rows(entry, part_start, part_end)
+        if counted is None:
+            path = os.path.join(folder, entry['file'])
+            if not os.path.exists(path):
+                logger.warning(f"Archived partition file missing: {path}")
+                continue
+            counted = _read_groups(path, part_start, part_end)
+        for group, count in counted.items():
+            totals[group] = totals.get(group, 0) + count
+
+    return totals
+
+def count_archived_detections(start=None, end=None, camera_id=None, class_name=None, folder=None):
+    """Count archived detections matching the filters from the manifest counts"""
+    return _filtered_total(archived_counts(start, end, folder), camera_id, class_name)
+
+def _archived_to_dict(row):
+    """Format an archived row like Detection.to_dict"""
+    data = dict(row)
+    data['bbox'] = [row.get('bbox_x'), row.get('bbox_y'), row.get('bbox_width'), row.get('bbox_height')]
+    for name in ('bbox_x', 'bbox_y', 'bbox_width', 'bbox_height'):
+        data.pop(name, None)
+    for name, value in row.items():
+        if isinstance(value, datetime):
+            data[name] = value.isoformat()
+    data['archived'] = True
+    return data
+
+def run_archiver(interval=3600):
+    """Periodically move old detection partitions into archive files"""
+    from app import app, db
+
+    while True:
+        try:
+            with app.app_context():
+                archived = archive_old_partitions(db.session, app.config.get('DETECTION_ARCHIVE_AFTER_DAYS', 90))
+                if archived:
+                    logger.info(f"Detection archiver compacted partitions: {archived}")
+        except Exception as e:
+            logger.error(f"Error archiving detections: {str(e)}")
+
+        time.sleep(interval)
@@ -0,0 +1,300 @@
+"""
+Detection-triggered recording with a pre-event ring buffer
+
+An ffmpeg process stream-copies the camera into MPEG-TS on a pipe. The last
+few seconds of compressed packets are kept in memory, grouped by keyframe so
+the buffer always starts on a decodable frame. When a detection triggers an
+event, the buffered pre-roll is written to disk, recording continues until
+post_seconds after the last trigger, and the finished file is remuxed to
+fragmented MP4 for playback. Memory per camera is capped at max_buffer_bytes.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+import subprocess
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+from app.utils.recording_store import remux_segment
+from app.utils.stream_recorder import StreamRecorder
+
+logger = logging.getLogger(__name__)
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+PAT_PID = 0x0000
+PMT_PID = 0x1000  # Passed to ffmpeg explicitly so the PMT can be found without parsing the PAT
+READ_SIZE = TS_PACKET_SIZE * 512
+
+class EventRecorder(StreamRecorder):
+    """Record only around detections, keeping a bounded pre-event buffer in memory"""
+
+    def __init__(self, camera_id, stream_url, output_dir, pre_seconds=10, post_seconds=20,
+                 max_buffer_bytes=32 * 1024 * 1024, segment_seconds=60, ffmpeg_path='ffmpeg',
+                 on_segment_start=None, on_segment=None):
+        """Initialize event recorder
+
+        Args:
+            camera_id: Camera ID (used for logging)
+            stream_url: Stream URL including credentials
+            output_dir: Directory event files are written to
+            pre_seconds: Seconds of footage kept from before the first detection
+            post_seconds: Seconds recorded after the last detection
+            max_buffer_bytes: Hard cap on the pre-event buffer size
+            segment_seconds: Long events are split into files of about this length
+            ffmpeg_path: ffmpeg binary name or path
+            on_segment_start: Called as on_segment_start(file_path, start_time)
+            on_segment: Called as on_segment(file_path, start_time, end_time, source_path=...)
+        """
+        super().__init__(camera_id, stream_url, output_dir, segment_seconds=segment_seconds,
+                         ffmpeg_path=ffmpeg_path, container='ts',
+                         on_segment_start=on_segment_start, on_segment=on_segment)
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_buffer_bytes = max_buffer_bytes
+        self.ring = deque()  # [start_time, bytearray] per group of pictures
+        self.buffer_bytes = 0
+        self.tables = {}  # Latest PAT/PMT packet, written at the start of every event file
+        self.last_trigger = 0
+        self.event_file = None
+        self.event_start = None
+        self.event_opened = 0  # time.time() the current file was opened
+        self.events_recorded = 0
+        self.bytes_received = 0
+        self.bytes_written = 0
+        self.packets_dropped = 0  # Packets discarded before the first keyframe or over the cap
+
+    def _build_command(self, prefix):
+        """Stream-copy the camera into MPEG-TS on stdout"""
+        command = [self.ffmpeg_path, '-hide_banner', '-nostdin', '-loglevel', 'error']
+
+        if self.stream_url.startswith('rtsp://'):
+            command += ['-rtsp_transport', 'tcp']
+
+        command += [
+            '-i', self.stream_url,
+            '-map', '0:v:0',
+            '-an',
+            '-c', 'copy',
+            '-f', 'mpegts',
+            '-mpegts_pmt_start_pid', str(PMT_PID),
+            'pipe:1'
+        ]
+        return command
+
+    def trigger(self):
+        """Start or extend an event
+
+        Returns:
+            str: Path of the event file the detection belongs to
+        """
+        with self.lock:
+            self.last_trigger = time.time()
+            if self.current_path is None:
+                # The reader thread opens the file on its next chunk, the name is fixed now
+                self.current_path = self._event_path(datetime.now())
+            return self.current_path
+
+    def _event_path(self, start_time):
+        """Get a new event file path"""
+        return os.path.join(self.output_dir, f"{start_time:%Y%m%d_%H%M%S}_event_{uuid.uuid4().hex[:6]}.ts")
+
+    def _run_session(self):
+        """Run one ffmpeg process, buffering packets and writing events until it exits"""
+        self.session_start = datetime.now()
+
+        try:
+            with self.lock:
+                self.process = subprocess.Popen(
+                    self._build_command(None),
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE
+                )
+        except Exception as e:
+            logger.error(f"Failed to start ffmpeg for camera {self.camera_id}: {str(e)}")
+            self.errors.append(str(e))
+            return
+
+        stderr_thread = threading.Thread(target=self._read_errors, args=(self.process.stderr,))
+        stderr_thread.daemon = True
+        stderr_thread.start()
+
+        # A new process starts a new stream, old packets cannot be continued
+        self._clear_buffer()
+        pending = b''
+
+        while True:
+            data = self.process.stdout.read1(READ_SIZE)
+            if not data:
+                break
+
+            data = pending + data
+            usable = len(data) - len(data) % TS_PACKET_SIZE
+            pending = data[usable:]
+            if usable:
+                self._handle_packets(np.frombuffer(data[:usable], dtype=np.uint8).reshape(-1, TS_PACKET_SIZE))
+
+        self.process.wait()
+        stderr_thread.join(timeout=1.0)
+        self._close_event()
+
+    def _clear_buffer(self):
+        """Drop all buffered packets"""
+        self.ring.clear()
+        self.buffer_bytes = 0
+        self.tables = {}
+
+    def _handle_packets(self, packets):
+        """Split packets into keyframe groups, buffer them and write them to an open event"""
+        now = datetime.now()
+        self.bytes_received += packets.size
+
+        if packets[0, 0] != TS_SYNC_BYTE:
+            # Lost packet alignment, resynchronize on the next read
+            logger.warning(f"MPEG-TS sync lost for camera {self.camera_id}")
+            self.packets_dropped += len(packets)
+            return
+
+        pids = ((packets[:, 1].astype(np.uint16) & 0x1f) << 8) | packets[:, 2]
+        # random_access_indicator in the adaptation field marks keyframes
+        keyframes = (packets[:, 3] & 0x20 > 0) & (packets[:, 4] > 0) & (packets[:, 5] & 0x40 > 0)
+
+        for pid in (PAT_PID, PMT_PID):
+            found = np.nonzero(pids == pid)[0]
+            if len(found):
+                self.tables[pid] = packets[found[-1]].tobytes()
+
+        starts = np.nonzero(keyframes)[0].tolist()
+        bounds = [0] + [i for i in starts if i > 0] + [len(packets)]
+
+        for begin, end in zip(bounds[:-1], bounds[1:]):
+            chunk = packets[begin:end].tobytes()
+            if begin in starts:
+                self._start_group(now)
+                self.ring.append([now, bytearray(chunk)])
+                self.buffer_bytes += len(chunk)
+            elif self.ring:
+                self.ring[-1][1].extend(chunk)
+                self.buffer_bytes += len(chunk)
+            elif not self.event_file:
+                # No keyframe buffered, nothing decodable to keep
+                self.packets_dropped += end - begin
+
+            if self.event_file:
+                self.event_file.write(chunk)
+                self.bytes_written += len(chunk)
+
+        self._evict(now)
+        self._update_event(now)
+
+    def _start_group(self, now):
+        """Handle a new keyframe: open a triggered event or split a long one"""
+        if self.event_file and (time.time() - self.event_opened) >= self.segment_seconds:
+            # Split long events on a keyframe so every file starts decodable
+            with self.lock:
+                self.current_path = self._event_path(now)
+            self._close_event(keep_path=True)
+
+    def _evict(self, now):
+        """Keep only enough keyframe groups to cover pre_seconds, within the memory cap"""
+        while len(self.ring) > 1 and (now - self.ring[1][0]).total_seconds() >= self.pre_seconds:
+            self.buffer_bytes -= len(self.ring.popleft()[1])
+
+        while self.ring and self.buffer_bytes > self.max_buffer_bytes:
+            dropped = self.ring.popleft()[1]
+            self.buffer_bytes -= len(dropped)
+            self.packets_dropped += len(dropped) // TS_PACKET_SIZE
+
+    def _update_event(self, now):
+        """Open the event file after a trigger and close it once post_seconds have passed"""
+        if self.event_file is None:
+            if self.current_path and self.ring and time.time() - self.last_trigger < self.post_seconds:
+                self._open_event()
+            return
+
+        if time.time() - self.last_trigger >= self.post_seconds:
+            self._close_event()
+
+    def _open_event(self):
+        """Write the tables and buffered pre-roll to a new event file"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.event_start = self.ring[0][0]
+        self.event_opened = time.time()
+        self.event_file = open(self.current_path, 'wb')
+        self._notify_start(self.current_path, self.event_start)
+
+        for pid in (PAT_PID, PMT_PID):
+            if pid in self.tables:
+                self.event_file.write(self.tables[pid])
+        for _, chunk in self.ring:
+            self.event_file.write(chunk)
+            self.bytes_written += len(chunk)
+
+        logger.info(f"Started event recording for camera {self.camera_id}: {self.current_path}")
+
+    def _close_event(self, keep_path=False):
+        """Close the event file and finalize it in the background"""
+        if self.event_file is None:
+            if not keep_path:
+                with self.lock:
+                    self.current_path = None
+            return
+
+        path = self.event_file.name
+        self.event_file.close()
+        self.event_file = None
+        self.events_recorded += 1
+
+        finisher = threading.Thread(target=self._finish_event, args=(path, self.event_start, datetime.now()))
+        finisher.daemon = True
+        finisher.start()
+
+        if keep_path:
+            # A long event continues in a new file starting with the current keyframe
+            self.event_start = datetime.now()
+            self.event_opened = time.time()
+            self.event_file = open(self.current_path, 'wb')
+            self._notify_start(self.current_path, self.event_start)
+            for pid in (PAT_PID, PMT_PID):
+                if pid in self.tables:
+                    self.event_file.write(self.tables[pid])
+        else:
+            with self.lock:
+                # A trigger that arrived after the last check starts a fresh event file
+                if time.time() - self.last_trigger >= self.post_seconds:
+                    self.current_path = None
+                else:
+                    self.current_path = self._event_path(datetime.now())
+
+    def _finish_event(self, path, start_time, end_time):
+        """Remux a closed event to fragmented MP4 for browser playback and report it"""
+        mp4_path = os.path.splitext(path)[0] + '.mp4'
+        if remux_segment(path, mp4_path, self.ffmpeg_path):
+            os.remove(path)
+            self._notify(mp4_path, start_time, end_time, source_path=path)
+        else:
+            self._notify(path, start_time, end_time)
+
+    def get_stats(self):
+        """Get buffer memory use and storage savings next to the ffmpeg process stats"""
+        stats = super().get_stats()
+        buffer_seconds = (datetime.now() - self.ring[0][0]).total_seconds() if self.ring else 0
+        stats.update({
+            'engine': 'ffmpeg-event',
+            'event_active': self.event_file is not None,
+            'buffer_bytes': self.buffer_bytes,
+            'buffer_seconds': round(buffer_seconds, 1),
+            'max_buffer_bytes': self.max_buffer_bytes,
+            'events_recorded': self.events_recorded,
+            'bytes_received': self.bytes_received,
+            'bytes_written': self.bytes_written,
+            'storage_saved_percent': round(100 * (1 - self.bytes_written / self.bytes_received), 1)
+                                     if self.bytes_received else 0,
+            'packets_dropped': self.packets_dropped
+        })
+        return stats
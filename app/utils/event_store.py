@@ -0,0 +1,167 @@
+"""
+Incremental event aggregation
+
+Detections of one class on one camera that are less than EVENT_MERGE_GAP
+seconds apart form one Event. Events are maintained on the same writer
+session as the detections themselves: a new detection either extends the
+open event of its class (found through the camera/class/end time index) or
+starts a new one, and tracked objects move their event's end time forward
+while they stay in view. Listings and dashboards read the events instead of
+every detection row.
+"""
+from datetime import timedelta
+
+DEFAULT_MERGE_GAP = 30
+
+def merge_gap():
+    """Get the configured gap that separates two events"""
+    from app import app
+    return timedelta(seconds=app.config.get('EVENT_MERGE_GAP', DEFAULT_MERGE_GAP))
+
+def _open_event(session, camera_id, class_name, timestamp, gap):
+    """Get the latest event of a class that a detection at timestamp extends"""
+    from app.models.event import Event
+
+    return session.query(Event).filter(
+        Event.camera_id == camera_id,
+        Event.class_name == class_name,
+        Event.end_time >= timestamp - gap,
+        Event.start_time <= timestamp + gap
+    ).order_by(Event.end_time.desc()).first()
+
+def assign_events(session, camera_id, rows):
+    """Attach detection rows to events before they are inserted
+
+    Sets 'event_id' on every row, extending or creating events.
+
+    Args:
+        session: SQLAlchemy session the detections are written with
+        camera_id: ID of the camera the detections belong to
+        rows: Detection column dictionaries
+
+    Returns:
+        dict: Event by index of the row that now holds its peak confidence,
+              pass it to set_best_detections once the rows have IDs
+    """
+    from app.models.event import Event
+
+    gap = merge_gap()
+    events = {}  # Open event per class within this batch
+    best_rows = {}
+
+    for index in sorted(range(len(rows)), key=lambda i: rows[i]['timestamp']):
+        row = rows[index]
+        timestamp = row['timestamp']
+        class_name = row['class_name']
+
+        event = events.get(class_name)
+        if event is None or timestamp > event.end_time + gap:
+            event = _open_event(session, camera_id, class_name, timestamp, gap)
+
+        if event is None:
+            event = Event(
+                camera_id=camera_id,
+                class_name=class_name,
+                start_time=timestamp,
+                end_time=timestamp,
+                detection_count=0,
+                peak_confidence=0.0,
+                recording_id=row.get('recording_id'),
+                video_path=row.get('video_path'),
+                video_offset=row.get('video_offset')
+            )
+            session.add(event)
+            session.flush()
+        elif timestamp < event.start_time:
+            # Out of order report, the event now starts in this detection's segment
+            event.start_time = timestamp
+            event.recording_id = row.get('recording_id')
+            event.video_path = row.get('video_path')
+            event.video_offset = row.get('video_offset')
+
+        event.end_time = max(event.end_time, timestamp)
+        event.detection_count = (event.detection_count or 0) + 1
+        if row['confidence'] > (event.peak_confidence or 0):
+            event.peak_confidence = row['confidence']
+            best_rows = {i: e for i, e in best_rows.items() if e is not event}
+            best_rows[index] = event
+
+        row['event_id'] = event.id
+        events[class_name] = event
+
+    return best_rows
+
+def set_best_detections(best_rows, detections):
+    """Point events at the inserted detections that hold their peak confidence"""
+    for index, event in best_rows.items():
+        event.best_detection_id = detections[index].id
+
+def update_track_event(session, camera_id, track_id, last_seen=None, confidence=None):
+    """Extend the event of a tracked object while it stays in view
+
+    Args:
+        session: SQLAlchemy session
+        camera_id: ID of the camera
+        track_id: Tracker id stored on the detection row
+        last_seen: Time the object was last detected
+        confidence: New best confidence of the track's detection
+    """
+    from app.models.detection import Detection
+    from app.models.event import Event
+
+    row = session.query(Detection.id, Detection.event_id).filter(
+        Detection.camera_id == camera_id,
+        Detection.track_id == track_id
+    ).first()
+    if not row or row.event_id is None:
+        return
+
+    event = session.get(Event, row.event_id)
+    if event is None:
+        return
+    if last_seen is not None and last_seen > event.end_time:
+        event.end_time = last_seen
+    if confidence is not None and confidence > (event.peak_confidence or 0):
+        event.peak_confidence = confidence
+        event.best_detection_id = row.id
+
+def rebuild_events(session, batch_size=1000):
+    """Group detections that have no event yet, oldest first (used by the migration)
+
+    Returns:
+        int: Number of events created
+    """
+    from app.models.detection import Detection
+    from app.models.event import Event
+
+    existing = session.query(Event).count()
+    last_id = 0
+    while True:
+        batch = session.query(Detection).filter(
+            Detection.event_id.is_(None),
+            Detection.id > last_id
+        ).order_by(Detection.id.asc()).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+
+        by_camera = {}
+        for detection in batch:
+            by_camera.setdefault(detection.camera_id, []).append(detection)
+
+        for camera_id, detections in by_camera.items():
+            rows = [{
+                'timestamp': d.timestamp,
+                'class_name': d.class_name,
+                'confidence': d.confidence,
+                'recording_id': d.recording_id,
+                'video_path': d.video_path,
+                'video_offset': d.video_offset
+            } for d in detections]
+            best_rows = assign_events(session, camera_id, rows)
+            for detection, row in zip(detections, rows):
+                detection.event_id = row['event_id']
+            set_best_detections(best_rows, detections)
+        session.flush()
+
+    return session.query(Event).count() - existing
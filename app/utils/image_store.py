@@ -0,0 +1,258 @@
+"""
+Content-addressed detection image store
+
+Snapshots are named after a 64-bit perceptual hash (DCT hash) of the image
+they show and of the detected object's box, and stored in a two-level
+sharded tree under SNAPSHOT_FOLDER (images/3f/a2/3fa2..._<camera>.jpg), so
+no directory holds more than a small share of the images. Before a snapshot
+is queued, its hashes are compared with the images the same camera stored
+recently: one where both are at most IMAGE_DEDUPE_DISTANCE bits away and
+the sizes match (a parked car) is referenced again instead of writing
+another nearly identical JPEG. The object hash keeps a small object in a
+full-frame snapshot from matching the empty scene.
+
+Because files are shared between detections they are reference counted in
+the detection_image table, on the same session as the detection rows:
+storing or updating a detection acquires its image, clearing or deleting it
+releases the image. The storage janitor only deletes images nobody
+references that have not been used for longer than the dedupe window.
+"""
+import os
+import time
+import logging
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+import cv2
+import numpy as np
+from sqlalchemy import case
+
+from app.utils.snapshot_writer import SNAPSHOT_FOLDER, SnapshotWriter, crop_box
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8  # The hash is built from the HASH_SIZE x HASH_SIZE lowest DCT frequencies
+SIZE_TOLERANCE = 0.1  # Share an image may differ in width and height from a match
+
+def perceptual_hash(image):
+    """Compute the 64-bit DCT perceptual hash of a BGR or grayscale image"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (HASH_SIZE * 4, HASH_SIZE * 4), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(np.float32(small))[:HASH_SIZE, :HASH_SIZE].flatten()
+    # The DC term only reflects overall brightness and is left out of the median
+    bits = low > np.median(low[1:])
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+def hamming_distance(hash_a, hash_b):
+    """Count the bits two hashes differ in"""
+    return bin(hash_a ^ hash_b).count('1')
+
+def image_path_for(camera_id, hashes):
+    """Get the sharded store path of an image's hashes"""
+    digest = ''.join(f"{value:016x}" for value in hashes)
+    return os.path.join(SNAPSHOT_FOLDER, digest[:2], digest[2:4], f"{digest}_{camera_id}.jpg")
+
+class RecentImage:
+    """An image a camera stored recently, candidate for reuse"""
+
+    def __init__(self, hashes, sizes, last_used):
+        self.hashes = hashes  # Hashes of the snapshot and of the object box
+        self.sizes = sizes  # Width and height of the snapshot and of the object box
+        self.last_used = last_used
+
+    def similar_size(self, sizes):
+        """Check that the snapshot and object have about the same dimensions"""
+        return all(abs(own - other) <= own * SIZE_TOLERANCE for own, other in zip(self.sizes, sizes))
+
+    def distance(self, hashes):
+        """Get the larger hash distance of the snapshot and the object"""
+        return max(hamming_distance(own, other) for own, other in zip(self.hashes, hashes))
+
+class ImageStore:
+    """Deduplicate detection snapshots by perceptual hash and queue new ones for writing"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """Get singleton instance"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from app import app
+                    cls._instance = ImageStore(
+                        max_distance=app.config.get('IMAGE_DEDUPE_DISTANCE', 6),
+                        window=app.config.get('IMAGE_DEDUPE_WINDOW', 600)
+                    )
+        return cls._instance
+
+    def __init__(self, max_distance=6, window=600, recent_size=256):
+        """Initialize image store
+
+        Args:
+            max_distance: Hash bits an image may differ by to reuse a recent one (negative to disable)
+            window: Seconds an image stays a reuse candidate after it was last used
+            recent_size: Candidates kept per camera
+        """
+        self.max_distance = max_distance
+        self.window = window
+        self.recent_size = max(1, recent_size)
+        self.recent = {}  # camera_id -> OrderedDict of path -> RecentImage, least recently used first
+        self.lock = threading.Lock()
+        self.stored = 0
+        self.reused = 0
+        self.dropped = 0
+
+    def store(self, camera_id, frame, quality=80, max_width=None, crop=None, region=None):
+        """Get the path of a snapshot, reusing a near-duplicate or queueing a new file
+
+        Args:
+            camera_id: ID of the camera
+            frame: BGR frame, must not be modified afterwards
+            quality: JPEG quality
+            max_width: Downscale wider images to this width
+            crop: (x, y, width, height) box to crop to (None for the full frame)
+            region: (x, y, width, height) box of the detected object (None to match the snapshot only)
+
+        Returns:
+            tuple: (path or None if the writer is saturated, True if an existing image was reused)
+        """
+        image = crop_box(frame, crop) if crop is not None else frame
+        region_image = crop_box(frame, region, padding=0) if region is not None else image
+        hashes = (perceptual_hash(image), perceptual_hash(region_image))
+        sizes = image.shape[1::-1] + region_image.shape[1::-1]
+        now = time.time()
+
+        with self.lock:
+            recent = self.recent.setdefault(camera_id, OrderedDict())
+            match = self._match(recent, hashes, sizes, now)
+            if match is not None:
+                recent[match].last_used = now
+                recent.move_to_end(match)
+                self.reused += 1
+                return match, True
+
+        path = SnapshotWriter.get_instance().submit(
+            image, image_path_for(camera_id, hashes), quality=quality, max_width=max_width)
+
+        with self.lock:
+            if path is None:
+                self.dropped += 1
+                return None, False
+            recent[path] = RecentImage(hashes, sizes, now)
+            recent.move_to_end(path)
+            while len(recent) > self.recent_size:
+                recent.popitem(last=False)
+            self.stored += 1
+        return path, False
+
+    def _match(self, recent, hashes, sizes, now):
+        """Find a recent image of about the same size whose hashes are close enough"""
+        while recent and now - next(iter(recent.values())).last_used > self.window:
+            recent.popitem(last=False)
+
+        if self.max_distance < 0:
+            return None
+
+        best, best_distance = None, self.max_distance + 1
+        for path, candidate in recent.items():
+            if not candidate.similar_size(sizes):
+                continue
+            distance = candidate.distance(hashes)
+            if distance < best_distance:
+                best, best_distance = path, distance
+        return best
+
+    def get_stats(self):
+        """Get store statistics"""
+        with self.lock:
+            candidates = sum(len(recent) for recent in self.recent.values())
+            total = self.stored + self.reused
+            return {
+                'stored': self.stored,
+                'reused': self.reused,
+                'dropped': self.dropped,
+                'reuse_ratio': self.reused / total if total else 0.0,
+                'candidates': candidates,
+                'max_distance': self.max_distance,
+                'window': self.window
+            }
+
+def acquire_images(session, camera_id, paths):
+    """Add one reference per path occurrence, registering new images
+
+    Args:
+        session: SQLAlchemy session the detections are written with
+        camera_id: ID of the camera the images belong to
+        paths: Image paths of stored or updated detection rows (None entries are ignored)
+    """
+    from app.models.detection_image import DetectionImage
+
+    counts = Counter(path for path in paths if path)
+    if not counts:
+        return
+
+    now = datetime.now()
+    existing = {image.path: image for image in session.query(DetectionImage).filter(
+        DetectionImage.path.in_(list(counts)))}
+    for path, refs in counts.items():
+        image = existing.get(path)
+        if image is None:
+            session.add(DetectionImage(camera_id=camera_id, path=path, ref_count=refs,
+                                       created_at=now, last_used=now))
+        else:
+            image.ref_count = (image.ref_count or 0) + refs
+            image.last_used = now
+
+def release_images(session, paths):
+    """Drop one reference per path occurrence, images are deleted later by the janitor"""
+    from app.models.detection_image import DetectionImage
+
+    counts = Counter(path for path in paths if path)
+    now = datetime.now()
+    for path, refs in counts.items():
+        session.query(DetectionImage).filter(DetectionImage.path == path).update({
+            DetectionImage.ref_count: case((DetectionImage.ref_count > refs, DetectionImage.ref_count - refs), else_=0),
+            DetectionImage.last_used: now
+        }, synchronize_session=False)
+
+def release_camera_images(session, camera_id):
+    """Delete the image rows of a camera that is being deleted
+
+    Returns:
+        list: Paths of the camera's images, their files can be removed after the commit
+    """
+    from app.models.detection_image import DetectionImage
+
+    paths = [path for (path,) in session.query(DetectionImage.path).filter(DetectionImage.camera_id == camera_id)]
+    session.query(DetectionImage).filter(DetectionImage.camera_id == camera_id).delete(synchronize_session=False)
+    return paths
+
+def delete_unreferenced(session, unused_since, limit=500):
+    """Delete rows of images without references that were last used before a time
+
+    Returns:
+        list: Paths whose rows were deleted, their files can be removed
+    """
+    from app.models.detection_image import DetectionImage
+
+    batch = session.query(DetectionImage.id, DetectionImage.path).filter(
+        DetectionImage.ref_count == 0,
+        DetectionImage.last_used < unused_since
+    ).order_by(DetectionImage.last_used.asc()).limit(limit).all()
+    if not batch:
+        return []
+
+    ids = [row.id for row in batch]
+    session.query(DetectionImage).filter(
+        DetectionImage.id.in_(ids),
+        DetectionImage.ref_count == 0
+    ).delete(synchronize_session=False)
+    # An image referenced again since the select keeps its row and its file
+    kept = {image_id for (image_id,) in session.query(DetectionImage.id).filter(DetectionImage.id.in_(ids))}
+    return [row.path for row in batch if row.id not in kept]
@@ -0,0 +1,277 @@
+"""
+Fair inference scheduling across cameras
+
+Cameras no longer queue frames for a detection thread of their own. Each
+camera has a single slot in the InferenceScheduler that holds its newest
+frame: a frame arriving before the previous one was picked up replaces it,
+so under load detection skips frames instead of falling seconds behind. A
+small pool of workers (INFERENCE_WORKERS) runs detection for one camera at
+a time, never for the same camera twice at once.
+
+Which camera is served next depends on the policy:
+
+- weighted: stride scheduling over inference time. Every camera has a
+  virtual time that advances by the seconds its inference took divided by
+  its weight (the camera's inference priority), and the ready camera with
+  the lowest virtual time goes next, so a camera of weight 2 gets about
+  twice the GPU time of one of weight 1, and a busy camera cannot starve
+  quiet ones.
+- priority: cameras of a higher priority are always served first, cameras
+  of the same priority take turns as above.
+
+A frame older than its camera's maximum detection latency when it would be
+served is dropped as stale, detections are never made on footage that old.
+Staleness at inference time, each camera's share of the inference time and
+the drop reasons are reported by get_stats.
+"""
+import time
+import logging
+import threading
+from collections import Counter, deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('weighted', 'priority')
+STALENESS_SAMPLES = 200  # Recent frames the staleness figures are computed over
+
+class CameraSlot:
+    """Newest frame and scheduling state of one camera"""
+
+    def __init__(self, processor):
+        self.processor = processor
+        self.frame = None
+        self.captured = None  # time.time() of the frame
+        self.captured_at = None  # Local datetime of the frame, used as detection time
+        self.busy = False
+        self.virtual_time = 0.0
+        self.offered = 0
+        self.inferred = 0
+        self.errors = 0
+        self.drops = Counter()  # 'superseded' by a newer frame, 'stale' past the max latency
+        self.service_seconds = 0.0
+        self.staleness = deque(maxlen=STALENESS_SAMPLES)
+
+    def priority(self):
+        """Get the camera's weight or rank, at least 1"""
+        return max(1, getattr(self.processor.camera, 'inference_priority', None) or 1)
+
+    def max_latency(self, default):
+        """Get the camera's maximum detection latency in seconds"""
+        return getattr(self.processor.camera, 'max_detection_latency', None) or default
+
+class InferenceScheduler:
+    """Serve the newest frame of each camera to a shared pool of detection workers"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """Get singleton instance, started on first use"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from app import app
+                    scheduler = InferenceScheduler(
+                        workers=app.config.get('INFERENCE_WORKERS', 2),
+                        policy=app.config.get('INFERENCE_SCHEDULING', 'weighted'),
+                        max_latency=app.config.get('INFERENCE_MAX_LATENCY', 2.0)
+                    )
+                    scheduler.start()
+                    cls._instance = scheduler
+        return cls._instance
+
+    def __init__(self, workers=2, policy='weighted', max_latency=2.0):
+        """Initialize scheduler
+
+        Args:
+            workers: Detection threads shared by all cameras
+            policy: 'weighted' (round-robin by inference time and weight) or 'priority'
+            max_latency: Default age in seconds after which a frame is dropped instead of inferred
+        """
+        if policy not in POLICIES:
+            logger.warning(f"Unknown inference scheduling policy {policy}, using weighted")
+            policy = 'weighted'
+        self.workers = max(1, workers)
+        self.policy = policy
+        self.max_latency = max_latency
+        self.slots = {}  # camera_id -> CameraSlot
+        self.virtual_time = 0.0  # Virtual time of the last camera served
+        self.condition = threading.Condition()
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        """Start the worker threads"""
+        if self.running:
+            return False
+        self.running = True
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"inference-worker-{index}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return True
+
+    def stop(self):
+        """Stop the worker threads after their current inference"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=2.0)
+        self.threads = []
+        return True
+
+    def register(self, processor):
+        """Add a camera processor, its detect_frame is called with the frames it offers"""
+        camera_id = processor.camera.id
+        with self.condition:
+            slot = self.slots.get(camera_id)
+            if slot is None:
+                slot = CameraSlot(processor)
+                # Start level with the others instead of catching up on their past service
+                slot.virtual_time = self.virtual_time
+                self.slots[camera_id] = slot
+            else:
+                slot.processor = processor
+        return slot
+
+    def unregister(self, camera_id, timeout=5.0):
+        """Remove a camera, waiting for an inference of it that is still running"""
+        deadline = time.time() + timeout
+        with self.condition:
+            slot = self.slots.get(camera_id)
+            if slot is None:
+                return False
+            slot.frame = None
+            while slot.busy and time.time() < deadline:
+                self.condition.wait(timeout=0.1)
+            self.slots.pop(camera_id, None)
+        return True
+
+    def offer(self, camera_id, frame):
+        """Hand over a camera's newest frame, replacing one that was not picked up yet
+
+        Returns:
+            bool: False if the camera is not registered
+        """
+        with self.condition:
+            slot = self.slots.get(camera_id)
+            if slot is None:
+                return False
+            if slot.frame is not None:
+                slot.drops['superseded'] += 1
+            slot.frame = frame
+            slot.captured = time.time()
+            slot.captured_at = datetime.now()
+            slot.offered += 1
+            self.condition.notify()
+        return True
+
+    def _pick(self):
+        """Take the next camera's frame, dropping stale ones (called with the condition held)"""
+        now = time.time()
+        ready = []
+        for slot in self.slots.values():
+            if slot.frame is None or slot.busy:
+                continue
+            if now - slot.captured > slot.max_latency(self.max_latency):
+                slot.drops['stale'] += 1
+                slot.frame = None
+                continue
+            ready.append(slot)
+        if not ready:
+            return None
+
+        if self.policy == 'priority':
+            slot = min(ready, key=lambda s: (-s.priority(), s.virtual_time, s.captured))
+        else:
+            slot = min(ready, key=lambda s: (s.virtual_time, s.captured))
+
+        # A camera that was idle does not get a burst of credit for the time it had no frames
+        slot.virtual_time = max(slot.virtual_time, self.virtual_time)
+        self.virtual_time = slot.virtual_time
+        slot.busy = True
+        slot.staleness.append(now - slot.captured)
+        job = (slot, slot.frame, slot.captured_at)
+        slot.frame = None
+        return job
+
+    def _run(self):
+        """Worker loop"""
+        while True:
+            with self.condition:
+                job = self._pick() if self.running else None
+                while self.running and job is None:
+                    self.condition.wait(timeout=0.5)
+                    job = self._pick()
+                if not self.running:
+                    if job is not None:
+                        job[0].busy = False
+                    return
+
+            slot, frame, captured_at = job
+            started = time.perf_counter()
+            failed = False
+            try:
+                slot.processor.detect_frame(frame, captured_at)
+            except Exception as e:
+                failed = True
+                logger.error(f"Error in object detection for camera {slot.processor.camera.id}: {str(e)}")
+            elapsed = time.perf_counter() - started
+
+            with self.condition:
+                slot.busy = False
+                slot.service_seconds += elapsed
+                slot.virtual_time += elapsed / slot.priority()
+                if failed:
+                    slot.errors += 1
+                else:
+                    slot.inferred += 1
+                self.condition.notify_all()
+
+    def _slot_stats(self, camera_id, slot, total_seconds, total_inferred):
+        """Get the statistics of one camera (called with the condition held)"""
+        staleness = sorted(slot.staleness)
+        return {
+            'camera_id': camera_id,
+            'priority': slot.priority(),
+            'max_latency': slot.max_latency(self.max_latency),
+            'offered': slot.offered,
+            'inferred': slot.inferred,
+            'errors': slot.errors,
+            'drops': dict(slot.drops),
+            'service_seconds': round(slot.service_seconds, 3),
+            'service_share': round(slot.service_seconds / total_seconds, 3) if total_seconds else None,
+            'frame_share': round(slot.inferred / total_inferred, 3) if total_inferred else None,
+            'staleness_avg': round(sum(staleness) / len(staleness), 3) if staleness else None,
+            'staleness_p95': round(staleness[int(0.95 * (len(staleness) - 1))], 3) if staleness else None,
+            'staleness_max': round(staleness[-1], 3) if staleness else None
+        }
+
+    def camera_stats(self, camera_id):
+        """Get the scheduling statistics of one camera, None if it is not registered"""
+        with self.condition:
+            slot = self.slots.get(camera_id)
+            if slot is None:
+                return None
+            total_seconds = sum(s.service_seconds for s in self.slots.values())
+            total_inferred = sum(s.inferred for s in self.slots.values())
+            return self._slot_stats(camera_id, slot, total_seconds, total_inferred)
+
+    def get_stats(self):
+        """Get scheduler statistics with a breakdown per camera"""
+        with self.condition:
+            total_seconds = sum(s.service_seconds for s in self.slots.values())
+            total_inferred = sum(s.inferred for s in self.slots.values())
+            return {
+                'running': self.running,
+                'policy': self.policy,
+                'workers': self.workers,
+                'max_latency': self.max_latency,
+                'busy_workers': sum(1 for s in self.slots.values() if s.busy),
+                'cameras': [self._slot_stats(camera_id, slot, total_seconds, total_inferred)
+                            for camera_id, slot in self.slots.items()]
+            }
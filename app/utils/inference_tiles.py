@@ -0,0 +1,125 @@
+"""
+Tiled inference helpers
+
+A wide-angle or 4K frame sent to YOLOv5 as a whole is shrunk to the model's
+640 px input, which makes people and cars far from the camera a few pixels
+tall. In tiled mode the frame is cut into a grid of overlapping tiles that
+are run as one batch, so every tile keeps several times the resolution.
+Objects on a tile border are seen by two tiles; merge_detections combines
+those duplicates (cross-tile NMS) before the detections are used.
+"""
+import cv2
+import numpy as np
+
+MOTION_WIDTH = 160  # Width of the grayscale frame motion is detected on
+MOTION_THRESHOLD = 25  # Gray level change that counts as motion
+MOTION_MIN_SHARE = 0.002  # Share of a tile's pixels that must change for it to be inferred
+
+def parse_grid(value):
+    """Parse a 'COLUMNSxROWS' tile grid
+
+    Returns:
+        tuple or None: (columns, rows), None when tiling is off or the value is invalid
+    """
+    try:
+        columns, rows = (int(part) for part in str(value).lower().split('x'))
+    except (TypeError, ValueError):
+        return None
+    if columns < 1 or rows < 1 or columns * rows == 1:
+        return None
+    return columns, rows
+
+def tile_layout(width, height, columns, rows, overlap=0.2):
+    """Split a frame into a grid of tiles that overlap by a share of their size
+
+    Returns:
+        list: (x1, y1, x2, y2) tiles covering the whole frame
+    """
+    overlap = min(max(overlap, 0.0), 0.5)
+    tile_width = width / (columns - (columns - 1) * overlap)
+    tile_height = height / (rows - (rows - 1) * overlap)
+    tiles = []
+    for row in range(rows):
+        for column in range(columns):
+            x1 = int(round(column * tile_width * (1 - overlap)))
+            y1 = int(round(row * tile_height * (1 - overlap)))
+            x2 = width if column == columns - 1 else min(width, int(round(x1 + tile_width)))
+            y2 = height if row == rows - 1 else min(height, int(round(y1 + tile_height)))
+            tiles.append((x1, y1, x2, y2))
+    return tiles
+
+def rects_overlap(a, b):
+    """Check whether two (x1, y1, x2, y2) rectangles intersect"""
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+def merge_detections(detections, iou_threshold=0.5, containment_threshold=0.5):
+    """Merge duplicates of one object found by several overlapping tiles
+
+    Detections are visited by descending confidence. A detection of the same
+    class from another tile is merged into a kept one when their IoU reaches
+    iou_threshold, or when at least containment_threshold of the smaller box
+    lies inside the other (an object cut off at a tile edge). The kept box
+    grows to cover both. Detections of one tile already went through the
+    model's NMS and are never merged with each other.
+
+    Args:
+        detections: [x1, y1, x2, y2, confidence, class_id, class_name, tile index] lists in frame pixels
+
+    Returns:
+        list: Merged detections in the same format
+    """
+    kept = []
+    for detection in sorted(detections, key=lambda d: d[4], reverse=True):
+        x1, y1, x2, y2 = detection[:4]
+        area = max(0, x2 - x1) * max(0, y2 - y1)
+        for other in kept:
+            if other[5] != detection[5] or other[7] == detection[7]:
+                continue
+            inter_w = min(x2, other[2]) - max(x1, other[0])
+            inter_h = min(y2, other[3]) - max(y1, other[1])
+            if inter_w <= 0 or inter_h <= 0:
+                continue
+            intersection = inter_w * inter_h
+            other_area = (other[2] - other[0]) * (other[3] - other[1])
+            union = area + other_area - intersection
+            smaller = min(area, other_area)
+            if (union > 0 and intersection / union >= iou_threshold) or \
+                    (smaller > 0 and intersection / smaller >= containment_threshold):
+                other[0], other[1] = min(other[0], x1), min(other[1], y1)
+                other[2], other[3] = max(other[2], x2), max(other[3], y2)
+                break
+        else:
+            kept.append(list(detection))
+    return kept
+
+class MotionGate:
+    """Pick the tiles that changed since the previous inference"""
+
+    def __init__(self):
+        self.reference = None
+
+    def moving_tiles(self, frame, tiles, keep_boxes=()):
+        """Get the tiles with motion or with one of keep_boxes (e.g. live tracks) in them
+
+        The first frame, and any frame after a size change, passes all tiles.
+        """
+        height, width = frame.shape[:2]
+        scale = MOTION_WIDTH / float(width)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.GaussianBlur(cv2.resize(gray, (MOTION_WIDTH, max(1, int(height * scale))),
+                                            interpolation=cv2.INTER_AREA), (5, 5), 0)
+        reference, self.reference = self.reference, small
+        if reference is None or reference.shape != small.shape:
+            return list(tiles)
+
+        changed = cv2.absdiff(small, reference) > MOTION_THRESHOLD
+        selected = []
+        for tile in tiles:
+            if any(rects_overlap(tile, box) for box in keep_boxes):
+                selected.append(tile)
+                continue
+            x1, y1, x2, y2 = (int(value * scale) for value in tile)
+            region = changed[y1:max(y2, y1 + 1), x1:max(x2, x1 + 1)]
+            if region.size and np.count_nonzero(region) >= MOTION_MIN_SHARE * region.size:
+                selected.append(tile)
+        return selected
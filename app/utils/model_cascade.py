@@ -0,0 +1,252 @@
+"""
+Two-stage detection cascade
+
+A camera with a confirmation model runs its own (small, fast) model on every
+frame and only sends what it finds to the larger model. Each candidate is
+cut out of the frame with some context and handed to the ConfirmationQueue,
+which is shared by all cameras: it collects the crops of concurrent requests
+for a few milliseconds and runs them through each confirmation model as one
+batch, so the heavy model is loaded once and the GPU sees few large calls
+instead of many small ones. A candidate counts as confirmed when the heavy
+model finds the same class at the same place; only confirmed detections are
+tracked, stored and notified about.
+"""
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CONFIRM_MODEL_CONFIDENCE = 0.25  # Confidence the confirmation model reports from, cameras apply their own threshold
+CONFIRM_CROP_PADDING = 0.5  # Share of a candidate's size kept around it in the confirmation crop
+CONFIRM_CROP_MIN_PADDING = 32  # Minimum padding in pixels
+CONFIRM_MIN_IOU = 0.3  # Overlap a confirming detection needs with the candidate
+REJECT_HOLD = 5.0  # Seconds a rejected box is not escalated again (static false alarms)
+REJECT_MIN_IOU = 0.5  # Overlap with a rejected box of the same class to be held back
+
+def confirmation_crop(box, width, height):
+    """Get the (x1, y1, x2, y2) crop a candidate (x1, y1, x2, y2) box is confirmed on"""
+    pad_x = max(CONFIRM_CROP_MIN_PADDING, (box[2] - box[0]) * CONFIRM_CROP_PADDING)
+    pad_y = max(CONFIRM_CROP_MIN_PADDING, (box[3] - box[1]) * CONFIRM_CROP_PADDING)
+    return (int(max(0, box[0] - pad_x)), int(max(0, box[1] - pad_y)),
+            int(min(width, box[2] + pad_x)), int(min(height, box[3] + pad_y)))
+
+class ConfirmRequest:
+    """Crops of one camera frame waiting for a confirmation model"""
+
+    def __init__(self, model_path, images, alone=False):
+        self.model_path = model_path
+        self.images = images
+        self.alone = alone  # Run in a model call of its own instead of a shared batch
+        self.future = Future()
+        self.seconds = 0.0  # This request's share of the batch inference time
+
+class ConfirmationQueue:
+    """Run confirmation crops of all cameras through the heavy models in shared batches"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """Get singleton instance, started on first use"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from app import app
+                    confirmation_queue = ConfirmationQueue(
+                        max_batch=app.config.get('CASCADE_BATCH_SIZE', 8),
+                        max_wait=app.config.get('CASCADE_BATCH_WAIT', 0.02)
+                    )
+                    confirmation_queue.start()
+                    cls._instance = confirmation_queue
+        return cls._instance
+
+    def __init__(self, max_batch=8, max_wait=0.02):
+        """Initialize confirmation queue
+
+        Args:
+            max_batch: Crops collected into one model call
+            max_wait: Seconds the first request waits for others to share its batch
+        """
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait)
+        self.models = {}  # model path -> loaded model
+        self.load_lock = threading.Lock()
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.requests = 0
+        self.batches = 0
+        self.images = 0
+        self.seconds = 0.0
+        self.timeouts = 0
+        self.failures = 0
+        self.measured = 0  # Requests run alone to measure the model
+
+    def start(self):
+        """Start the batching thread"""
+        if self.running:
+            return False
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="confirmation-queue")
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stop the batching thread, waiting requests fail"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout=2.0)
+        return True
+
+    def load(self, model_path, loader):
+        """Load a confirmation model once for all cameras that use it
+
+        Args:
+            model_path: Path of the model file
+            loader: Callable loading a model from its path
+        """
+        with self.load_lock:
+            model = self.models.get(model_path)
+            if model is None:
+                model = loader(model_path)
+                model.conf = CONFIRM_MODEL_CONFIDENCE
+                model.classes = None  # The loader may have applied a camera's class filter
+                self.models[model_path] = model
+        return model
+
+    def confirm(self, model_path, images, timeout=2.0, alone=False):
+        """Run crops through a loaded confirmation model
+
+        Args:
+            model_path: Path of a model passed to load() before
+            images: BGR crops
+            timeout: Seconds to wait for the result
+            alone: Run the images in a model call of their own, so that
+                   request.seconds is their full inference time
+
+        Returns:
+            ConfirmRequest: Finished request, its future holds one detections table per crop
+
+        Raises:
+            TimeoutError: If the batch did not finish in time
+        """
+        request = ConfirmRequest(model_path, images, alone)
+        with self.condition:
+            if not self.running:
+                raise RuntimeError("Confirmation queue is not running")
+            self.pending.append(request)
+            self.condition.notify()
+
+        try:
+            request.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Dropped from the queue unless its batch is already running
+            request.future.cancel()
+            with self.condition:
+                self.timeouts += 1
+            raise TimeoutError(f"Confirmation took longer than {timeout} seconds")
+        return request
+
+    def _collect(self):
+        """Wait for a request and the ones that can share its batch"""
+        with self.condition:
+            while self.running and not self.pending:
+                self.condition.wait(timeout=1.0)
+            if not self.running:
+                for request in self.pending:
+                    request.future.cancel()
+                self.pending.clear()
+                return None
+
+            if self.pending[0].alone:
+                request = self.pending.popleft()
+                return [request] if request.future.set_running_or_notify_cancel() else []
+
+            deadline = time.time() + self.max_wait
+            while self.running and sum(len(r.images) for r in self.pending) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(timeout=remaining)
+
+            batch, size = [], 0
+            while (self.pending and not self.pending[0].alone
+                   and (not batch or size + len(self.pending[0].images) <= self.max_batch)):
+                request = self.pending.popleft()
+                # Requests whose camera gave up waiting are skipped
+                if request.future.set_running_or_notify_cancel():
+                    batch.append(request)
+                    size += len(request.images)
+            return batch
+
+    def _run(self):
+        """Batching loop"""
+        while self.running:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            by_model = {}
+            for request in batch:
+                by_model.setdefault(request.model_path, []).append(request)
+
+            for model_path, requests in by_model.items():
+                images = [image for request in requests for image in request.images]
+                try:
+                    started = time.perf_counter()
+                    tables = self.models[model_path](images).pandas().xyxy
+                    elapsed = time.perf_counter() - started
+                except Exception as e:
+                    logger.error(f"Error running confirmation model {model_path}: {str(e)}")
+                    with self.condition:
+                        self.failures += len(requests)
+                    for request in requests:
+                        request.future.set_exception(e)
+                    continue
+
+                with self.condition:
+                    if requests[0].alone:
+                        self.measured += 1
+                    else:
+                        self.requests += len(requests)
+                        self.batches += 1
+                        self.images += len(images)
+                        self.seconds += elapsed
+
+                start = 0
+                for request in requests:
+                    count = len(request.images)
+                    request.seconds = elapsed * count / len(images)
+                    request.future.set_result(tables[start:start + count])
+                    start += count
+
+    def get_stats(self):
+        """Get queue statistics"""
+        with self.condition:
+            return {
+                'running': self.running,
+                'models': list(self.models),
+                'queued': len(self.pending),
+                'requests': self.requests,
+                'batches': self.batches,
+                'images': self.images,
+                'avg_batch_images': round(self.images / self.batches, 2) if self.batches else 0,
+                'seconds_per_image': round(self.seconds / self.images, 4) if self.images else None,
+                'timeouts': self.timeouts,
+                'failures': self.failures,
+                'measured': self.measured
+            }
+
+def crop_images(frame, rects):
+    """Cut (x1, y1, x2, y2) rects out of a frame as contiguous images"""
+    return [np.ascontiguousarray(frame[y1:y2, x1:x2]) for x1, y1, x2, y2 in rects]
@@ -1,6 +1,8 @@
 import smtplib
 import os
 import json
+import queue
+import threading
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
@@ -107,6 +109,99 @@ def send_detection_email(camera, detection):
         logger.error(f"Error sending email notification: {str(e)}")
         return False
 
+class DetectionNotifier:
+    """Send detection notifications on a background thread
+
+    Inference and database writer threads only queue the stored detections, so
+    a slow or unreachable SMTP server never delays them. The queue is bounded;
+    notifications arriving while it is full are dropped.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """Get singleton instance, started on first use"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from app import app
+                    notifier = DetectionNotifier(queue_size=app.config.get('NOTIFICATION_QUEUE_SIZE', 256))
+                    notifier.start()
+                    cls._instance = notifier
+        return cls._instance
+
+    def __init__(self, queue_size=256):
+        """Initialize detection notifier
+
+        Args:
+            queue_size: Detection batches waiting to be sent before new ones are dropped
+        """
+        self.jobs = queue.Queue(maxsize=max(1, queue_size))
+        self.running = False
+        self.thread = None
+        self.sent = 0
+        self.dropped = 0
+
+    def start(self):
+        """Start the sender thread"""
+        if self.running:
+            return False
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='detection-notifier')
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def stop(self, timeout=5.0):
+        """Stop the sender thread after the queued notifications"""
+        self.running = False
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=timeout)
+        return True
+
+    def submit(self, camera, detections):
+        """Queue notifications for stored detections without blocking
+
+        Returns:
+            bool: True if queued, False if the queue was full
+        """
+        try:
+            self.jobs.put_nowait((camera, detections))
+            return True
+        except queue.Full:
+            self.dropped += len(detections)
+            logger.warning(f"Notification queue full, dropped {len(detections)} notifications for camera {camera.id}")
+            return False
+
+    def _run(self):
+        """Sender loop, drains the queue before exiting"""
+        from app import app
+
+        while self.running or not self.jobs.empty():
+            try:
+                camera, detections = self.jobs.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            with app.app_context():
+                for detection in detections:
+                    try:
+                        if send_detection_email(camera, detection):
+                            self.sent += 1
+                    except Exception as e:
+                        logger.error(f"Error sending notification: {str(e)}")
+
+    def get_stats(self):
+        """Get notifier statistics"""
+        return {
+            'running': self.running,
+            'queued': self.jobs.qsize(),
+            'sent': self.sent,
+            'dropped': self.dropped
+        }
+
 def send_test_email(smtp_server, smtp_port, smtp_username, smtp_password, recipients):
     """
     Send a test email to verify SMTP configuration
@@ -0,0 +1,631 @@
+"""
+Offload of recordings and detection images to S3-compatible object storage
+
+Finished segments and detection images are uploaded to a bucket (AWS S3,
+MinIO, ...) with multipart uploads on a bounded worker pool; botocore retries
+individual requests and a failed file is retried on the next pass. Once an
+upload is verified, Recording.object_key is set, or DetectionImage.uploaded
+for an image file, which is tracked per file because a track's snapshot can
+be replaced long after its detection row was written. Local copies of uploaded
+footage are evicted after S3_EVICT_AFTER_DAYS, or earlier when the recordings
+disk passes the high watermark, always oldest-first. Eviction is recorded per
+file, so a segment whose upload keeps failing stays on disk without holding
+back the eviction of anything else.
+
+Evicted segments are served either by redirecting the player to a presigned
+URL or by proxying them through a local read-through cache, so recently
+played segments are read from disk again and range requests are answered by
+send_file. Requires boto3; offload stays disabled without it.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+    has_boto3 = True
+except ImportError:
+    has_boto3 = False
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+CACHE_FOLDER = os.path.join('storage', 'cache', 'objects')
+STATE_FILE = os.path.join('storage', 'cache', 'offload_state.json')  # Cursors of older versions, read by migrations
+
+def object_key_for(file_path, prefix=''):
+    """Get the object key for a local recordings file
+
+    Keys are relative to the storage tier root, so a segment keeps its key
+    when the tier mover moves it between tiers.
+    """
+    from app.utils.storage_tiers import get_tiers
+
+    path = os.path.abspath(file_path)
+    relative = None
+    for name, root in get_tiers():
+        if path.startswith(root + os.sep):
+            relative = os.path.relpath(path, root)
+            break
+    if relative is None:
+        relative = os.path.relpath(path, os.path.abspath('storage'))
+        if relative.startswith('..'):
+            relative = os.path.join('external', os.path.basename(path))
+
+    key = relative.replace(os.sep, '/')
+    return f"{prefix.strip('/')}/{key}" if prefix else key
+
+class ObjectStore:
+    """S3-compatible bucket client with a local read-through cache"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """Get singleton instance"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from app import app
+                    cls._instance = ObjectStore(
+                        bucket=app.config.get('S3_BUCKET', ''),
+                        endpoint_url=app.config.get('S3_ENDPOINT_URL') or None,
+                        region=app.config.get('S3_REGION', 'us-east-1'),
+                        access_key=app.config.get('S3_ACCESS_KEY') or None,
+                        secret_key=app.config.get('S3_SECRET_KEY') or None,
+                        prefix=app.config.get('S3_PREFIX', ''),
+                        multipart_mb=app.config.get('S3_MULTIPART_MB', 16),
+                        retries=app.config.get('S3_RETRIES', 5),
+                        serve_mode=app.config.get('S3_SERVE_MODE', 'proxy'),
+                        cache_bytes=app.config.get('S3_CACHE_MB', 2048) * 1024 * 1024,
+                        max_connections=app.config.get('S3_UPLOAD_CONCURRENCY', 4) * 4
+                    )
+        return cls._instance
+
+    def __init__(self, bucket, endpoint_url=None, region='us-east-1', access_key=None, secret_key=None,
+                 prefix='', multipart_mb=16, retries=5, serve_mode='proxy', cache_bytes=2048 * 1024 * 1024,
+                 max_connections=16, cache_folder=CACHE_FOLDER):
+        """Initialize object store client
+
+        Args:
+            bucket: Bucket name, offload is disabled when empty
+            endpoint_url: Endpoint of an S3-compatible server (None for AWS)
+            region: Bucket region
+            access_key: Access key (None to use the default credential chain)
+            secret_key: Secret key
+            prefix: Key prefix for everything this NVR uploads
+            multipart_mb: Files larger than this are uploaded in parts of this size
+            retries: Attempts per request before an upload fails
+            serve_mode: 'proxy' (through the local cache) or 'redirect' (presigned URL)
+            cache_bytes: Size limit of the read-through cache
+            max_connections: HTTP connection pool size
+            cache_folder: Directory of the read-through cache
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self.serve_mode = serve_mode if serve_mode in ('proxy', 'redirect') else 'proxy'
+        self.cache_bytes = cache_bytes
+        self.cache_folder = cache_folder
+        self.client = None
+        self.transfer_config = None
+        self.fetch_locks = {}  # key -> [lock, callers holding or waiting for it]
+        self.cache_files = None  # path -> size, least recently played first; scanned on first use
+        self.cache_used = 0
+        self.lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        if bucket and not has_boto3:
+            logger.error("S3_BUCKET is set but boto3 is not installed, object storage offload disabled")
+        elif bucket:
+            self.client = boto3.client(
+                's3',
+                endpoint_url=endpoint_url,
+                region_name=region,
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                config=BotoConfig(
+                    retries={'max_attempts': retries, 'mode': 'standard'},
+                    max_pool_connections=max_connections,
+                    # Self-hosted servers usually do not have per-bucket DNS names
+                    s3={'addressing_style': 'path' if endpoint_url else 'auto'}
+                )
+            )
+            part_size = max(5, multipart_mb) * 1024 * 1024  # S3 minimum part size is 5 MB
+            self.transfer_config = TransferConfig(
+                multipart_threshold=part_size,
+                multipart_chunksize=part_size,
+                max_concurrency=2  # Parts in flight per file, files are spread over the offloader pool
+            )
+
+    def enabled(self):
+        """Check that a bucket is configured and boto3 is available"""
+        return self.client is not None
+
+    def key_for(self, file_path):
+        """Get the object key for a local file"""
+        return object_key_for(file_path, self.prefix)
+
+    def upload(self, file_path, key, content_type=None):
+        """Upload a file and verify the stored size
+
+        Returns:
+            bool: True if the object is stored completely
+        """
+        extra_args = {'ContentType': content_type} if content_type else None
+        size = os.path.getsize(file_path)
+        self.client.upload_file(file_path, self.bucket, key, ExtraArgs=extra_args, Config=self.transfer_config)
+        stored = self.client.head_object(Bucket=self.bucket, Key=key)
+        return stored.get('ContentLength') == size
+
+    def delete_keys(self, keys):
+        """Delete objects, up to 1000 per request"""
+        keys = [key for key in keys if key]
+        for start in range(0, len(keys), 1000):
+            batch = keys[start:start + 1000]
+            try:
+                self.client.delete_objects(Bucket=self.bucket, Delete={
+                    'Objects': [{'Key': key} for key in batch],
+                    'Quiet': True
+                })
+            except Exception as e:
+                logger.error(f"Error deleting {len(batch)} objects from {self.bucket}: {str(e)}")
+
+    def presigned_url(self, key, expires=3600, download_name=None):
+        """Get a temporary URL the browser can read the object from directly"""
+        params = {'Bucket': self.bucket, 'Key': key}
+        if download_name:
+            params['ResponseContentDisposition'] = f'attachment; filename="{download_name}"'
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires)
+
+    def fetch(self, key):
+        """Get a local copy of an object through the read-through cache
+
+        Returns:
+            str: Path of the cached file
+        """
+        path = os.path.abspath(os.path.join(self.cache_folder, *key.split('/')))
+
+        with self.lock:
+            entry = self.fetch_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+
+        try:
+            # Concurrent requests for the same segment wait for one download
+            with entry[0]:
+                if os.path.exists(path):
+                    self.cache_hits += 1
+                    os.utime(path)  # Recently played segments stay cached longest
+                    self._cache_used(path)
+                    return path
+
+                self.cache_misses += 1
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.part"
+                try:
+                    self.client.download_file(self.bucket, key, tmp_path, Config=self.transfer_config)
+                    os.replace(tmp_path, path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                # The lock is only dropped once nobody waits on it, otherwise a
+                # new caller could start a second download of the same key
+                if entry[1] == 0 and self.fetch_locks.get(key) is entry:
+                    del self.fetch_locks[key]
+
+        self._cache_used(path, added=True)
+        return path
+
+    def _cache_used(self, path, added=False):
+        """Mark a cache file as most recently played and trim the cache to its size limit
+
+        The cache size is kept up to date as files are added and deleted; the
+        cache folder is only scanned once, for files left by an earlier run.
+        """
+        removed = []
+        with self.lock:
+            if self.cache_files is None:
+                self.cache_files = self._scan_cache()
+                self.cache_used = sum(self.cache_files.values())
+
+            if added or path not in self.cache_files:
+                try:
+                    size = os.path.getsize(path)
+                except FileNotFoundError:
+                    return
+                self.cache_used += size - self.cache_files.pop(path, 0)
+                self.cache_files[path] = size
+            else:
+                self.cache_files.move_to_end(path)
+
+            # The file just played is kept even if it alone exceeds the limit
+            while self.cache_used > self.cache_bytes and len(self.cache_files) > 1:
+                oldest, size = self.cache_files.popitem(last=False)
+                self.cache_used -= size
+                removed.append(oldest)
+
+        for oldest in removed:
+            try:
+                os.remove(oldest)
+            except FileNotFoundError:
+                pass
+
+    def _scan_cache(self):
+        """List the cached files, least recently played first"""
+        files = []
+        pending = [self.cache_folder]
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False) and not entry.name.endswith('.part'):
+                            stat = entry.stat()
+                            files.append((stat.st_mtime, os.path.abspath(entry.path), stat.st_size))
+            except FileNotFoundError:
+                continue
+
+        return OrderedDict((path, size) for mtime, path, size in sorted(files))
+
+    def send(self, key, mimetype=None, download_name=None):
+        """Build a response serving an object by redirect or from the cache"""
+        from flask import redirect, send_file
+
+        if self.serve_mode == 'redirect':
+            return redirect(self.presigned_url(key, download_name=download_name))
+
+        path = self.fetch(key)
+        if download_name:
+            return send_file(path, as_attachment=True, download_name=download_name, mimetype=mimetype)
+        return send_file(path, mimetype=mimetype, conditional=True)
+
+    def get_stats(self):
+        """Get client and cache statistics"""
+        return {
+            'enabled': self.enabled(),
+            'bucket': self.bucket,
+            'serve_mode': self.serve_mode,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_used_bytes': self.cache_used,
+            'cache_limit_bytes': self.cache_bytes
+        }
+
+class ObjectOffloader:
+    """Upload finished footage to the object store and evict local copies"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """Get singleton instance"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from app import app
+                    cls._instance = ObjectOffloader(
+                        ObjectStore.get_instance(),
+                        interval=app.config.get('S3_INTERVAL', 60),
+                        concurrency=app.config.get('S3_UPLOAD_CONCURRENCY', 4),
+                        evict_after_days=app.config.get('S3_EVICT_AFTER_DAYS', 1),
+                        high_watermark=app.config.get('DISK_HIGH_WATERMARK', 90),
+                        low_watermark=app.config.get('DISK_LOW_WATERMARK', 80)
+                    )
+        return cls._instance
+
+    def __init__(self, store, interval=60, concurrency=4, evict_after_days=1, high_watermark=90,
+                 low_watermark=80, batch_size=200):
+        """Initialize offloader
+
+        Args:
+            store: ObjectStore to upload to
+            interval: Seconds between offload passes
+            concurrency: Files uploaded in parallel
+            evict_after_days: Age after which uploaded local copies are deleted (negative to keep them)
+            high_watermark: Recordings disk usage percent that starts evicting uploaded copies early
+            low_watermark: Disk usage percent early eviction stops at
+            batch_size: Rows handled per query
+        """
+        self.store = store
+        self.interval = interval
+        self.concurrency = max(1, concurrency)
+        self.evict_after_days = evict_after_days
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.batch_size = max(1, batch_size)
+        self.running = False
+        self.thread = None
+        self.last_run = None
+        self.uploaded = 0
+        self.bytes_uploaded = 0
+        self.upload_failures = 0
+        self.evicted = 0
+        self.bytes_evicted = 0
+
+    def enabled(self):
+        """Check that the object store is usable"""
+        return self.store.enabled()
+
+    def start(self):
+        """Start the offloader thread"""
+        if self.running or not self.enabled():
+            return False
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info(f"Started object storage offload to bucket {self.store.bucket}")
+        return True
+
+    def stop(self):
+        """Stop the offloader thread after the current batch"""
+        self.running = False
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5.0)
+        return True
+
+    def _run(self):
+        """Offloader loop"""
+        from app import app, db
+
+        while self.running:
+            try:
+                with app.app_context():
+                    self.run_once(db.session)
+            except Exception as e:
+                logger.error(f"Error in object storage offload: {str(e)}")
+
+            deadline = time.time() + self.interval
+            while self.running and time.time() < deadline:
+                time.sleep(1)
+
+    def _active(self):
+        """Keep working unless the offloader thread was asked to stop (direct calls always run)"""
+        return self.running or self.thread is None
+
+    def run_once(self, session):
+        """Upload new recordings and images, then evict expired local copies"""
+        if not self.enabled():
+            return
+        self.upload_recordings(session)
+        self.upload_images(session)
+        cutoff = None
+        if self.evict_after_days >= 0:
+            cutoff = datetime.now() - timedelta(days=self.evict_after_days)
+        stop_below = self.low_watermark if self._disk_percent() >= self.high_watermark else None
+        if cutoff is not None or stop_below is not None:
+            self.evict(session, cutoff=cutoff, stop_below=stop_below)
+        self.last_run = datetime.now()
+
+    def _upload_file(self, file_path, key, content_type):
+        """Upload one file, returns its size or None on failure"""
+        try:
+            if self.store.upload(file_path, key, content_type):
+                return os.path.getsize(file_path)
+            logger.error(f"Uploaded object {key} does not match {file_path}")
+        except Exception as e:
+            logger.error(f"Error uploading {file_path}: {str(e)}")
+        self.upload_failures += 1
+        return None
+
+    def upload_recordings(self, session):
+        """Upload recordings that have no object yet
+
+        Returns:
+            int: Recordings uploaded
+        """
+        from app.models.recording import Recording
+
+        uploaded = 0
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while self._active():
+                batch = session.query(Recording.id, Recording.file_path).filter(
+                    Recording.object_key.is_(None), Recording.id > last_id
+                ).order_by(Recording.id.asc()).limit(self.batch_size).all()
+                if not batch:
+                    break
+                last_id = batch[-1].id
+
+                keys = {}
+                futures = {}
+                for row in batch:
+                    if not os.path.exists(row.file_path):
+                        keys[row.id] = ''  # Nothing left to upload
+                        continue
+                    keys[row.id] = self.store.key_for(row.file_path)
+                    futures[row.id] = pool.submit(self._upload_file, row.file_path, keys[row.id], 'video/mp4')
+
+                for recording_id, future in futures.items():
+                    size = future.result()
+                    if size is None:
+                        del keys[recording_id]  # Retried on the next pass
+                    else:
+                        uploaded += 1
+                        self.uploaded += 1
+                        self.bytes_uploaded += size
+
+                try:
+                    for recording_id, key in keys.items():
+                        session.query(Recording).filter(Recording.id == recording_id).update(
+                            {Recording.object_key: key}, synchronize_session=False)
+                    session.commit()
+                except Exception as e:
+                    session.rollback()
+                    logger.error(f"Error saving object keys: {str(e)}")
+                    break
+
+        return uploaded
+
+    def upload_images(self, session):
+        """Upload image files that are not in the object store yet
+
+        Files the snapshot writer has not written yet and failed uploads stay
+        marked as not uploaded and are retried on the next pass.
+
+        Returns:
+            int: Images uploaded
+        """
+        from app.models.detection_image import DetectionImage
+
+        uploaded = 0
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while self._active():
+                batch = session.query(DetectionImage.id, DetectionImage.path).filter(
+                    DetectionImage.uploaded == False, DetectionImage.id > last_id  # noqa: E712
+                ).order_by(DetectionImage.id.asc()).limit(self.batch_size).all()
+                if not batch:
+                    break
+                last_id = batch[-1].id
+
+                futures = {row.id: pool.submit(self._upload_file, row.path, self.store.key_for(row.path), 'image/jpeg')
+                           for row in batch if os.path.exists(row.path)}
+                done = [image_id for image_id, future in futures.items() if future.result() is not None]
+                uploaded += len(done)
+
+                try:
+                    if done:
+                        session.query(DetectionImage).filter(DetectionImage.id.in_(done)).update(
+                            {DetectionImage.uploaded: True}, synchronize_session=False)
+                    session.commit()
+                except Exception as e:
+                    session.rollback()
+                    logger.error(f"Error marking uploaded images: {str(e)}")
+                    break
+
+        return uploaded
+
+    def _disk_percent(self):
+        """Get the usage percent of the recordings volume"""
+        from app.utils.storage_tiers import get_tiers
+
+        root = get_tiers()[0][1]
+        return psutil.disk_usage(root if os.path.exists(root) else '.').percent
+
+    def _evict_file(self, path):
+        """Delete an uploaded local copy, returns the bytes freed"""
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            logger.error(f"Error evicting {path}: {str(e)}")
+            return 0
+        self.evicted += 1
+        self.bytes_evicted += size
+        return size
+
+    def evict(self, session, cutoff=None, stop_below=None):
+        """Delete local copies of uploaded footage oldest-first
+
+        Copies are deleted while they are older than cutoff, or while disk usage
+        is above stop_below. Only files with a verified upload are considered.
+
+        Returns:
+            int: Bytes freed
+        """
+        from app.models.detection_image import DetectionImage
+        from app.models.recording import Recording
+
+        if not self.enabled():
+            return 0
+
+        def keep_going(timestamp):
+            if cutoff is not None and timestamp < cutoff:
+                return True
+            return stop_below is not None and self._disk_percent() > stop_below
+
+        freed = 0
+
+        while self._active():
+            batch = session.query(Recording.id, Recording.file_path, Recording.timestamp).filter(
+                Recording.object_key.isnot(None), Recording.evicted == False  # noqa: E712
+            ).order_by(Recording.timestamp.asc()).limit(self.batch_size).all()
+            if not batch:
+                break
+
+            done = False
+            evicted = []
+            for row in batch:
+                if not keep_going(row.timestamp):
+                    done = True
+                    break
+                freed += self._evict_file(row.file_path)
+                evicted.append(row.id)
+            try:
+                if evicted:
+                    session.query(Recording).filter(Recording.id.in_(evicted)).update(
+                        {Recording.evicted: True}, synchronize_session=False)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Error marking evicted recordings: {str(e)}")
+                break
+            if done:
+                break
+
+        while self._active():
+            batch = session.query(DetectionImage.id, DetectionImage.path, DetectionImage.last_used).filter(
+                DetectionImage.uploaded == True, DetectionImage.evicted == False  # noqa: E712
+            ).order_by(DetectionImage.last_used.asc()).limit(self.batch_size).all()
+            if not batch:
+                break
+
+            done = False
+            evicted = []
+            for row in batch:
+                if not keep_going(row.last_used):
+                    done = True
+                    break
+                freed += self._evict_file(row.path)
+                evicted.append(row.id)
+            try:
+                if evicted:
+                    session.query(DetectionImage).filter(DetectionImage.id.in_(evicted)).update(
+                        {DetectionImage.evicted: True}, synchronize_session=False)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Error marking evicted images: {str(e)}")
+                break
+            if done:
+                break
+
+        return freed
+
+    def image_uploaded(self, image_path):
+        """Check whether an image file has been uploaded"""
+        from app import db
+        from app.models.detection_image import DetectionImage
+
+        return bool(db.session.query(DetectionImage.uploaded).filter(DetectionImage.path == image_path).scalar())
+
+    def get_stats(self):
+        """Get offload statistics"""
+        stats = self.store.get_stats()
+        stats.update({
+            'running': self.running,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'uploaded': self.uploaded,
+            'bytes_uploaded': self.bytes_uploaded,
+            'upload_failures': self.upload_failures,
+            'evicted': self.evicted,
+            'bytes_evicted': self.bytes_evicted
+        })
+        return stats
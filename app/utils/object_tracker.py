@@ -0,0 +1,303 @@
+"""
+Multi-object tracking for the detection stage
+
+Detections of consecutive inferences are associated to tracks by IoU against
+each track's predicted box. Every track carries a constant-velocity Kalman
+filter over its box center, area and aspect ratio (as in SORT), so a moving
+object still matches its track when it has moved by more than its own size
+between two inferences, or was missed for a few frames.
+
+The camera processor only persists track lifecycle changes: a Detection row,
+snapshot and notification when a track is confirmed, an in-place update at
+most every best_interval seconds while the object stays in view (with a new
+snapshot if a better frame was seen) and once more when the track ends, and
+nothing for the frames in between.
+"""
+import time
+import logging
+import threading
+from datetime import datetime
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def iou(box_a, box_b):
+    """Intersection over union of two (x1, y1, x2, y2) boxes"""
+    x1 = max(box_a[0], box_b[0])
+    y1 = max(box_a[1], box_b[1])
+    x2 = min(box_a[2], box_b[2])
+    y2 = min(box_a[3], box_b[3])
+    intersection = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    if intersection <= 0:
+        return 0.0
+    area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+    area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+    return intersection / float(area_a + area_b - intersection)
+
+def center_distance(box_a, box_b):
+    """Distance between the centers of two boxes in units of the larger box diagonal"""
+    dx = (box_a[0] + box_a[2] - box_b[0] - box_b[2]) / 2
+    dy = (box_a[1] + box_a[3] - box_b[1] - box_b[3]) / 2
+    diagonal = max(np.hypot(box_a[2] - box_a[0], box_a[3] - box_a[1]),
+                   np.hypot(box_b[2] - box_b[0], box_b[3] - box_b[1]), 1.0)
+    return float(np.hypot(dx, dy) / diagonal)
+
+class BoxKalmanFilter:
+    """Constant-velocity Kalman filter over a box as (center x, center y, area, aspect ratio)
+
+    The aspect ratio is modelled as constant. Steps are measured in seconds so
+    irregular inference intervals predict the right distance.
+    """
+
+    def __init__(self, box):
+        self.x = np.zeros((7, 1))
+        self.x[:4] = self._measurement(box)
+        # High uncertainty for the unobserved velocities
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 1e4, 1e4, 1e4])
+        self.R = np.diag([1.0, 1.0, 10.0, 0.01])
+        self.H = np.zeros((4, 7))
+        self.H[:4, :4] = np.eye(4)
+
+    def _measurement(self, box):
+        """Convert an (x1, y1, x2, y2) box to the measurement vector"""
+        width = max(1.0, box[2] - box[0])
+        height = max(1.0, box[3] - box[1])
+        return np.array([[box[0] + width / 2], [box[1] + height / 2], [width * height], [width / height]])
+
+    def predict(self, dt):
+        """Advance the state by dt seconds"""
+        F = np.eye(7)
+        F[0, 4] = F[1, 5] = F[2, 6] = dt
+        # Process noise grows with the step so long gaps widen the search
+        Q = np.diag([1.0, 1.0, 1.0, 0.01, 10.0, 10.0, 1.0]) * max(dt, 1e-3)
+        if self.x[2, 0] + self.x[6, 0] * dt <= 0:
+            self.x[6, 0] = 0.0
+        self.x = F @ self.x
+        self.P = F @ self.P @ F.T + Q
+
+    def update(self, box):
+        """Correct the state with a measured box"""
+        y = self._measurement(box) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(7) - K @ self.H) @ self.P
+
+    def box(self):
+        """Get the current state as an (x1, y1, x2, y2) box"""
+        center_x, center_y, area, ratio = self.x[:4, 0]
+        area = max(area, 1.0)
+        ratio = max(ratio, 1e-3)
+        width = np.sqrt(area * ratio)
+        height = area / width
+        return (center_x - width / 2, center_y - height / 2, center_x + width / 2, center_y + height / 2)
+
+class Track:
+    """One tracked object"""
+
+    def __init__(self, track_id, detection, box, timestamp):
+        self.id = track_id
+        self.class_name = detection['class_name']
+        self.kalman = BoxKalmanFilter(box)
+        self.hits = 1
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.last_predict = timestamp
+        self.confirmed = False
+        self.first_detection = detection
+        self.detection = detection  # Latest matched detection
+        self.best = detection  # Highest confidence detection
+        self.best_frame = None  # Frame of the best detection, until it is written
+        self.best_written = None  # Confidence of the best detection that was persisted
+        self.best_written_time = None
+        self.image_path = None  # Snapshot of the persisted best detection
+
+    @property
+    def pending_best(self):
+        """Check that the best detection has not been persisted with a snapshot yet"""
+        return self.best_written is None or self.best['confidence'] > self.best_written
+
+class ObjectTracker:
+    """IoU and Kalman filter tracker for one camera"""
+
+    def __init__(self, iou_threshold=0.3, min_hits=2, max_age=2.0, best_interval=10.0, max_distance=1.5):
+        """Initialize tracker
+
+        Args:
+            iou_threshold: Minimum IoU between a detection and a predicted track box to match
+            max_distance: Center distance in box diagonals up to which non-overlapping boxes still match
+            min_hits: Matched inferences before a track is confirmed and reported
+            max_age: Seconds without a match before a track ends
+            best_interval: Minimum seconds between persisted updates of a track
+        """
+        self.iou_threshold = iou_threshold
+        self.min_hits = max(1, min_hits)
+        self.max_age = max_age
+        self.best_interval = best_interval
+        self.max_distance = max_distance
+        self.tracks = []
+        # Seeded from the clock so track ids stay unique across restarts
+        self.next_id = int(time.time() * 1000)
+        self.lock = threading.Lock()
+        self.detections_seen = 0
+        self.tracks_confirmed = 0
+
+    def _new_id(self):
+        """Get the next track id"""
+        self.next_id += 1
+        return self.next_id
+
+    def update(self, detections, frame=None, timestamp=None):
+        """Associate the detections of one inference with the tracks
+
+        Sets 'track_id' on every detection of a confirmed track.
+
+        Args:
+            detections: Detection dictionaries with bbox_x, bbox_y, bbox_width, bbox_height
+            frame: Frame the detections were made on, kept while it holds a track's best detection
+            timestamp: Time of the inference
+
+        Returns:
+            dict: Tracks by lifecycle change, 'appeared' (just confirmed), 'updated'
+                  (still in view, due to be persisted) and 'ended'
+        """
+        timestamp = timestamp or datetime.now()
+        changes = {'appeared': [], 'updated': [], 'ended': []}
+
+        with self.lock:
+            self.detections_seen += len(detections)
+
+            for track in self.tracks:
+                dt = (timestamp - track.last_predict).total_seconds()
+                track.kalman.predict(max(dt, 0.0))
+                track.last_predict = timestamp
+
+            boxes = [(d['bbox_x'], d['bbox_y'], d['bbox_x'] + d['bbox_width'], d['bbox_y'] + d['bbox_height'])
+                     for d in detections]
+
+            # Greedy matching by descending IoU, objects only match tracks of their class
+            predicted = [track.kalman.box() for track in self.tracks]
+            pairs = []
+            for t, track in enumerate(self.tracks):
+                for d, detection in enumerate(detections):
+                    if detection['class_name'] != track.class_name:
+                        continue
+                    overlap = iou(predicted[t], boxes[d])
+                    if overlap >= self.iou_threshold:
+                        pairs.append((overlap, t, d))
+            pairs.sort(reverse=True)
+
+            matched_tracks, matched_detections = set(), set()
+            for _, t, d in pairs:
+                if t in matched_tracks or d in matched_detections:
+                    continue
+                matched_tracks.add(t)
+                matched_detections.add(d)
+                self._match(self.tracks[t], detections[d], boxes[d], frame, timestamp, changes)
+
+            # A new track has no velocity yet, so an object moving more than its own
+            # size per inference only overlaps from its third frame on. The leftovers
+            # are matched by center distance relative to the box size instead.
+            pairs = []
+            for t, track in enumerate(self.tracks):
+                if t in matched_tracks:
+                    continue
+                for d, detection in enumerate(detections):
+                    if d in matched_detections or detection['class_name'] != track.class_name:
+                        continue
+                    distance = center_distance(predicted[t], boxes[d])
+                    if distance <= self.max_distance:
+                        pairs.append((distance, t, d))
+            pairs.sort()
+
+            for _, t, d in pairs:
+                if t in matched_tracks or d in matched_detections:
+                    continue
+                matched_tracks.add(t)
+                matched_detections.add(d)
+                self._match(self.tracks[t], detections[d], boxes[d], frame, timestamp, changes)
+
+            for d, detection in enumerate(detections):
+                if d not in matched_detections:
+                    track = Track(self._new_id(), detection, boxes[d], timestamp)
+                    track.best_frame = frame
+                    self.tracks.append(track)
+                    self._confirm(track, detection, changes)
+
+            live = []
+            for track in self.tracks:
+                if (timestamp - track.last_seen).total_seconds() > self.max_age:
+                    if track.confirmed:
+                        changes['ended'].append(track)
+                else:
+                    live.append(track)
+            self.tracks = live
+
+        return changes
+
+    def _match(self, track, detection, box, frame, timestamp, changes):
+        """Add a matched detection to a track"""
+        track.kalman.update(box)
+        track.hits += 1
+        track.last_seen = timestamp
+        track.detection = detection
+        if detection['confidence'] > track.best['confidence']:
+            track.best = detection
+            track.best_frame = frame
+
+        if not track.confirmed:
+            self._confirm(track, detection, changes)
+        elif (timestamp - track.best_written_time).total_seconds() >= self.best_interval:
+            changes['updated'].append(track)
+
+        if track.confirmed:
+            detection['track_id'] = track.id
+
+    def _confirm(self, track, detection, changes):
+        """Confirm a track once it has enough hits"""
+        if track.hits < self.min_hits:
+            return
+        track.confirmed = True
+        detection['track_id'] = track.id
+        self.tracks_confirmed += 1
+        changes['appeared'].append(track)
+
+    def mark_written(self, track, timestamp=None, best=True):
+        """Record that a track was persisted, with its best detection unless best is False"""
+        track.best_written_time = timestamp or datetime.now()
+        if best:
+            track.best_written = track.best['confidence']
+            track.best_frame = None
+
+    def flush(self):
+        """End all tracks, used when the camera stops
+
+        Returns:
+            list: Confirmed tracks that were live
+        """
+        with self.lock:
+            ended = [track for track in self.tracks if track.confirmed]
+            self.tracks = []
+        return ended
+
+    def predicted_boxes(self):
+        """Get the current (x1, y1, x2, y2) box estimate of every live track"""
+        with self.lock:
+            return [track.kalman.box() for track in self.tracks]
+
+    def is_tracked(self, class_name, box):
+        """Check whether an (x1, y1, x2, y2) box matches the predicted box of a live track of its class"""
+        with self.lock:
+            return any(track.class_name == class_name and iou(track.kalman.box(), box) >= self.iou_threshold
+                       for track in self.tracks)
+
+    def get_stats(self):
+        """Get tracker statistics"""
+        with self.lock:
+            return {
+                'active_tracks': sum(1 for track in self.tracks if track.confirmed),
+                'tentative_tracks': sum(1 for track in self.tracks if not track.confirmed),
+                'detections_seen': self.detections_seen,
+                'tracks_confirmed': self.tracks_confirmed
+            }
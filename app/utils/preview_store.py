@@ -0,0 +1,139 @@
+"""
+Segment thumbnails and scrub sprites
+
+The camera processor already decodes every frame for detection and live view.
+Every few seconds one of those frames is downscaled into a small tile and kept
+in memory for a little longer than a segment. When a segment finishes, the
+tiles covering its time range become one JPEG sprite sheet (a grid of tiles)
+plus a larger thumbnail, so previews never need a second decode of the file.
+
+The sprite layout (tile size, columns and the offset of every tile in the
+segment) is stored on the Recording row, letting the player fetch a single
+sprite image per segment and show the right tile while scrubbing.
+"""
+import os
+import math
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_FOLDER = os.path.join('storage', 'recordings', 'thumbnails')
+SPRITE_COLUMNS = 10
+
+def sprite_path_for(thumbnail_path):
+    """Get the sprite sheet path that belongs to a thumbnail"""
+    root, extension = os.path.splitext(thumbnail_path)
+    return f"{root}_sprite{extension}"
+
+class PreviewBuilder:
+    """Collect preview tiles from live frames and write them out per segment"""
+
+    def __init__(self, camera_id, interval=5, tile_width=160, thumbnail_width=320, retention=180, quality=70):
+        """Initialize preview builder
+
+        Args:
+            camera_id: Camera ID (names the output folder)
+            interval: Seconds between sprite tiles
+            tile_width: Sprite tile width in pixels, height keeps the aspect ratio
+            thumbnail_width: Thumbnail width in pixels
+            retention: Seconds of tiles kept in memory, must cover a segment plus finalization
+            quality: JPEG quality of thumbnails and sprites
+        """
+        self.camera_id = camera_id
+        self.interval = interval
+        self.tile_width = tile_width
+        self.thumbnail_width = thumbnail_width
+        self.retention = retention
+        self.quality = quality
+        self.tiles = deque()  # (timestamp, tile image, encoded thumbnail)
+        self.last_tile_time = None
+        self.lock = threading.Lock()
+
+    def _resize(self, frame, width):
+        """Downscale a frame to a width, keeping the aspect ratio with an even height"""
+        height, frame_width = frame.shape[:2]
+        target_height = max(2, int(round(height * width / frame_width / 2)) * 2)
+        return cv2.resize(frame, (width, target_height), interpolation=cv2.INTER_AREA)
+
+    def add_frame(self, frame, timestamp=None):
+        """Offer a decoded frame, a tile is only taken once per interval"""
+        timestamp = timestamp or datetime.now()
+        if self.last_tile_time and (timestamp - self.last_tile_time).total_seconds() < self.interval:
+            return False
+
+        try:
+            tile = self._resize(frame, self.tile_width)
+            ok, thumbnail = cv2.imencode('.jpg', self._resize(frame, self.thumbnail_width),
+                                         [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        except Exception as e:
+            logger.error(f"Error creating preview tile for camera {self.camera_id}: {str(e)}")
+            return False
+
+        with self.lock:
+            self.last_tile_time = timestamp
+            self.tiles.append((timestamp, tile, thumbnail.tobytes() if ok else None))
+            horizon = timestamp - timedelta(seconds=self.retention)
+            while self.tiles and self.tiles[0][0] < horizon:
+                self.tiles.popleft()
+        return True
+
+    def build(self, file_path, start_time, end_time=None):
+        """Write the thumbnail and sprite sheet for a finished segment
+
+        Args:
+            file_path: Segment file (names the preview files)
+            start_time: Wall clock start of the segment
+            end_time: Wall clock end of the segment (now if unknown)
+
+        Returns:
+            tuple: (thumbnail path, sprite layout dict), (None, None) without tiles
+        """
+        end_time = end_time or datetime.now()
+        with self.lock:
+            tiles = [tile for tile in self.tiles if start_time <= tile[0] < end_time]
+        if not tiles:
+            return None, None
+
+        # Tiles of different sizes (resolution change mid-segment) cannot share a grid
+        tile_height, tile_width = tiles[-1][1].shape[:2]
+        tiles = [tile for tile in tiles if tile[1].shape[:2] == (tile_height, tile_width)]
+
+        folder = os.path.join(PREVIEW_FOLDER, str(self.camera_id))
+        os.makedirs(folder, exist_ok=True)
+        thumbnail_path = os.path.abspath(os.path.join(folder, os.path.splitext(os.path.basename(file_path))[0] + '.jpg'))
+
+        try:
+            # The middle tile represents the segment better than its first frame
+            _, middle_tile, thumbnail = tiles[len(tiles) // 2]
+            if thumbnail is not None:
+                with open(thumbnail_path, 'wb') as f:
+                    f.write(thumbnail)
+            else:
+                cv2.imwrite(thumbnail_path, middle_tile, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+
+            columns = min(SPRITE_COLUMNS, len(tiles))
+            rows = math.ceil(len(tiles) / columns)
+            sprite = np.zeros((rows * tile_height, columns * tile_width, 3), dtype=np.uint8)
+            for index, (_, tile, _) in enumerate(tiles):
+                row, column = divmod(index, columns)
+                sprite[row * tile_height:(row + 1) * tile_height, column * tile_width:(column + 1) * tile_width] = tile
+            cv2.imwrite(sprite_path_for(thumbnail_path), sprite, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        except Exception as e:
+            logger.error(f"Error writing previews for {file_path}: {str(e)}")
+            return None, None
+
+        layout = {
+            'tile_width': tile_width,
+            'tile_height': tile_height,
+            'columns': columns,
+            'count': len(tiles),
+            'interval': self.interval,
+            'offsets': [round((tile[0] - start_time).total_seconds(), 2) for tile in tiles]
+        }
+        return thumbnail_path, layout
@@ -0,0 +1,299 @@
+"""
+Recording segment registration
+
+Each finished segment file is registered as one Recording row with its exact
+start time, duration, size and frame count, so playback can list and seek small
+segments directly instead of guessing from detection times.
+
+Segments being written are listed in a journal (one small file per open
+segment). After a crash, recovery only visits the journal entries, so its
+cost scales with the number of segments that were open, not with the size of
+the recording archive.
+"""
+import os
+import json
+import logging
+import subprocess
+from datetime import datetime, timedelta
+
+import cv2
+from sqlalchemy import case
+
+from app.utils.clip_export import index_segment
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FOLDER = os.path.join('storage', 'recordings', 'journal')
+
+def probe_segment(file_path):
+    """Read frame count and duration from a segment's container header
+
+    Only the index is read, no frames are decoded.
+
+    Returns:
+        tuple: (frame_count, duration_seconds), zeros if the file cannot be opened
+    """
+    cap = cv2.VideoCapture(file_path)
+    try:
+        if not cap.isOpened():
+            return 0, 0.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0
+        duration = frame_count / fps if fps > 0 else 0.0
+        return frame_count, duration
+    finally:
+        cap.release()
+
+def _journal_path(camera_id, file_path):
+    """Get the journal entry path for a segment file"""
+    return os.path.join(JOURNAL_FOLDER, f"{camera_id}_{os.path.basename(file_path)}.json")
+
+def open_segment(camera_id, file_path, start_time, recording_type='continuous'):
+    """Record that a segment file is being written"""
+    os.makedirs(JOURNAL_FOLDER, exist_ok=True)
+    journal_path = _journal_path(camera_id, file_path)
+    tmp_path = journal_path + '.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'camera_id': camera_id,
+                'file_path': os.path.abspath(file_path),
+                'start_time': start_time.isoformat(),
+                'recording_type': recording_type
+            }, f)
+        os.replace(tmp_path, journal_path)
+    except Exception as e:
+        logger.error(f"Error writing segment journal for {file_path}: {str(e)}")
+
+def close_segment(camera_id, file_path):
+    """Remove the journal entry of a segment that has been handled"""
+    try:
+        os.remove(_journal_path(camera_id, file_path))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error removing segment journal for {file_path}: {str(e)}")
+
+def remux_segment(source_path, target_path, ffmpeg_path='ffmpeg'):
+    """Copy a segment's packets into a new container without re-encoding
+
+    MP4 targets are written as fragmented MP4. The target is only replaced once
+    the remux has produced a non-empty file.
+
+    Returns:
+        bool: True if target_path was written
+    """
+    from app.utils.stream_recorder import find_ffmpeg
+
+    ffmpeg = find_ffmpeg(ffmpeg_path)
+    if not ffmpeg:
+        return False
+
+    root, extension = os.path.splitext(target_path)
+    tmp_path = f"{root}.remux{extension}"
+    command = [ffmpeg, '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+               '-i', source_path, '-map', '0', '-c', 'copy']
+    if extension == '.mp4':
+        command += ['-movflags', '+frag_keyframe+empty_moov+default_base_moof']
+    command.append(tmp_path)
+
+    try:
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=300)
+        if os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
+            os.replace(tmp_path, target_path)
+            return True
+    except Exception as e:
+        logger.error(f"Error remuxing segment {source_path}: {str(e)}")
+
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    return False
+
+def repair_segment(file_path, ffmpeg_path='ffmpeg'):
+    """Rewrite a truncated segment so it ends on its last complete packet
+
+    Remuxes with stream copy, so the cost is one sequential read and write of
+    the damaged file only.
+
+    Returns:
+        bool: True if the file was rewritten
+    """
+    return remux_segment(file_path, file_path, ffmpeg_path)
+
+def register_segment(session, camera_id, file_path, start_time, duration, file_size, frame_count,
+                     recording_type='continuous', thumbnail_path=None, sprite_info=None, keyframes=None,
+                     source_path=None, offset_shift=None):
+    """Insert the Recording row for a finished segment (run on the DatabaseWriter)
+
+    Detections and events reported while the segment was being written are
+    linked to the new row by the file they were recorded into. offset_shift
+    moves their video offsets back when the segment turned out to start later
+    than the recorder assumed while it was open.
+    """
+    from app.models.detection import Detection
+    from app.models.event import Event
+    from app.models.recording import Recording
+
+    recording = Recording(
+        camera_id=camera_id,
+        file_path=os.path.abspath(file_path),  # send_file resolves relative paths against the app package
+        timestamp=start_time,
+        duration=duration,
+        file_size=file_size,
+        frame_count=frame_count,
+        recording_type=recording_type,
+        thumbnail_path=thumbnail_path,
+        sprite_info=json.dumps(sprite_info) if sprite_info else None,
+        keyframe_index=json.dumps(keyframes) if keyframes else None
+    )
+    session.add(recording)
+    session.flush()
+
+    # The camera/time indexes narrow the scans to the segment's time range
+    paths = {recording.file_path}
+    if source_path:
+        paths.add(os.path.abspath(source_path))
+    window_start = start_time - timedelta(minutes=1)
+    window_end = start_time + timedelta(seconds=duration, minutes=1)
+    values = {Detection.recording_id: recording.id, Detection.video_path: recording.file_path}
+    if offset_shift:
+        values[Detection.video_offset] = case(
+            (Detection.video_offset.is_(None), None),
+            (Detection.video_offset > offset_shift, Detection.video_offset - offset_shift),
+            else_=0.0)
+    session.query(Detection).filter(
+        Detection.camera_id == camera_id,
+        Detection.timestamp >= window_start,
+        Detection.timestamp <= window_end,
+        Detection.video_path.in_(paths),
+        Detection.recording_id.is_(None)
+    ).update(values, synchronize_session=False)
+    values = {Event.recording_id: recording.id, Event.video_path: recording.file_path}
+    if offset_shift:
+        values[Event.video_offset] = case(
+            (Event.video_offset.is_(None), None),
+            (Event.video_offset > offset_shift, Event.video_offset - offset_shift),
+            else_=0.0)
+    session.query(Event).filter(
+        Event.camera_id == camera_id,
+        Event.start_time >= window_start,
+        Event.start_time <= window_end,
+        Event.video_path.in_(paths),
+        Event.recording_id.is_(None)
+    ).update(values, synchronize_session=False)
+    return recording
+
+def segment_finished(camera_id, file_path, start_time, end_time=None, frame_count=None,
+                     recording_type='continuous', source_path=None, previews=None, offset_shift=None):
+    """Queue registration of a finished segment file
+
+    Args:
+        camera_id: Camera ID
+        file_path: Path of the closed segment file
+        start_time: Wall clock time of the segment's first frame
+        end_time: Wall clock time of the segment's end (probed from the file if None)
+        frame_count: Frames written (probed from the file if None)
+        recording_type: Recording type stored on the row
+        source_path: File the segment was journaled under, if it was remuxed into file_path
+        previews: PreviewBuilder holding live frame tiles for the segment's time range
+        offset_shift: Seconds the segment started after the start video offsets were measured from
+
+    Returns:
+        Future or None: Resolves to the new Recording once committed
+    """
+    from app.utils.database import DatabaseWriter
+
+    journal_file = source_path or file_path
+    if not os.path.exists(file_path):
+        logger.warning(f"Finished segment missing, not registered: {file_path}")
+        close_segment(camera_id, journal_file)
+        return None
+
+    file_size = os.path.getsize(file_path)
+    if file_size == 0:
+        # Stream dropped before the first keyframe was written
+        os.remove(file_path)
+        close_segment(camera_id, journal_file)
+        return None
+
+    if frame_count is None or end_time is None:
+        probed_frames, probed_duration = probe_segment(file_path)
+        if probed_frames == 0 and end_time is None:
+            logger.warning(f"Segment has no readable frames, not registered: {file_path}")
+            close_segment(camera_id, journal_file)
+            return None
+        if frame_count is None:
+            frame_count = probed_frames
+        if end_time is None:
+            end_time = start_time + timedelta(seconds=probed_duration)
+
+    duration = max(0.0, (end_time - start_time).total_seconds())
+
+    thumbnail_path, sprite_info = None, None
+    if previews is not None:
+        thumbnail_path, sprite_info = previews.build(file_path, start_time, end_time)
+
+    # Read from the box headers only, lets clip exports start on a keyframe
+    keyframes = index_segment(file_path)
+
+    try:
+        future = DatabaseWriter.get_instance().submit(
+            register_segment, camera_id, file_path, start_time, duration, file_size, frame_count,
+            recording_type=recording_type, thumbnail_path=thumbnail_path, sprite_info=sprite_info,
+            keyframes=keyframes, source_path=source_path, offset_shift=offset_shift, shard=camera_id)
+    except Exception as e:
+        logger.error(f"Error registering segment {file_path}: {str(e)}")
+        return None
+
+    # Keep the journal entry until the row is committed so a crash in between is recovered
+    future.add_done_callback(
+        lambda f: close_segment(camera_id, journal_file) if f.exception() is None else None)
+    return future
+
+def recover_open_segments(ffmpeg_path='ffmpeg'):
+    """Register segments that were still open when the process last stopped
+
+    Truncated files are repaired with a stream-copy remux when ffmpeg is
+    available, then indexed with whatever is playable. Must run inside an
+    application context before camera processors start.
+
+    Returns:
+        int: Number of segments recovered
+    """
+    from app.models.recording import Recording
+
+    if not os.path.isdir(JOURNAL_FOLDER):
+        return 0
+
+    recovered = 0
+    with os.scandir(JOURNAL_FOLDER) as entries:
+        journal = [entry.path for entry in entries if entry.name.endswith('.json')]
+
+    for journal_path in journal:
+        try:
+            with open(journal_path, 'r') as f:
+                entry = json.load(f)
+            camera_id = entry['camera_id']
+            file_path = entry['file_path']
+            start_time = datetime.fromisoformat(entry['start_time'])
+        except Exception as e:
+            logger.error(f"Discarding unreadable segment journal {journal_path}: {str(e)}")
+            os.remove(journal_path)
+            continue
+
+        try:
+            already_registered = Recording.query.filter_by(file_path=file_path).first() is not None
+            if os.path.exists(file_path) and os.path.getsize(file_path) > 0 and not already_registered:
+                repair_segment(file_path, ffmpeg_path)
+                future = segment_finished(camera_id, file_path, start_time,
+                                          recording_type=entry.get('recording_type', 'continuous'))
+                if future is not None:
+                    future.result(timeout=30)
+                    recovered += 1
+                    logger.info(f"Recovered recording segment {file_path}")
+        except Exception as e:
+            logger.error(f"Error recovering segment {file_path}: {str(e)}")
+
+        close_segment(camera_id, file_path)
+
+    return recovered
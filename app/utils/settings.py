@@ -0,0 +1,85 @@
+"""
+Runtime settings stored in config/settings.json
+"""
+import os
+import json
+import copy
+import logging
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_FILE = os.path.join('config', 'settings.json')
+MAX_CLIP_LENGTH = 3600  # Longest recording segment in seconds, the clip export looks back this far
+
+DEFAULT_SETTINGS = {
+    'recording': {
+        'retention_days': 30,
+        'storage_path': 'storage/recordings',
+        'clip_length': 60,
+        'format': 'mp4',
+        'mode': 'continuous',  # continuous or event (record only around detections)
+        'pre_event_seconds': 10,
+        'post_event_seconds': 20,
+        'event_classes': '',  # Comma separated class names that trigger events, empty for all
+        'event_roi_only': False  # Only detections inside an ROI trigger events
+    },
+    'notifications': {
+        'email_enabled': False,
+        'smtp_server': '',
+        'smtp_port': 587,
+        'smtp_username': '',
+        'smtp_password': '',
+        'from_email': '',
+        'email_to': ''
+    },
+    'system': {
+        'log_level': 'info'
+    },
+    'detection': {
+        'default_confidence': 0.45,
+        'default_model': 'yolov5s',
+        'snapshot_quality': 80,  # JPEG quality of detection snapshots
+        'snapshot_max_width': 1280,  # Snapshots are downscaled to this width, 0 keeps the frame size
+        'snapshot_crop': False  # Store a crop around the object instead of the full frame
+    }
+}
+
+def default_settings():
+    """Get a fresh copy of the default settings"""
+    return copy.deepcopy(DEFAULT_SETTINGS)
+
+def load_settings():
+    """Load settings, filling in defaults for missing sections and keys"""
+    settings = default_settings()
+
+    if os.path.exists(SETTINGS_FILE):
+        try:
+            with open(SETTINGS_FILE, 'r') as f:
+                stored = json.load(f)
+            for section, values in stored.items():
+                if isinstance(values, dict) and isinstance(settings.get(section), dict):
+                    settings[section].update(values)
+                else:
+                    settings[section] = values
+        except Exception as e:
+            logger.error(f"Error loading settings: {str(e)}")
+
+    return settings
+
+def save_settings(settings):
+    """Write settings, keeping sections and keys not present in the update"""
+    merged = load_settings()
+    for section, values in settings.items():
+        if isinstance(values, dict) and isinstance(merged.get(section), dict):
+            merged[section].update(values)
+        else:
+            merged[section] = values
+
+    os.makedirs(os.path.dirname(SETTINGS_FILE), exist_ok=True)
+    with open(SETTINGS_FILE, 'w') as f:
+        json.dump(merged, f, indent=4)
+    return merged
+
+def get_setting(section, key, default=None):
+    """Get a single setting value"""
+    return load_settings().get(section, {}).get(key, default)
@@ -0,0 +1,203 @@
+"""
+Background snapshot writer
+
+Detection snapshots are encoded and written by a small pool of threads so
+the inference thread only hands over a reference to the frame. Each snapshot
+can be downscaled, encoded at a per-camera JPEG quality and cropped to the
+detected object instead of keeping the full frame.
+
+The queue is bounded. A snapshot for a path that is already waiting is
+written once, and a new one is refused when the queue is full, so the
+caller stores the detection without an image instead of blocking inference.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FOLDER = os.path.join('storage', 'recordings', 'images')
+CROP_PADDING = 0.25  # Share of the box size kept around a cropped object
+
+class SnapshotJob:
+    """One snapshot waiting to be written"""
+
+    def __init__(self, frame, path, quality, max_width, crop):
+        self.frame = frame
+        self.path = path
+        self.quality = quality
+        self.max_width = max_width
+        self.crop = crop
+
+class SnapshotWriter:
+    """Encode and write detection snapshots off the inference thread"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """Get singleton instance, started on first use"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from app import app
+                    writer = SnapshotWriter(
+                        workers=app.config.get('SNAPSHOT_WORKERS', 2),
+                        queue_size=app.config.get('SNAPSHOT_QUEUE_SIZE', 64)
+                    )
+                    writer.start()
+                    cls._instance = writer
+        return cls._instance
+
+    def __init__(self, workers=2, queue_size=64):
+        """Initialize snapshot writer
+
+        Args:
+            workers: Encoding threads
+            queue_size: Snapshots waiting to be written before new ones are refused
+        """
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.pending = OrderedDict()  # path -> SnapshotJob, oldest first
+        self.condition = threading.Condition()
+        self.running = False
+        self.threads = []
+        self.written = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failures = 0
+        self.bytes_written = 0
+
+    def start(self):
+        """Start the writer threads"""
+        if self.running:
+            return False
+        self.running = True
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"snapshot-writer-{index}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return True
+
+    def stop(self, timeout=5.0):
+        """Write what is queued, then stop the writer threads"""
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.pending and time.time() < deadline:
+                self.condition.wait(timeout=0.1)
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=max(0.1, deadline - time.time()))
+        self.threads = []
+        return True
+
+    def submit(self, frame, path, quality=80, max_width=None, crop=None):
+        """Queue a snapshot without blocking
+
+        Args:
+            frame: BGR frame, must not be modified afterwards
+            path: File to write
+            quality: JPEG quality
+            max_width: Downscale wider images to this width (None to keep the size)
+            crop: (x, y, width, height) box to crop to (None for the full frame)
+
+        Returns:
+            str or None: Path the snapshot will be written to, None if it was dropped
+        """
+        job = SnapshotJob(frame, path, quality, max_width, crop)
+        with self.condition:
+            if path in self.pending:
+                # Same content is already waiting to be written
+                self.coalesced += 1
+                return path
+
+            if len(self.pending) >= self.queue_size or not self.running:
+                self.dropped += 1
+                return None
+
+            self.pending[path] = job
+            self.condition.notify()
+        return path
+
+    def _run(self):
+        """Writer loop"""
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait(timeout=1.0)
+                if not self.pending:
+                    return
+                _, job = self.pending.popitem(last=False)
+                self.condition.notify_all()
+
+            try:
+                size = self.write(job)
+                with self.condition:
+                    self.bytes_written += size
+                    self.written += 1
+            except Exception as e:
+                with self.condition:
+                    self.failures += 1
+                logger.error(f"Error writing snapshot {job.path}: {str(e)}")
+
+    def write(self, job):
+        """Crop, scale, encode and atomically write one snapshot
+
+        Returns:
+            int: Bytes written
+        """
+        image = job.frame
+        if job.crop is not None:
+            image = crop_box(image, job.crop)
+
+        if job.max_width and image.shape[1] > job.max_width:
+            height = max(1, int(round(image.shape[0] * job.max_width / image.shape[1])))
+            image = cv2.resize(image, (job.max_width, height), interpolation=cv2.INTER_AREA)
+
+        ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(job.quality)])
+        if not ok:
+            raise IOError("JPEG encoding failed")
+
+        os.makedirs(os.path.dirname(job.path), exist_ok=True)
+        # A path being written can be queued and picked up by another worker again
+        tmp_path = f"{job.path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(encoded.tobytes())
+        os.replace(tmp_path, job.path)
+        return len(encoded)
+
+    def get_stats(self):
+        """Get writer statistics"""
+        with self.condition:
+            queued = len(self.pending)
+        return {
+            'running': self.running,
+            'workers': self.workers,
+            'queued': queued,
+            'written': self.written,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'failures': self.failures,
+            'bytes_written': self.bytes_written,
+            'avg_bytes': int(self.bytes_written / self.written) if self.written else 0
+        }
+
+def crop_box(frame, box, padding=CROP_PADDING):
+    """Cut an (x, y, width, height) box with some context out of a frame"""
+    frame_height, frame_width = frame.shape[:2]
+    x, y, width, height = box
+    pad_x, pad_y = width * padding, height * padding
+    x1 = int(max(0, x - pad_x))
+    y1 = int(max(0, y - pad_y))
+    x2 = int(min(frame_width, x + width + pad_x))
+    y2 = int(min(frame_height, y + height + pad_y))
+    if x2 <= x1 or y2 <= y1:
+        return frame
+    return frame[y1:y2, x1:x2]
@@ -0,0 +1,467 @@
+"""
+Storage janitor for recordings and detection images
+
+Enforces recording.retention_days from config/settings.json and keeps the
+recordings volume between a high and a low disk usage watermark. Recordings
+are removed oldest-first in batches: rows are deleted in one transaction per
+batch, then their files are unlinked at a limited rate so the janitor never
+spikes disk I/O. Flagged recordings are always kept. Detection images are
+shared between detections, so expiring a detection only releases its image
+and files are deleted once nothing references them. A slower sweep walks the
+storage tree with streaming directory iterators to remove expired files that
+have no database row, without ever listing a whole directory into memory.
+
+With a cold storage tier configured, the watermarks are enforced on the cold
+tier, where the oldest footage lives; hot tier pressure is relieved by the
+tier mover moving segments early.
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import psutil
+
+from app.utils.preview_store import sprite_path_for
+
+logger = logging.getLogger(__name__)
+
+class StorageJanitor:
+    """Delete expired footage and keep disk usage under the high watermark"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """Get singleton instance"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from app import app
+                    cls._instance = StorageJanitor(
+                        interval=app.config.get('JANITOR_INTERVAL', 300),
+                        sweep_interval=app.config.get('JANITOR_SWEEP_INTERVAL', 86400),
+                        high_watermark=app.config.get('DISK_HIGH_WATERMARK', 90),
+                        low_watermark=app.config.get('DISK_LOW_WATERMARK', 80),
+                        batch_size=app.config.get('JANITOR_BATCH_SIZE', 500),
+                        max_deletes_per_second=app.config.get('JANITOR_MAX_DELETES_PER_SECOND', 200),
+                        # Unreferenced images stay while the image store may still reuse them
+                        image_grace=2 * app.config.get('IMAGE_DEDUPE_WINDOW', 600)
+                    )
+        return cls._instance
+
+    def __init__(self, storage_root=os.path.join('storage', 'recordings'), interval=300, sweep_interval=86400,
+                 high_watermark=90, low_watermark=80, batch_size=500, max_deletes_per_second=200,
+                 image_grace=1200):
+        """Initialize storage janitor
+
+        Args:
+            storage_root: Root of the recordings storage tree
+            interval: Seconds between retention and watermark passes
+            sweep_interval: Seconds between filesystem sweeps for unregistered files
+            high_watermark: Disk usage percent that starts deleting the oldest footage
+            low_watermark: Disk usage percent deletion stops at
+            batch_size: Recordings deleted per transaction
+            max_deletes_per_second: File deletions per second (0 for unlimited)
+            image_grace: Seconds an unreferenced detection image is kept after its last use
+        """
+        self.storage_root = storage_root
+        self.interval = interval
+        self.sweep_interval = sweep_interval
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.batch_size = max(1, batch_size)
+        self.max_deletes_per_second = max_deletes_per_second
+        self.image_grace = image_grace
+        self.running = False
+        self.thread = None
+        self.last_run = None
+        self.last_sweep = 0
+        self.recordings_deleted = 0
+        self.files_deleted = 0
+        self.bytes_freed = 0
+        self.watermark_triggered = 0
+
+    def start(self):
+        """Start the janitor thread"""
+        if self.running:
+            return False
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info("Started storage janitor")
+        return True
+
+    def stop(self):
+        """Stop the janitor thread after the current batch"""
+        self.running = False
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5.0)
+        return True
+
+    def _run(self):
+        """Janitor loop"""
+        from app import app, db
+
+        while self.running:
+            try:
+                with app.app_context():
+                    self.run_once(db.session)
+            except Exception as e:
+                logger.error(f"Error in storage janitor: {str(e)}")
+
+            # Sleep in short steps so stop() does not wait a whole interval
+            deadline = time.time() + self.interval
+            while self.running and time.time() < deadline:
+                time.sleep(1)
+
+    def run_once(self, session):
+        """Run one retention pass, one watermark pass and, when due, a filesystem sweep"""
+        from app.utils.settings import get_setting
+
+        try:
+            retention_days = int(get_setting('recording', 'retention_days', 30))
+        except (TypeError, ValueError):
+            retention_days = 30
+        cutoff = datetime.now() - timedelta(days=retention_days)
+
+        expired = self.purge_before(session, cutoff)
+        if expired:
+            logger.info(f"Storage janitor removed {expired} recordings older than {retention_days} days")
+
+        self.enforce_watermarks(session)
+
+        if time.time() - self.last_sweep >= self.sweep_interval:
+            self.sweep_files(session, cutoff)
+            self.last_sweep = time.time()
+
+        self.last_run = datetime.now()
+
+    def _active(self):
+        """Keep working unless the janitor thread was asked to stop (direct calls always run)"""
+        return self.running or self.thread is None
+
+    def disk_percent(self, path=None):
+        """Get the usage percent of the volume holding the recordings (or path)"""
+        path = path or self.storage_root
+        if not os.path.exists(path):
+            path = '.'
+        return psutil.disk_usage(path).percent
+
+    def _throttle(self):
+        """Limit the file deletion rate"""
+        if self.max_deletes_per_second > 0:
+            time.sleep(1.0 / self.max_deletes_per_second)
+
+    def _delete_file(self, path):
+        """Delete one file, returns the bytes freed"""
+        if not path:
+            return 0
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            logger.error(f"Error deleting {path}: {str(e)}")
+            return 0
+
+        self.files_deleted += 1
+        self.bytes_freed += size
+        self._throttle()
+        return size
+
+    def _modified_since(self, path, since):
+        """Check whether a file was written after a time"""
+        try:
+            return os.path.getmtime(path) >= since.timestamp()
+        except OSError:
+            return False
+
+    def _object_store(self):
+        """Get the object store footage is offloaded to"""
+        from app.utils.object_store import ObjectStore
+        return ObjectStore.get_instance()
+
+    def _delete_objects(self, keys):
+        """Delete offloaded copies of deleted footage"""
+        keys = [key for key in keys if key]
+        if keys and self._object_store().enabled():
+            self._object_store().delete_keys(keys)
+
+    def _unflagged(self, query):
+        """Exclude flagged recordings from a recording query"""
+        from app import db
+        from app.models.recording import Recording
+
+        return query.filter(db.or_(Recording.is_flagged == False, Recording.is_flagged.is_(None)))  # noqa: E712
+
+    def _delete_batch(self, session, before=None, root=None, local_only=False):
+        """Delete the oldest batch of unflagged recordings
+
+        Optionally only recordings stored under root, or only those not offloaded to object storage.
+
+        Returns:
+            tuple: (recordings deleted, timestamp of the newest deleted recording)
+        """
+        from app import db
+        from app.models.detection import Detection
+        from app.models.event import Event
+        from app.models.recording import Recording
+
+        query = session.query(Recording.id, Recording.file_path, Recording.thumbnail_path, Recording.timestamp,
+                              Recording.object_key)
+        query = self._unflagged(query)
+        if before is not None:
+            query = query.filter(Recording.timestamp < before)
+        if root is not None:
+            query = query.filter(Recording.file_path.like(root + os.sep + '%'))
+        if local_only:
+            query = query.filter(db.or_(Recording.object_key.is_(None), Recording.object_key == ''))
+        batch = query.order_by(Recording.timestamp.asc()).limit(self.batch_size).all()
+        if not batch:
+            return 0, None
+
+        ids = [row.id for row in batch]
+        try:
+            # Rows first: a crash afterwards only leaves files for the sweep to collect
+            session.query(Detection).filter(Detection.recording_id.in_(ids)).update(
+                {Detection.recording_id: None}, synchronize_session=False)
+            session.query(Event).filter(Event.recording_id.in_(ids)).update(
+                {Event.recording_id: None}, synchronize_session=False)
+            session.query(Recording).filter(Recording.id.in_(ids)).delete(synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error deleting recording rows: {str(e)}")
+            return 0, None
+
+        for row in batch:
+            self._delete_file(row.file_path)
+            self._delete_file(row.thumbnail_path)
+            if row.thumbnail_path:
+                self._delete_file(sprite_path_for(row.thumbnail_path))
+        self._delete_objects([row.object_key for row in batch])
+
+        self.recordings_deleted += len(batch)
+        return len(batch), batch[-1].timestamp
+
+    def _purge_detection_images(self, session, before):
+        """Release detection images taken before a time, except those of flagged recordings
+
+        Images are shared between detections, so a file is only deleted once
+        nothing references it any more.
+        """
+        from app import db
+        from app.models.detection import Detection
+        from app.models.recording import Recording
+        from app.utils.image_store import release_images
+
+        flagged = session.query(Recording.id).filter(Recording.is_flagged == True)  # noqa: E712
+        base = session.query(Detection.id, Detection.image_path).filter(
+            Detection.timestamp < before,
+            Detection.image_path.isnot(None),
+            db.or_(Detection.recording_id.is_(None), ~Detection.recording_id.in_(flagged))
+        )
+
+        last_id = 0
+        while self._active():
+            batch = base.filter(Detection.id > last_id).order_by(Detection.id.asc()).limit(self.batch_size).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            try:
+                session.query(Detection).filter(Detection.id.in_([row.id for row in batch])).update(
+                    {Detection.image_path: None}, synchronize_session=False)
+                release_images(session, [row.image_path for row in batch])
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Error clearing detection image paths: {str(e)}")
+                break
+
+        self._delete_unreferenced_images(session)
+
+    def _delete_unreferenced_images(self, session):
+        """Delete image files no detection references that have been unused for the grace period"""
+        from app.utils.image_store import delete_unreferenced
+
+        unused_since = datetime.now() - timedelta(seconds=self.image_grace)
+        while self._active():
+            try:
+                paths = delete_unreferenced(session, unused_since, self.batch_size)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Error deleting unreferenced image rows: {str(e)}")
+                break
+            if not paths:
+                break
+
+            # A file written again since then holds a new snapshot of the same content
+            paths = [path for path in paths if not self._modified_since(path, unused_since)]
+            for path in paths:
+                self._delete_file(path)
+            self._delete_objects([self._object_store().key_for(path) for path in paths]
+                                 if self._object_store().enabled() else [])
+
+    def purge_before(self, session, cutoff):
+        """Delete unflagged recordings and detection images older than cutoff
+
+        Returns:
+            int: Recordings deleted
+        """
+        total = 0
+        while self._active():
+            deleted, _ = self._delete_batch(session, before=cutoff)
+            if not deleted:
+                break
+            total += deleted
+
+        self._purge_detection_images(session, cutoff)
+        return total
+
+    def enforce_watermarks(self, session):
+        """Delete the oldest footage while disk usage is above the low watermark
+
+        Only starts once usage reaches the high watermark. With tiered storage
+        the coldest tier is checked and only footage stored there is deleted.
+
+        Returns:
+            int: Recordings deleted
+        """
+        from app.utils.storage_tiers import get_tiers
+
+        tiers = get_tiers()
+        name, root = tiers[-1]
+        if len(tiers) == 1:
+            root = None  # Single tier: also covers rows stored with legacy relative paths
+
+        if self.disk_percent(root) < self.high_watermark:
+            return 0
+
+        self.watermark_triggered += 1
+
+        # Footage already in object storage only needs its local copy dropped
+        from app.utils.object_store import ObjectOffloader
+        offloader = ObjectOffloader.get_instance()
+        if offloader.enabled():
+            offloader.evict(session, stop_below=self.low_watermark)
+            if self.disk_percent(root) <= self.low_watermark:
+                return 0
+
+        logger.warning(f"Recordings disk ({name}) above {self.high_watermark}%, deleting oldest footage")
+
+        total = 0
+        while self._active() and self.disk_percent(root) > self.low_watermark:
+            # Deleting offloaded rows would free no local space, only their objects
+            deleted, newest = self._delete_batch(session, root=root, local_only=offloader.enabled())
+            if not deleted:
+                logger.warning("Disk above watermark but only flagged recordings are left")
+                break
+            total += deleted
+            self._purge_detection_images(session, newest)
+
+        logger.info(f"Storage janitor removed {total} recordings to get below {self.low_watermark}% disk usage")
+        return total
+
+    def _registered(self, session, paths):
+        """Get the files among paths that a recording or image row references
+
+        Rows hold absolute or working directory relative paths; a scrub sprite
+        belongs to the recording of its thumbnail.
+
+        Returns:
+            set: Absolute paths of the referenced files
+        """
+        from app.models.detection_image import DetectionImage
+        from app.models.recording import Recording
+
+        owners = {}
+        for path in paths:
+            absolute = os.path.abspath(path)
+            root, extension = os.path.splitext(absolute)
+            candidates = [absolute]
+            if root.endswith('_sprite'):
+                candidates.append(root[:-len('_sprite')] + extension)
+            for candidate in candidates:
+                for form in (candidate, os.path.relpath(candidate)):
+                    owners.setdefault(form, set()).add(absolute)
+
+        registered = set()
+        forms = list(owners)
+        for start in range(0, len(forms), 500):
+            chunk = forms[start:start + 500]
+            for column in (Recording.file_path, Recording.thumbnail_path, DetectionImage.path):
+                for (value,) in session.query(column).filter(column.in_(chunk)):
+                    registered.update(owners[value])
+        return registered
+
+    def sweep_files(self, session, cutoff):
+        """Delete expired files that no recording or image row references
+
+        Walks the storage tree one directory entry at a time and looks up
+        expired files in the database in batches before deleting any, so
+        memory use does not grow with the number of files.
+
+        Returns:
+            int: Files deleted
+        """
+        from app.utils.recording_store import JOURNAL_FOLDER
+        from app.utils.storage_tiers import get_tiers
+
+        cutoff_ts = cutoff.timestamp()
+        skip = os.path.abspath(JOURNAL_FOLDER)
+        deleted = 0
+        pending = [self.storage_root] + [root for name, root in get_tiers()[1:]]
+
+        def delete_unregistered(expired):
+            registered = self._registered(session, expired)
+            return sum(1 for path in expired
+                       if os.path.abspath(path) not in registered and self._delete_file(path))
+
+        while pending and self._active():
+            directory = pending.pop()
+            expired = []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if os.path.abspath(entry.path) != skip:
+                                pending.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff_ts:
+                            expired.append(entry.path)
+                            if len(expired) >= self.batch_size:
+                                deleted += delete_unregistered(expired)
+                                expired = []
+                if expired:
+                    deleted += delete_unregistered(expired)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.error(f"Error sweeping {directory}: {str(e)}")
+
+        if deleted:
+            logger.info(f"Storage janitor swept {deleted} expired unregistered files")
+        return deleted
+
+    def get_stats(self):
+        """Get janitor statistics including usage per storage tier"""
+        from app.utils.storage_tiers import tier_usage
+
+        return {
+            'running': self.running,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'disk_percent': self.disk_percent(),
+            'high_watermark': self.high_watermark,
+            'low_watermark': self.low_watermark,
+            'recordings_deleted': self.recordings_deleted,
+            'files_deleted': self.files_deleted,
+            'bytes_freed': self.bytes_freed,
+            'watermark_triggered': self.watermark_triggered,
+            'tiers': tier_usage()
+        }
@@ -0,0 +1,388 @@
+"""
+Hot/cold storage tiers for recordings
+
+New segments are always written to the hot tier (storage/recordings, usually a
+fast SSD). A background mover copies segments older than
+TIER_MIGRATE_AFTER_DAYS to the cold tier (COLD_STORAGE_PATH, usually a large
+HDD) with a throttled sequential copy, verifies the copy against a checksum of
+the source, and only then points Recording.file_path at the new file in a
+single conditional UPDATE. The source is unlinked after a grace period, so a
+request that resolved the old path just before the switch can still open it;
+sources waiting for that are kept in a state file so a restart still removes
+them.
+When the hot tier fills past DISK_HIGH_WATERMARK, the oldest segments are
+moved early instead of waiting for their age threshold.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+HOT_STORAGE_PATH = os.path.join('storage', 'recordings')
+COPY_CHUNK_SIZE = 1024 * 1024
+STATE_FILE = os.path.join('storage', 'cache', 'tier_state.json')
+
+def get_tiers():
+    """Get the configured storage tiers, hottest first
+
+    Returns:
+        list: (name, absolute root path) tuples
+    """
+    from app import app
+
+    tiers = [('hot', os.path.abspath(HOT_STORAGE_PATH))]
+    cold_path = app.config.get('COLD_STORAGE_PATH')
+    if cold_path:
+        tiers.append(('cold', os.path.abspath(cold_path)))
+    return tiers
+
+def tier_of(file_path):
+    """Get the name of the tier a file is stored on (hot for unknown locations)"""
+    path = os.path.abspath(file_path)
+    for name, root in reversed(get_tiers()):
+        if path.startswith(root + os.sep):
+            return name
+    return 'hot'
+
+def tier_usage():
+    """Get disk usage for every storage tier"""
+    usage = []
+    for name, root in get_tiers():
+        entry = {'name': name, 'path': root, 'percent': 0, 'total': 0, 'used': 0, 'free': 0}
+        if os.path.exists(root):
+            disk = psutil.disk_usage(root)
+            entry.update({'percent': disk.percent, 'total': disk.total, 'used': disk.used, 'free': disk.free})
+        usage.append(entry)
+    return usage
+
+class TierMover:
+    """Move old recording segments from the hot tier to the cold tier"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """Get singleton instance"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from app import app
+                    cls._instance = TierMover(
+                        migrate_after_days=app.config.get('TIER_MIGRATE_AFTER_DAYS', 7),
+                        interval=app.config.get('TIER_INTERVAL', 600),
+                        max_copy_rate=app.config.get('TIER_COPY_RATE_MB', 50) * 1024 * 1024,
+                        high_watermark=app.config.get('DISK_HIGH_WATERMARK', 90),
+                        low_watermark=app.config.get('DISK_LOW_WATERMARK', 80)
+                    )
+        return cls._instance
+
+    def __init__(self, migrate_after_days=7, interval=600, max_copy_rate=50 * 1024 * 1024,
+                 high_watermark=90, low_watermark=80, delete_grace=60, batch_size=100,
+                 state_file=STATE_FILE):
+        """Initialize tier mover
+
+        Args:
+            migrate_after_days: Age at which segments move to the cold tier
+            interval: Seconds between migration passes
+            max_copy_rate: Copy throughput limit in bytes per second (0 for unlimited)
+            high_watermark: Hot tier usage percent that starts moving segments early
+            low_watermark: Hot tier usage percent early moves stop at
+            delete_grace: Seconds a migrated source file is kept for requests that already resolved it
+            batch_size: Recordings fetched per query
+            state_file: JSON file holding the migrated sources waiting to be unlinked
+        """
+        self.migrate_after_days = migrate_after_days
+        self.interval = interval
+        self.max_copy_rate = max_copy_rate
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.delete_grace = delete_grace
+        self.batch_size = max(1, batch_size)
+        self.running = False
+        self.thread = None
+        self.state_file = state_file
+        self.pending_deletes = self._load_state()  # (delete after time.time(), source path)
+        self.current_file = None
+        self.last_run = None
+        self.migrated = 0
+        self.bytes_migrated = 0
+        self.failures = 0
+
+    def _load_state(self):
+        """Load the sources left waiting for deletion by a previous run"""
+        pending = deque()
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r') as f:
+                    pending.extend((due, source) for due, source in json.load(f).get('pending_deletes', []))
+            except Exception as e:
+                logger.error(f"Error loading tier mover state: {str(e)}")
+        return pending
+
+    def _save_state(self):
+        """Write the pending deletes atomically"""
+        try:
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            tmp_path = self.state_file + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'pending_deletes': list(self.pending_deletes)}, f)
+            os.replace(tmp_path, self.state_file)
+        except Exception as e:
+            logger.error(f"Error saving tier mover state: {str(e)}")
+
+    def enabled(self):
+        """Check that a cold tier is configured"""
+        return len(get_tiers()) > 1
+
+    def start(self):
+        """Start the mover thread"""
+        if self.running or not self.enabled():
+            return False
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info("Started storage tier mover")
+        return True
+
+    def stop(self):
+        """Stop the mover thread after the current file"""
+        self.running = False
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5.0)
+        return True
+
+    def _run(self):
+        """Mover loop"""
+        from app import app, db
+
+        while self.running:
+            try:
+                with app.app_context():
+                    self.run_once(db.session)
+            except Exception as e:
+                logger.error(f"Error in storage tier mover: {str(e)}")
+
+            deadline = time.time() + self.interval
+            while self.running and time.time() < deadline:
+                self._delete_sources()
+                time.sleep(1)
+
+        self._delete_sources(force=True)
+
+    def _active(self):
+        """Keep working unless the mover thread was asked to stop (direct calls always run)"""
+        return self.running or self.thread is None
+
+    def run_once(self, session):
+        """Move segments past the age threshold, then relieve hot tier pressure"""
+        if not self.enabled():
+            return 0
+
+        cutoff = datetime.now() - timedelta(days=self.migrate_after_days)
+        moved = self.migrate_before(session, cutoff)
+
+        hot_root = get_tiers()[0][1]
+        if os.path.exists(hot_root) and psutil.disk_usage(hot_root).percent >= self.high_watermark:
+            logger.warning(f"Hot storage above {self.high_watermark}%, moving oldest segments to cold storage")
+            moved += self.migrate_before(session, None, stop_below=self.low_watermark)
+
+        self._delete_sources()
+        self.last_run = datetime.now()
+        if moved:
+            logger.info(f"Moved {moved} recording segments to cold storage")
+        return moved
+
+    def migrate_before(self, session, cutoff, stop_below=None):
+        """Move hot tier segments oldest-first
+
+        Args:
+            session: Database session
+            cutoff: Only move segments started before this time (None for any age)
+            stop_below: Stop once hot tier usage is below this percent
+
+        Returns:
+            int: Segments moved
+        """
+        from app.models.recording import Recording
+
+        hot_root = get_tiers()[0][1]
+        cold_root = get_tiers()[1][1]
+        moved = 0
+        last_seen = None
+
+        while self._active():
+            query = session.query(Recording.id, Recording.camera_id, Recording.file_path,
+                                  Recording.timestamp, Recording.duration)
+            query = query.filter(~Recording.file_path.like(cold_root + os.sep + '%'))
+            # Offloaded segments are evicted locally instead of moved
+            query = query.filter(Recording.object_key.is_(None))
+            if cutoff is not None:
+                query = query.filter(Recording.timestamp < cutoff)
+            if last_seen is not None:
+                # Keyset paging so failed files are not retried in the same pass
+                query = query.filter((Recording.timestamp > last_seen[0]) |
+                                     ((Recording.timestamp == last_seen[0]) & (Recording.id > last_seen[1])))
+            batch = query.order_by(Recording.timestamp.asc(), Recording.id.asc()).limit(self.batch_size).all()
+            if not batch:
+                break
+
+            for row in batch:
+                if not self._active():
+                    break
+                if stop_below is not None and psutil.disk_usage(hot_root).percent < stop_below:
+                    return moved
+                last_seen = (row.timestamp, row.id)
+                if self.migrate_recording(session, row, hot_root, cold_root):
+                    moved += 1
+
+        return moved
+
+    def migrate_recording(self, session, row, hot_root, cold_root):
+        """Copy one segment to the cold tier, verify it and switch its row over
+
+        Returns:
+            bool: True if the recording now points at the cold tier copy
+        """
+        from app.models.detection import Detection
+        from app.models.event import Event
+        from app.models.recording import Recording
+
+        source = os.path.abspath(row.file_path)
+        if not os.path.exists(source):
+            return False
+
+        relative = os.path.relpath(source, hot_root)
+        if relative.startswith('..'):
+            relative = os.path.join('imported', os.path.basename(source))
+        target = os.path.join(cold_root, relative)
+        tmp_path = target + '.part'
+
+        self.current_file = source
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            source_hash, size = self._copy(source, tmp_path)
+            if self._hash_file(tmp_path) != source_hash or os.path.getsize(tmp_path) != size:
+                raise IOError("copy does not match source checksum")
+            os.replace(tmp_path, target)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Error copying {source} to cold storage: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        finally:
+            self.current_file = None
+
+        try:
+            # Only switch if the row still points at the source (it may have been deleted meanwhile)
+            updated = session.query(Recording).filter(
+                Recording.id == row.id, Recording.file_path == row.file_path
+            ).update({Recording.file_path: target}, synchronize_session=False)
+
+            if updated:
+                end = row.timestamp + timedelta(seconds=row.duration or 0)
+                session.query(Detection).filter(
+                    Detection.camera_id == row.camera_id,
+                    Detection.timestamp >= row.timestamp,
+                    Detection.timestamp <= end,
+                    Detection.video_path.in_([row.file_path, source])
+                ).update({Detection.video_path: target}, synchronize_session=False)
+                session.query(Event).filter(
+                    Event.camera_id == row.camera_id,
+                    Event.start_time >= row.timestamp - timedelta(minutes=1),
+                    Event.start_time <= end,
+                    Event.recording_id == row.id
+                ).update({Event.video_path: target}, synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            self.failures += 1
+            logger.error(f"Error updating recording {row.id} after migration: {str(e)}")
+            os.remove(target)
+            return False
+
+        if not updated:
+            os.remove(target)
+            return False
+
+        self.pending_deletes.append((time.time() + self.delete_grace, source))
+        self._save_state()
+        self.migrated += 1
+        self.bytes_migrated += size
+        return True
+
+    def _copy(self, source, target):
+        """Copy a file sequentially at the configured rate and fsync it
+
+        Returns:
+            tuple: (sha256 hex digest of the source, bytes copied)
+        """
+        digest = hashlib.sha256()
+        copied = 0
+        started = time.time()
+
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            while True:
+                chunk = src.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                dst.write(chunk)
+                copied += len(chunk)
+
+                if self.max_copy_rate > 0:
+                    ahead = copied / self.max_copy_rate - (time.time() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            dst.flush()
+            os.fsync(dst.fileno())
+
+        return digest.hexdigest(), copied
+
+    def _hash_file(self, path):
+        """Get the sha256 hex digest of a file as stored on disk"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _delete_sources(self, force=False):
+        """Unlink migrated source files whose grace period has passed"""
+        now = time.time()
+        removed = False
+        while self.pending_deletes and (force or self.pending_deletes[0][0] <= now):
+            _, source = self.pending_deletes.popleft()
+            removed = True
+            try:
+                os.remove(source)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Error removing migrated source {source}: {str(e)}")
+        if removed:
+            self._save_state()
+
+    def get_stats(self):
+        """Get mover statistics"""
+        return {
+            'enabled': self.enabled(),
+            'running': self.running,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'current_file': self.current_file,
+            'migrate_after_days': self.migrate_after_days,
+            'migrated': self.migrated,
+            'bytes_migrated': self.bytes_migrated,
+            'failures': self.failures,
+            'pending_deletes': len(self.pending_deletes)
+        }
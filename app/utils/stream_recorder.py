@@ -0,0 +1,388 @@
+"""
+Stream-copy recording engine
+
+Runs one ffmpeg process per camera that remuxes the camera's compressed
+H.264/H.265 packets into segment files with ``-c copy``. Nothing is decoded or
+re-encoded for recording, so OpenCV only decodes frames for detection and live
+view. The process is restarted with a backoff if the stream drops.
+
+Segments are written as fragmented MP4 by default: every keyframe starts a
+self-contained fragment, so a file cut short by a crash or power loss is still
+playable up to its last complete fragment.
+
+Segment times come from the stream's own timestamps. ffmpeg's progress reports
+tie them to the wall clock: the stream arrives in real time, so the smallest
+difference between the time a report is read and the stream time it reports
+is when stream time zero arrived, and the RTSP handshake does not shift
+recording times. Stream time zero is the first packet received, which can be
+up to a keyframe interval before the first segment's first keyframe; that
+segment's start is corrected once its length is known.
+"""
+import os
+import time
+import shutil
+import logging
+import threading
+import subprocess
+from collections import deque
+from datetime import datetime
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# Recording container -> (ffmpeg segment format, file extension, muxer options)
+# flush_packets hands every finished fragment to the OS instead of buffering it
+SEGMENT_FORMATS = {
+    'fmp4': ('mp4', 'mp4', 'movflags=+frag_keyframe+empty_moov+default_base_moof:flush_packets=1'),
+    'ts': ('mpegts', 'ts', 'flush_packets=1'),
+    'mp4': ('mp4', 'mp4', None),  # Index written on close, not crash-safe
+}
+
+def find_ffmpeg(ffmpeg_path=None):
+    """Get the full path of the ffmpeg binary, or None if it is not installed"""
+    return shutil.which(ffmpeg_path or 'ffmpeg')
+
+class StreamRecorder:
+    """Record a camera stream into segment files without re-encoding"""
+
+    def __init__(self, camera_id, stream_url, output_dir, segment_seconds=60, ffmpeg_path='ffmpeg',
+                 container='fmp4', on_segment_start=None, on_segment=None):
+        """Initialize stream recorder
+
+        Args:
+            camera_id: Camera ID (used for logging)
+            stream_url: Stream URL including credentials
+            output_dir: Directory the segment files are written to
+            segment_seconds: Target segment length, segments are cut on the next keyframe
+            ffmpeg_path: ffmpeg binary name or path
+            container: Segment container, one of SEGMENT_FORMATS
+            on_segment_start: Called as on_segment_start(file_path, start_time) when a
+                segment file is opened
+            on_segment: Called as on_segment(file_path, start_time, end_time, offset_shift=...)
+                for every finished segment; end_time is None if ffmpeg exited before
+                reporting it, offset_shift is set when the first segment of a session
+                started later than reported to on_segment_start
+        """
+        self.camera_id = camera_id
+        self.stream_url = stream_url
+        self.output_dir = output_dir
+        self.segment_seconds = segment_seconds
+        self.ffmpeg_path = find_ffmpeg(ffmpeg_path) or ffmpeg_path
+        self.container = container if container in SEGMENT_FORMATS else 'fmp4'
+        self.extension = SEGMENT_FORMATS[self.container][1]
+        self.on_segment_start = on_segment_start
+        self.on_segment = on_segment
+        self.process = None
+        self.running = False
+        self.thread = None
+        self.lock = threading.Lock()
+        self.session_start = None  # Wall clock time the current ffmpeg process started
+        self.stream_epoch = None  # time.time() at which the session's stream time zero arrived
+        self.stream_time = None  # Stream time of the last packet ffmpeg reported writing
+        self.start_pending = False  # The first segment's start has not been reported yet
+        self.session_prefix = None
+        self.segment_index = 0  # Index of the segment currently being written
+        self.current_path = None
+        self.segment_start = None  # Wall clock start of the segment currently being written
+        self.segments_completed = 0
+        self.restarts = 0
+        self.errors = deque(maxlen=20)  # Last ffmpeg error lines
+
+    def _segment_path(self, index):
+        """Get the file path of a segment in the current session"""
+        return os.path.join(self.output_dir, f"{self.session_prefix}_{index:05d}.{self.extension}")
+
+    def _build_command(self, prefix):
+        """Build the ffmpeg command line for one recording session"""
+        segment_format, extension, format_options = SEGMENT_FORMATS[self.container]
+        # Progress reports on stderr map stream time to the wall clock
+        command = [self.ffmpeg_path, '-hide_banner', '-nostdin', '-loglevel', 'error', '-progress', 'pipe:2']
+
+        if self.stream_url.startswith('rtsp://'):
+            command += ['-rtsp_transport', 'tcp']
+
+        command += [
+            '-i', self.stream_url,
+            '-map', '0:v:0',
+            '-an',
+            '-c', 'copy',
+            # The segment muxer only cuts on keyframes, so every segment starts decodable
+            '-f', 'segment',
+            '-segment_time', str(self.segment_seconds),
+            '-segment_format', segment_format,
+        ]
+        if format_options:
+            command += ['-segment_format_options', format_options]
+
+        command += [
+            '-reset_timestamps', '1',
+            # Completed segments are reported on stdout as "file,start,end"
+            '-segment_list', 'pipe:1',
+            '-segment_list_type', 'csv',
+            os.path.join(self.output_dir, f"{prefix}_%05d.{extension}")
+        ]
+        return command
+
+    def start(self):
+        """Start recording"""
+        if self.running:
+            return False
+
+        if not find_ffmpeg(self.ffmpeg_path):
+            logger.error(f"ffmpeg not found, cannot start stream-copy recording for camera {self.camera_id}")
+            return False
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+        logger.info(f"Started stream-copy recording for camera {self.camera_id}")
+        return True
+
+    def stop(self, timeout=5.0):
+        """Stop recording and let ffmpeg finalize the open segment"""
+        self.running = False
+
+        with self.lock:
+            process = self.process
+        if process and process.poll() is None:
+            try:
+                # ffmpeg finishes the current segment cleanly on SIGTERM
+                process.terminate()
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            except Exception as e:
+                logger.error(f"Error stopping ffmpeg for camera {self.camera_id}: {str(e)}")
+
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=timeout)
+
+        logger.info(f"Stopped stream-copy recording for camera {self.camera_id}")
+        return True
+
+    def _run(self):
+        """Supervise the ffmpeg process, restarting it when the stream drops"""
+        backoff = 1
+
+        while self.running:
+            started = time.time()
+            self._run_session()
+
+            if not self.running:
+                break
+
+            # Reset the backoff once a session has run for a while
+            if time.time() - started > 60:
+                backoff = 1
+            self.restarts += 1
+            logger.warning(f"ffmpeg recording for camera {self.camera_id} exited, restarting in {backoff}s")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _run_session(self):
+        """Run one ffmpeg process until it exits"""
+        from app.utils.recording_store import probe_segment
+
+        self.session_start = datetime.now()
+        self.session_prefix = self.session_start.strftime("%Y%m%d_%H%M%S")
+        self.segment_index = 0
+        self.current_path = self._segment_path(0)
+        # Known once ffmpeg reports writing the first packet
+        self.segment_start = None
+        self.stream_epoch = None
+        self.stream_time = None
+        self.start_pending = True
+
+        try:
+            with self.lock:
+                self.process = subprocess.Popen(
+                    self._build_command(self.session_prefix),
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=True,
+                    bufsize=1
+                )
+        except Exception as e:
+            logger.error(f"Failed to start ffmpeg for camera {self.camera_id}: {str(e)}")
+            self.errors.append(str(e))
+            return
+
+        # Drain stderr so a chatty stream can never block ffmpeg on a full pipe
+        stderr_thread = threading.Thread(target=self._read_errors, args=(self.process.stderr,))
+        stderr_thread.daemon = True
+        stderr_thread.start()
+
+        for line in self.process.stdout:
+            self._segment_finished(line.strip())
+
+        self.process.wait()
+        stderr_thread.join(timeout=1.0)
+        
+        # The segment open when ffmpeg exited was never reported, register what was written
+        if self.current_path and os.path.exists(self.current_path):
+            if self.segment_index == 0 and self.stream_time is not None:
+                start_time, offset_shift = self._first_segment_start(
+                    self.stream_time, *probe_segment(self.current_path))
+                self._notify(self.current_path, start_time, None, offset_shift=offset_shift)
+            else:
+                self._notify(self.current_path, self.segment_start or self.session_start, None)
+        self.current_path = None
+
+    def _read_errors(self, stream):
+        """Keep the last ffmpeg error lines for status reporting and handle progress reports"""
+        for line in stream:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', errors='replace')
+            line = line.strip()
+            key, _, value = line.partition('=')
+            if key == 'out_time_us':
+                self._progress(value)
+            elif line and '=' not in line:
+                # Other progress report lines are key=value pairs
+                self.errors.append(line)
+                logger.debug(f"ffmpeg camera {self.camera_id}: {line}")
+
+    def _wall_time(self, stream_time):
+        """Convert a stream time of the current session to a wall clock datetime"""
+        return datetime.fromtimestamp(self.stream_epoch + stream_time)
+
+    def _progress(self, out_time_us):
+        """Anchor stream time to the wall clock from an ffmpeg progress report
+
+        Args:
+            out_time_us: Stream time of the last packet written in microseconds,
+                N/A until the first packet has been written
+        """
+        try:
+            stream_time = int(out_time_us) / 1000000
+        except ValueError:
+            return
+
+        with self.lock:
+            estimate = time.time() - stream_time
+            self.stream_epoch = estimate if self.stream_epoch is None else min(self.stream_epoch, estimate)
+            self.stream_time = stream_time
+            if not self.start_pending:
+                return
+            # Provisional until the first segment's length shows where its keyframe was
+            self.start_pending = False
+            self.segment_start = self._wall_time(0.0)
+            path, start = self.current_path, self.segment_start
+
+        self._notify_start(path, start)
+
+    def _first_segment_start(self, end, frames, duration):
+        """Get the start of a session's first segment from its end and probed length
+
+        Detections stamped into the file while it was open measured their offset
+        from the provisional start at stream time zero.
+
+        Returns:
+            tuple: (start time, seconds to subtract from offsets measured from the
+                   provisional start, None if there is nothing to correct)
+        """
+        start_time = self._wall_time(max(0.0, end - duration) if frames else 0.0)
+        if self.segment_start is None:
+            return start_time, None
+        offset_shift = (start_time - self.segment_start).total_seconds()
+        return start_time, offset_shift if offset_shift > 0 else None
+
+    def _segment_finished(self, line):
+        """Handle a "file,start,end" line from the segment muxer"""
+        from app.utils.recording_store import probe_segment
+
+        if not line:
+            return
+
+        try:
+            filename, start, end = line.rsplit(',', 2)
+            start, end = float(start), float(end)
+        except ValueError:
+            logger.warning(f"Unexpected segment list entry from ffmpeg: {line}")
+            return
+
+        file_path = os.path.join(self.output_dir, os.path.basename(filename))
+        # The list line is written as the keyframe that ends the segment arrives
+        arrived = time.time()
+        # Only this thread advances segment_index; the probe reads the file header
+        # and must not hold the lock the stderr reader needs for progress reports
+        probed = probe_segment(file_path) if self.segment_index == 0 else None
+
+        with self.lock:
+            estimate = arrived - end
+            self.stream_epoch = estimate if self.stream_epoch is None else min(self.stream_epoch, estimate)
+            first_unreported = self.start_pending
+            self.start_pending = False
+
+            offset_shift = None
+            if probed is not None:
+                # The first entry starts at stream time zero, not at the segment's first keyframe
+                start_time, offset_shift = self._first_segment_start(end, *probed)
+            else:
+                start_time = self._wall_time(start)
+            end_time = self._wall_time(end)
+            self.segments_completed += 1
+            self.segment_index += 1
+            self.segment_start = end_time
+            self.current_path = self._segment_path(self.segment_index)
+
+        if first_unreported:
+            self._notify_start(file_path, start_time)
+
+        logger.debug(f"Finished recording segment {filename} for camera {self.camera_id} "
+                     f"({start_time:%H:%M:%S} - {end_time:%H:%M:%S})")
+        self._notify(file_path, start_time, end_time, offset_shift=offset_shift)
+        self._notify_start(self.current_path, end_time)
+
+    def _notify_start(self, file_path, start_time):
+        """Pass a newly opened segment to the on_segment_start callback"""
+        if not self.on_segment_start:
+            return
+        try:
+            self.on_segment_start(file_path, start_time)
+        except Exception as e:
+            logger.error(f"Error handling new segment {file_path}: {str(e)}")
+
+    def _notify(self, file_path, start_time, end_time, **kwargs):
+        """Pass a finished segment to the on_segment callback"""
+        if not self.on_segment:
+            return
+        try:
+            self.on_segment(file_path, start_time, end_time, **kwargs)
+        except Exception as e:
+            logger.error(f"Error handling finished segment {file_path}: {str(e)}")
+
+    def get_stats(self):
+        """Get recorder status including the CPU used by the ffmpeg process"""
+        stats = {
+            'engine': 'ffmpeg',
+            'container': self.container,
+            'running': self.running,
+            'pid': None,
+            'cpu_percent': 0,
+            'cpu_seconds': 0,
+            'memory_mb': 0,
+            'current_path': self.current_path,
+            'segments_completed': self.segments_completed,
+            'restarts': self.restarts,
+            'last_error': self.errors[-1] if self.errors else None
+        }
+
+        process = self.process
+        if process and process.poll() is None:
+            try:
+                proc = psutil.Process(process.pid)
+                times = proc.cpu_times()
+                stats['pid'] = process.pid
+                stats['cpu_percent'] = proc.cpu_percent(interval=0.1)
+                stats['cpu_seconds'] = round(times.user + times.system, 2)
+                stats['memory_mb'] = round(proc.memory_info().rss / (1024 * 1024), 1)
+            except psutil.Error:
+                pass
+
+        return stats
@@ -57,6 +57,14 @@ def get_system_resources():
         recordings_total = 0
         recordings_used = 0
     
+    # Get usage per storage tier (hot/cold)
+    try:
+        from app.utils.storage_tiers import tier_usage
+        tiers = tier_usage()
+    except Exception as e:
+        print(f"Error getting storage tier info: {str(e)}")
+        tiers = []
+    
     # Return all system information
     return {
         'timestamp': datetime.now().isoformat(),
@@ -80,6 +88,7 @@ def get_system_resources():
             'total': recordings_total,
             'used': recordings_used
         },
+        'tiers': tiers,
         'gpu': gpu_info
     }
 
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Recording benchmark for SmartNVR
+This script records a local RTSP stand-in camera and reports:
+
+- how far the stream-copy recorder's segment start times are from the time the
+  stand-in sent each segment's first frame, next to the times an anchor at
+  ffmpeg's start would have given
+- CPU per camera of the stream-copy recorder and of the OpenCV path, which
+  decodes every frame and re-encodes it with mp4v
+
+The stand-in is an ffmpeg process publishing a generated H.264 sample in real
+time to a recorder listening for RTSP (-rtsp_flags listen), so the recorder
+goes through the RTSP handshake and the first keyframe arrives part way into
+the stream like a camera joined mid-GOP. Every frame carries its frame number
+in the brightness of a small square, which identifies the first frame of each
+recorded segment.
+
+Usage:
+    python benchmark_recording.py [--seconds 30] [--segment 10] [--size 1280x720]
+                                  [--fps 25] [--gop 2] [--join-delay 2] [--ffmpeg ffmpeg]
+
+Needs ffmpeg with libx264.
+"""
+import os
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+
+import cv2
+
+from app.utils.stream_recorder import StreamRecorder, find_ffmpeg
+
+# Setup basic logging
+logging.basicConfig(
+    level=logging.WARNING,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+MARKER_SIZE = 64  # Square in the top left corner whose brightness encodes the frame number
+MARKER_PERIOD = 200  # Frame numbers repeat after this many frames
+MARKER_BASE = 20  # Brightness of frame 0, keeps the marker inside the limited luma range
+RECORDING_FPS = 20.0  # Frame rate of the OpenCV writer in the camera processor
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Benchmark recording against a local RTSP stand-in camera")
+    parser.add_argument('--seconds', type=float, default=30, help="Recording time per engine (default: 30)")
+    parser.add_argument('--segment', type=int, default=10, help="Segment length in seconds (default: 10)")
+    parser.add_argument('--size', default='1280x720', help="Stand-in resolution (default: 1280x720)")
+    parser.add_argument('--fps', type=int, default=25, help="Stand-in frame rate (default: 25)")
+    parser.add_argument('--gop', type=float, default=2, help="Stand-in keyframe interval in seconds (default: 2)")
+    parser.add_argument('--join-delay', type=float, default=2,
+                        help="Seconds between starting the recorder and the stand-in (default: 2)")
+    parser.add_argument('--port', type=int, default=8554, help="First local RTSP port to use (default: 8554)")
+    parser.add_argument('--ffmpeg', default='ffmpeg', help="ffmpeg binary (default: ffmpeg)")
+    return parser.parse_args()
+
+class ListeningRecorder(StreamRecorder):
+    """Stream-copy recorder that waits for the stand-in to publish instead of connecting to a camera"""
+
+    def _build_command(self, prefix):
+        command = super()._build_command(prefix)
+        index = command.index('-i')
+        return command[:index] + ['-rtsp_flags', 'listen'] + command[index:]
+
+def make_sample(ffmpeg, path, args, duration):
+    """Encode the stand-in's H.264 sample with frame numbers in the marker square"""
+    gop_frames = max(1, int(round(args.gop * args.fps)))
+    marker = (f"color=s={MARKER_SIZE}x{MARKER_SIZE}:r={args.fps},format=yuv420p,"
+              f"geq=lum='mod(N,{MARKER_PERIOD})+{MARKER_BASE}':cb=128:cr=128")
+    subprocess.run([
+        ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc2=s={args.size}:r={args.fps}:d={duration}",
+        '-f', 'lavfi', '-i', marker,
+        '-filter_complex', '[0:v][1:v]overlay=0:0:shortest=1,format=yuv420p',
+        # Cameras send no B-frames and a fixed keyframe interval
+        '-c:v', 'libx264', '-preset', 'veryfast', '-bf', '0', '-g', str(gop_frames),
+        '-keyint_min', str(gop_frames), '-sc_threshold', '0',
+        path
+    ], check=True)
+
+def publish(ffmpeg, sample, url, skip_frames, seconds):
+    """Start the stand-in: send the sample in real time, starting skip_frames into it
+
+    The stand-in's progress reports give the time.time() at which its stream
+    time zero (frame 0 of the sample) was sent, the smallest difference between
+    a report's arrival and the stream time it reports. Frame n is sent n / fps
+    seconds later; skipped frames are paced but not sent.
+
+    Returns:
+        tuple: (process, dict whose 'epoch' key holds the send clock once known)
+    """
+    process = subprocess.Popen([
+        ffmpeg, '-hide_banner', '-loglevel', 'error', '-progress', 'pipe:1',
+        '-re', '-t', str(seconds), '-i', sample,
+        '-c', 'copy', '-bsf:v', f"noise=drop='lt(n,{skip_frames})'",
+        '-f', 'rtsp', '-rtsp_transport', 'tcp', url
+    ], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, text=True)
+    clock = {'epoch': None}
+
+    def read_progress():
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key == 'out_time_us' and value.isdigit():
+                estimate = time.time() - int(value) / 1000000
+                clock['epoch'] = estimate if clock['epoch'] is None else min(clock['epoch'], estimate)
+
+    threading.Thread(target=read_progress, daemon=True).start()
+    return process, clock
+
+def first_frame_number(path):
+    """Read the frame number of a segment's first frame, modulo MARKER_PERIOD
+
+    Returns:
+        tuple: (frame number or None, frames in the file)
+    """
+    cap = cv2.VideoCapture(path)
+    try:
+        number, frames = None, 0
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if number is None:
+                luma = cv2.cvtColor(frame[8:MARKER_SIZE - 8, 8:MARKER_SIZE - 8], cv2.COLOR_BGR2YUV)[:, :, 0]
+                # Decoded frames are full range, the marker was drawn in limited range luma
+                number = int(round(16 + float(luma.mean()) * 219 / 255)) - MARKER_BASE
+            frames += 1
+        return number, frames
+    finally:
+        cap.release()
+
+def sent_time(epoch, number, estimate, fps):
+    """Get when the stand-in sent the frame whose number modulo MARKER_PERIOD is number
+
+    The period is resolved by taking the candidate closest to the recorder's estimate.
+    """
+    period = MARKER_PERIOD / fps
+    base = datetime.fromtimestamp(epoch) + timedelta(seconds=number / fps)
+    cycles = round((estimate - base).total_seconds() / period)
+    return base + timedelta(seconds=max(0, cycles) * period)
+
+def bench_timing(ffmpeg, sample, args, output_dir, url):
+    """Record the stand-in and compare segment start times with the frames' send times
+
+    Returns:
+        list: (file name, frames, recorded error, Popen anchor error) per segment, in seconds
+    """
+    segments = []
+    recorder = ListeningRecorder('benchmark', url, output_dir, segment_seconds=args.segment, ffmpeg_path=ffmpeg,
+                                 on_segment=lambda path, start, end, **kwargs: segments.append(
+                                     (path, start, end, recorder.stream_epoch, recorder.session_start)))
+    skip_frames = int(args.fps * args.gop / 2)  # Join half way into a keyframe interval
+
+    recorder.start()
+    time.sleep(args.join_delay)
+    stand_in, clock = publish(ffmpeg, sample, url, skip_frames, args.seconds + args.join_delay + 2)
+    time.sleep(args.seconds)
+    recorder.stop()
+    stand_in.kill()
+    stand_in.wait()
+
+    results = []
+    for index, (path, start, end, epoch, session_start) in enumerate(segments):
+        number, frames = first_frame_number(path)
+        if number is None or epoch is None or clock['epoch'] is None:
+            continue
+        truth = sent_time(clock['epoch'], number, start, args.fps)
+        # The old anchor: ffmpeg's start time plus the list offset, which is 0 for the first segment
+        offset = 0.0 if index == 0 else (start - datetime.fromtimestamp(epoch)).total_seconds()
+        popen_anchor = session_start + timedelta(seconds=offset)
+        results.append((os.path.basename(path), frames, (start - truth).total_seconds(),
+                        (popen_anchor - truth).total_seconds()))
+    return results
+
+def bench_stream_copy(ffmpeg, sample, args, output_dir, url):
+    """Record with the stream-copy recorder
+
+    Returns:
+        dict: CPU seconds of the ffmpeg process and segments written
+    """
+    recorder = ListeningRecorder('benchmark', url, output_dir, segment_seconds=args.segment, ffmpeg_path=ffmpeg)
+    recorder.start()
+    time.sleep(0.5)
+    stand_in, _ = publish(ffmpeg, sample, url, 0, args.seconds + 5)
+    time.sleep(args.seconds)
+    stats = recorder.get_stats()
+    recorder.stop()
+    stand_in.kill()
+    stand_in.wait()
+    return {'cpu_seconds': stats['cpu_seconds'], 'segments': recorder.segments_completed + 1}
+
+def bench_opencv(ffmpeg, sample, args, output_dir, url):
+    """Decode every frame with OpenCV and re-encode it with mp4v like the OpenCV recording path
+
+    Returns:
+        dict: CPU seconds spent decoding and encoding, frames written
+    """
+    # OpenCV reads capture options from the environment when the capture is opened
+    os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = 'rtsp_flags;listen|rtsp_transport;tcp|listen_timeout;30'
+    result = {'decode_seconds': 0.0, 'encode_seconds': 0.0, 'frames': 0}
+    stop = threading.Event()
+
+    def record():
+        cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG)
+        writer = None
+        try:
+            while not stop.is_set():
+                started = time.thread_time()
+                ok, frame = cap.read()
+                result['decode_seconds'] += time.thread_time() - started
+                if not ok:
+                    break
+                started = time.thread_time()
+                if writer is None:
+                    height, width = frame.shape[:2]
+                    writer = cv2.VideoWriter(os.path.join(output_dir, 'opencv.mp4'),
+                                             cv2.VideoWriter_fourcc(*'mp4v'), RECORDING_FPS, (width, height))
+                writer.write(frame)
+                result['encode_seconds'] += time.thread_time() - started
+                result['frames'] += 1
+        finally:
+            cap.release()
+            if writer is not None:
+                writer.release()
+            os.environ.pop('OPENCV_FFMPEG_CAPTURE_OPTIONS', None)
+
+    thread = threading.Thread(target=record, daemon=True)
+    thread.start()
+    time.sleep(0.5)
+    stand_in, _ = publish(ffmpeg, sample, url, 0, args.seconds + 5)
+    time.sleep(args.seconds)
+    stop.set()
+    thread.join(timeout=10)
+    stand_in.kill()
+    stand_in.wait()
+    return result
+
+def main():
+    """Run the timing and CPU benchmarks and print the results"""
+    args = parse_args()
+    ffmpeg = find_ffmpeg(args.ffmpeg)
+    if not ffmpeg:
+        logger.error(f"ffmpeg not found: {args.ffmpeg}")
+        return
+
+    scratch_dir = tempfile.mkdtemp(prefix='smartnvr-recording-')
+    try:
+        sample = os.path.join(scratch_dir, 'sample.mp4')
+        make_sample(ffmpeg, sample, args, args.seconds + args.join_delay + 10)
+        print(f"Stand-in: {args.size} at {args.fps} fps, keyframe every {args.gop}s, "
+              f"{args.segment}s segments, {args.seconds}s per run")
+
+        print(f"\nSegment start times (stand-in published {args.join_delay}s after the recorder started, "
+              f"joined half way into a keyframe interval)")
+        timing_dir = os.path.join(scratch_dir, 'timing')
+        results = bench_timing(ffmpeg, sample, args, timing_dir, f"rtsp://127.0.0.1:{args.port}/live")
+        print(f"  {'segment':<28} {'frames':>6} {'recorded':>10} {'Popen anchor':>13}")
+        for name, frames, error, popen_error in results:
+            print(f"  {name:<28} {frames:>6} {error:>+9.3f}s {popen_error:>+12.3f}s")
+
+        print("\nCPU per camera")
+        copy_dir = os.path.join(scratch_dir, 'copy')
+        os.makedirs(copy_dir)
+        copy = bench_stream_copy(ffmpeg, sample, args, copy_dir, f"rtsp://127.0.0.1:{args.port + 1}/live")
+        print(f"  stream copy  {copy['cpu_seconds'] / args.seconds * 100:>6.1f}% "
+              f"({copy['cpu_seconds']:.2f}s ffmpeg CPU, {copy['segments']} segments)")
+
+        opencv_dir = os.path.join(scratch_dir, 'opencv')
+        os.makedirs(opencv_dir)
+        opencv = bench_opencv(ffmpeg, sample, args, opencv_dir, f"rtsp://127.0.0.1:{args.port + 2}/live")
+        total = opencv['decode_seconds'] + opencv['encode_seconds']
+        print(f"  opencv       {total / args.seconds * 100:>6.1f}% "
+              f"(decode {opencv['decode_seconds'] / args.seconds * 100:.1f}%, "
+              f"mp4v encode {opencv['encode_seconds'] / args.seconds * 100:.1f}%, {opencv['frames']} frames)")
+        print("  Detection decodes frames in both modes; the OpenCV path adds the encode and decodes every frame.")
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
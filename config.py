@@ -15,10 +15,112 @@ class Config:
         f'sqlite:///{os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "smart_nvr.db")}')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # SQLite engine tuning (ignored for other database backends)
+    SQLITE_WAL_MODE = os.environ.get('SQLITE_WAL_MODE', 'True').lower() in ('true', '1', 't')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))  # 64 MB page cache
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))  # 256 MB memory map
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 10000))
+    
+    # Deployment size, used to derive connection pool sizes
+    CAMERA_WORKERS = int(os.environ.get('CAMERA_WORKERS', 16))  # Expected number of camera processors
+    WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))  # Concurrent web request threads
+    
+    # Connection pools: readers serve the web API, writers serve the camera pipeline
+    DB_READER_POOL_SIZE = int(os.environ.get('DB_READER_POOL_SIZE', WEB_THREADS + max(2, CAMERA_WORKERS // 10)))
+    DB_READER_MAX_OVERFLOW = int(os.environ.get('DB_READER_MAX_OVERFLOW', WEB_THREADS))
+    DB_WRITER_THREADS = int(os.environ.get('DB_WRITER_THREADS', max(1, min(8, CAMERA_WORKERS // 25))))  # Always 1 on SQLite
+    DB_WRITER_BATCH_SIZE = int(os.environ.get('DB_WRITER_BATCH_SIZE', 50))  # Jobs grouped into one commit
+    DB_WRITER_QUEUE_SIZE = int(os.environ.get('DB_WRITER_QUEUE_SIZE', 1000))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # Seconds, for server databases
+    
     # File storage
     UPLOAD_FOLDER = os.path.join('storage', 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB max upload
     
+    # Seconds between checks of the shared config version (bounds cross-process staleness)
+    CONFIG_CACHE_CHECK_INTERVAL = float(os.environ.get('CONFIG_CACHE_CHECK_INTERVAL', 2.0))
+    
+    # Detection history: months older than this are compacted into columnar archive files
+    DETECTION_ARCHIVE_AFTER_DAYS = int(os.environ.get('DETECTION_ARCHIVE_AFTER_DAYS', 90))
+    DETECTION_ARCHIVE_FOLDER = os.path.join('storage', 'archive', 'detections')
+    
+    # Recording engine: 'ffmpeg' remuxes camera packets without re-encoding (falls back
+    # to 'opencv' when ffmpeg is not installed), 'opencv' decodes and re-encodes frames
+    RECORDING_ENGINE = os.environ.get('RECORDING_ENGINE', 'ffmpeg').lower()
+    FFMPEG_PATH = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+    # Segment container for the ffmpeg engine: 'fmp4' (fragmented MP4, playable up to the
+    # last fragment after a crash), 'ts' (MPEG-TS) or 'mp4' (index written on close only)
+    RECORDING_FORMAT = os.environ.get('RECORDING_FORMAT', 'fmp4').lower()
+    # Memory cap per camera for the pre-event packet buffer in event recording mode
+    EVENT_BUFFER_MAX_MB = int(os.environ.get('EVENT_BUFFER_MAX_MB', 32))
+    # Scrub previews: one sprite tile every PREVIEW_TILE_INTERVAL seconds of each segment
+    PREVIEW_TILE_INTERVAL = float(os.environ.get('PREVIEW_TILE_INTERVAL', 5))
+    PREVIEW_TILE_WIDTH = int(os.environ.get('PREVIEW_TILE_WIDTH', 160))
+    PREVIEW_THUMBNAIL_WIDTH = int(os.environ.get('PREVIEW_THUMBNAIL_WIDTH', 320))
+    # Object tracking: detections are stored once per track instead of per inference
+    TRACKER_IOU_THRESHOLD = float(os.environ.get('TRACKER_IOU_THRESHOLD', 0.3))
+    TRACKER_MIN_HITS = int(os.environ.get('TRACKER_MIN_HITS', 2))  # Inferences before a track is reported
+    TRACKER_MAX_AGE = float(os.environ.get('TRACKER_MAX_AGE', 2.0))  # Seconds unseen before a track ends
+    TRACKER_BEST_INTERVAL = float(os.environ.get('TRACKER_BEST_INTERVAL', 10.0))  # Seconds between updates of a track
+    # Cameras with ROIs run inference on padded crops around them instead of the whole frame
+    ROI_CROP_INFERENCE = os.environ.get('ROI_CROP_INFERENCE', 'True').lower() in ('true', '1', 't')
+    # Share of their size that neighbouring tiles overlap by in tiled inference
+    INFERENCE_TILE_OVERLAP = float(os.environ.get('INFERENCE_TILE_OVERLAP', 0.2))
+    # Detections of cascade cameras are confirmed by a larger model in batches shared by all cameras
+    CASCADE_BATCH_SIZE = int(os.environ.get('CASCADE_BATCH_SIZE', 8))  # Crops per confirmation batch
+    CASCADE_BATCH_WAIT = float(os.environ.get('CASCADE_BATCH_WAIT', 0.02))  # Seconds a batch waits to fill
+    CASCADE_CONFIRM_TIMEOUT = float(os.environ.get('CASCADE_CONFIRM_TIMEOUT', 2.0))  # Unconfirmed after this many seconds
+    # Every this many frames the confirmation model also runs alone on what the small model saw, 0 to disable
+    CASCADE_BASELINE_INTERVAL = int(os.environ.get('CASCADE_BASELINE_INTERVAL', 100))
+    # Detection runs on the newest frame of each camera in a worker pool shared by all cameras
+    INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 2))
+    INFERENCE_SCHEDULING = os.environ.get('INFERENCE_SCHEDULING', 'weighted')  # weighted or priority
+    INFERENCE_MAX_LATENCY = float(os.environ.get('INFERENCE_MAX_LATENCY', 2.0))  # Older frames are dropped, per camera overridable
+    # Detection snapshots are encoded by a bounded pool, new ones are dropped when it is full
+    SNAPSHOT_WORKERS = int(os.environ.get('SNAPSHOT_WORKERS', 2))
+    SNAPSHOT_QUEUE_SIZE = int(os.environ.get('SNAPSHOT_QUEUE_SIZE', 64))
+    # Detection notifications are sent by a background thread, new ones are dropped when it falls behind
+    NOTIFICATION_QUEUE_SIZE = int(os.environ.get('NOTIFICATION_QUEUE_SIZE', 256))
+    # Snapshots within IMAGE_DEDUPE_DISTANCE perceptual hash bits of an image the camera
+    # used in the last IMAGE_DEDUPE_WINDOW seconds reference it instead of a new file
+    IMAGE_DEDUPE_DISTANCE = int(os.environ.get('IMAGE_DEDUPE_DISTANCE', 6))
+    IMAGE_DEDUPE_WINDOW = int(os.environ.get('IMAGE_DEDUPE_WINDOW', 600))
+    # Detections of one class less than EVENT_MERGE_GAP seconds apart are listed as one event
+    EVENT_MERGE_GAP = float(os.environ.get('EVENT_MERGE_GAP', 30))
+    # Longest clip /api/cameras/<id>/export produces, in seconds
+    EXPORT_MAX_SECONDS = int(os.environ.get('EXPORT_MAX_SECONDS', 3600))
+    
+    # Storage janitor: retention comes from recording.retention_days in config/settings.json
+    JANITOR_INTERVAL = int(os.environ.get('JANITOR_INTERVAL', 300))  # Seconds between passes
+    JANITOR_SWEEP_INTERVAL = int(os.environ.get('JANITOR_SWEEP_INTERVAL', 86400))  # Seconds between file sweeps
+    JANITOR_BATCH_SIZE = int(os.environ.get('JANITOR_BATCH_SIZE', 500))  # Recordings deleted per transaction
+    JANITOR_MAX_DELETES_PER_SECOND = int(os.environ.get('JANITOR_MAX_DELETES_PER_SECOND', 200))
+    DISK_HIGH_WATERMARK = float(os.environ.get('DISK_HIGH_WATERMARK', 90))  # Percent used that starts cleanup
+    DISK_LOW_WATERMARK = float(os.environ.get('DISK_LOW_WATERMARK', 80))  # Percent used cleanup stops at
+    
+    # Storage tiers: new segments go to storage/recordings (hot), segments older than
+    # TIER_MIGRATE_AFTER_DAYS move to COLD_STORAGE_PATH (disabled when empty)
+    COLD_STORAGE_PATH = os.environ.get('COLD_STORAGE_PATH', '')
+    TIER_MIGRATE_AFTER_DAYS = float(os.environ.get('TIER_MIGRATE_AFTER_DAYS', 7))
+    TIER_INTERVAL = int(os.environ.get('TIER_INTERVAL', 600))  # Seconds between migration passes
+    TIER_COPY_RATE_MB = float(os.environ.get('TIER_COPY_RATE_MB', 50))  # Copy throughput limit, 0 for unlimited
+    
+    # Object storage offload (S3, MinIO, ...): disabled when S3_BUCKET is empty, requires boto3
+    S3_BUCKET = os.environ.get('S3_BUCKET', '')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', '')  # Empty for AWS
+    S3_REGION = os.environ.get('S3_REGION', 'us-east-1')
+    S3_ACCESS_KEY = os.environ.get('S3_ACCESS_KEY', '')
+    S3_SECRET_KEY = os.environ.get('S3_SECRET_KEY', '')
+    S3_PREFIX = os.environ.get('S3_PREFIX', 'smartnvr')
+    S3_UPLOAD_CONCURRENCY = int(os.environ.get('S3_UPLOAD_CONCURRENCY', 4))  # Files uploaded in parallel
+    S3_MULTIPART_MB = int(os.environ.get('S3_MULTIPART_MB', 16))  # Multipart threshold and part size
+    S3_RETRIES = int(os.environ.get('S3_RETRIES', 5))
+    S3_INTERVAL = int(os.environ.get('S3_INTERVAL', 60))  # Seconds between offload passes
+    S3_EVICT_AFTER_DAYS = float(os.environ.get('S3_EVICT_AFTER_DAYS', 1))  # Local copies kept, negative keeps them
+    S3_SERVE_MODE = os.environ.get('S3_SERVE_MODE', 'proxy').lower()  # 'proxy' or 'redirect'
+    S3_CACHE_MB = int(os.environ.get('S3_CACHE_MB', 2048))  # Read-through cache for played segments
+    
     # AI settings
     AI_MODELS_FOLDER = os.path.join('storage', 'models')
     DEFAULT_AI_MODEL = 'yolov5s'
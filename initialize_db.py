@@ -23,8 +23,51 @@ def hash_password(password):
     """Generate password hash using Werkzeug's method"""
     return generate_password_hash(password)
 
+def initialize_server_database(database_uri):
+    """Initialize a server database (e.g. PostgreSQL) from the SQLAlchemy models"""
+    from app import app, db
+    from app.models import User, AIModel, ConfigVersion
+    
+    logger.info(f"Initializing {database_uri.split(':', 1)[0]} database from models")
+    
+    with app.app_context():
+        logger.info("Dropping existing tables")
+        db.drop_all()
+        logger.info("Creating tables")
+        db.create_all()
+        db.session.add(ConfigVersion(id=1, version=0))
+        
+        # Insert default admin user
+        logger.info("Creating default admin user: admin/admin")
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        admin.set_password('admin')
+        db.session.add(admin)
+        
+        # Insert default YOLOv5 models
+        logger.info("Creating default AI models")
+        db.session.add_all([
+            AIModel(name='YOLOv5s', file_path='models/yolov5s.pt', description='Small version of YOLOv5', is_default=True),
+            AIModel(name='YOLOv5m', file_path='models/yolov5m.pt', description='Medium version of YOLOv5'),
+            AIModel(name='YOLOv5l', file_path='models/yolov5l.pt', description='Large version of YOLOv5')
+        ])
+        db.session.commit()
+    
+    logger.info("Database initialization complete!")
+    logger.info("You can now run 'python run.py' to start the application")
+    logger.info("Login with username: admin, password: admin")
+
 def main():
     """Main function to initialize the database"""
+    # Server databases are created from the models instead of raw SQLite DDL
+    database_uri = os.environ.get('DATABASE_URI')
+    if database_uri and not database_uri.startswith('sqlite'):
+        try:
+            initialize_server_database(database_uri)
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            sys.exit(1)
+        return
+    
     # Create or ensure instance directory exists with full permissions
     instance_dir = os.path.join(os.getcwd(), 'instance')
     os.makedirs(instance_dir, exist_ok=True)
@@ -52,6 +95,9 @@ def main():
         cursor = conn.cursor()
         logger.info("Successfully connected to the database")
         
+        # WAL mode is persistent, so set it once at creation time
+        cursor.execute("PRAGMA journal_mode=WAL")
+        
         # Create User table
         logger.info("Creating User table")
         cursor.execute('''
@@ -89,6 +135,7 @@ def main():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
             rtsp_url TEXT NOT NULL,
+            sub_rtsp_url TEXT,
             username TEXT,
             password TEXT,
             is_active BOOLEAN NOT NULL DEFAULT 1,
@@ -96,10 +143,20 @@ def main():
             detection_enabled BOOLEAN NOT NULL DEFAULT 1,
             model_id INTEGER,
             confidence_threshold REAL NOT NULL DEFAULT 0.45,
+            detection_classes TEXT,
+            confirm_model_id INTEGER,
+            inference_tiles TEXT,
+            tile_motion_only BOOLEAN NOT NULL DEFAULT 0,
+            inference_priority INTEGER NOT NULL DEFAULT 1,
+            max_detection_latency REAL,
+            snapshot_quality INTEGER,
+            snapshot_max_width INTEGER,
+            snapshot_crop BOOLEAN,
             location TEXT,
             status TEXT DEFAULT 'offline',
             created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (model_id) REFERENCES ai_model (id)
+            FOREIGN KEY (model_id) REFERENCES ai_model (id),
+            FOREIGN KEY (confirm_model_id) REFERENCES ai_model (id)
         )
         ''')
         
@@ -126,9 +183,14 @@ def main():
             camera_id INTEGER NOT NULL,
             file_path TEXT NOT NULL,
             thumbnail_path TEXT,
+            sprite_info TEXT,
+            keyframe_index TEXT,
             timestamp TIMESTAMP NOT NULL,
             duration INTEGER,
             file_size INTEGER,
+            frame_count INTEGER DEFAULT 0,
+            object_key TEXT,
+            evicted BOOLEAN NOT NULL DEFAULT 0,
             recording_type TEXT NOT NULL DEFAULT 'continuous',
             is_flagged BOOLEAN NOT NULL DEFAULT 0,
             created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
@@ -136,6 +198,29 @@ def main():
         )
         ''')
         
+        # Create Event table
+        logger.info("Creating Event table")
+        cursor.execute('''
+        CREATE TABLE event (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            camera_id INTEGER NOT NULL,
+            class_name TEXT NOT NULL,
+            start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP NOT NULL,
+            detection_count INTEGER DEFAULT 0,
+            peak_confidence REAL DEFAULT 0,
+            best_detection_id INTEGER,
+            recording_id INTEGER,
+            video_path TEXT,
+            video_offset REAL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (camera_id) REFERENCES camera (id),
+            FOREIGN KEY (recording_id) REFERENCES recording (id)
+        )
+        ''')
+        cursor.execute('CREATE INDEX ix_event_camera_start ON event (camera_id, start_time)')
+        cursor.execute('CREATE INDEX ix_event_camera_class_end ON event (camera_id, class_name, end_time)')
+        
         # Create Detection table
         logger.info("Creating Detection table")
         cursor.execute('''
@@ -144,6 +229,8 @@ def main():
             camera_id INTEGER NOT NULL,
             recording_id INTEGER,
             roi_id INTEGER,
+            track_id INTEGER,
+            event_id INTEGER,
             timestamp TIMESTAMP NOT NULL,
             class_name TEXT NOT NULL,
             confidence REAL NOT NULL,
@@ -153,13 +240,53 @@ def main():
             bbox_height REAL NOT NULL,
             image_path TEXT,
             video_path TEXT,
+            video_offset REAL,
+            frame_offset INTEGER,
             notified BOOLEAN NOT NULL DEFAULT 0,
             created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (camera_id) REFERENCES camera (id),
             FOREIGN KEY (recording_id) REFERENCES recording (id),
-            FOREIGN KEY (roi_id) REFERENCES roi (id)
+            FOREIGN KEY (roi_id) REFERENCES roi (id),
+            FOREIGN KEY (event_id) REFERENCES event (id)
+        )
+        ''')
+        cursor.execute('CREATE INDEX ix_detection_timestamp ON detection (timestamp)')
+        cursor.execute('CREATE INDEX ix_detection_camera_timestamp ON detection (camera_id, timestamp)')
+        cursor.execute('CREATE INDEX ix_detection_camera_track ON detection (camera_id, track_id)')
+        cursor.execute('CREATE INDEX ix_detection_event_id ON detection (event_id)')
+        cursor.execute('CREATE INDEX ix_recording_camera_timestamp ON recording (camera_id, timestamp)')
+        cursor.execute('CREATE INDEX ix_recording_object_key ON recording (object_key)')
+        cursor.execute('CREATE INDEX ix_recording_offload ON recording (evicted, timestamp)')
+        cursor.execute('CREATE INDEX ix_recording_file_path ON recording (file_path)')
+        
+        # Create DetectionImage table
+        logger.info("Creating DetectionImage table")
+        cursor.execute('''
+        CREATE TABLE detection_image (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            camera_id INTEGER NOT NULL,
+            path TEXT NOT NULL UNIQUE,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            uploaded BOOLEAN NOT NULL DEFAULT 0,
+            evicted BOOLEAN NOT NULL DEFAULT 0,
+            created_at TIMESTAMP,
+            last_used TIMESTAMP,
+            FOREIGN KEY (camera_id) REFERENCES camera (id)
+        )
+        ''')
+        cursor.execute('CREATE INDEX ix_detection_image_refs_used ON detection_image (ref_count, last_used)')
+        cursor.execute('CREATE INDEX ix_detection_image_offload ON detection_image (uploaded, evicted, last_used)')
+        
+        # Create ConfigVersion table
+        logger.info("Creating ConfigVersion table")
+        cursor.execute('''
+        CREATE TABLE config_version (
+            id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP
         )
         ''')
+        cursor.execute('INSERT INTO config_version (id, version, updated_at) VALUES (1, 0, ?)', (datetime.now(),))
         
         # Insert default admin user
         logger.info("Creating default admin user: admin/admin")
@@ -11,6 +11,7 @@ import sys
 import signal
 from app import app, db
 from app.utils.camera_processor import CameraManager
+from app.utils.database import DatabaseWriter
 from app.models.user import User
 
 # Global flag for signaling shutdown
@@ -48,28 +49,73 @@ def signal_handler(sig, frame):
     camera_manager = CameraManager.get_instance()
     camera_manager.stop_all_cameras()
     
+    from app.utils.inference_scheduler import InferenceScheduler
+    InferenceScheduler.get_instance().stop()
+    
+    # Stop deleting footage mid-batch
+    from app.utils.storage_janitor import StorageJanitor
+    from app.utils.storage_tiers import TierMover
+    from app.utils.object_store import ObjectOffloader
+    StorageJanitor.get_instance().stop()
+    TierMover.get_instance().stop()
+    ObjectOffloader.get_instance().stop()
+    
+    # Write queued detection snapshots
+    from app.utils.snapshot_writer import SnapshotWriter
+    SnapshotWriter.get_instance().stop()
+    
+    # Flush pending pipeline writes
+    logger.info("Flushing database writer...")
+    DatabaseWriter.get_instance().stop()
+    
     # Allow a short time for cleanup
     logger.info("Cleanup complete, exiting")
     sys.exit(0)
 
 def initialize_database():
     """Verify database exists and is accessible"""
-    db_path = 'instance/smart_nvr.db'
-    if not os.path.exists(db_path):
+    from app.utils.database import sqlite_file_path
+    
+    # Only file-based SQLite databases can be checked on disk; server databases
+    # (e.g. PostgreSQL) are verified by the connection test below
+    db_uri = app.config['SQLALCHEMY_DATABASE_URI']
+    db_path = sqlite_file_path(db_uri)
+    if db_path and not os.path.exists(db_path):
         logger.error(f"Database not found at {db_path}")
         logger.info("Please run 'python initialize_db.py' first to set up the database")
         sys.exit(1)
     
+    logger.info(f"Using {db_uri.split(':', 1)[0]} database")
+    
     with app.app_context():
         try:
             # Verify we can connect to the database
             User.query.first()
             logger.info("Database connection verified")
+            
+            # Nearly static config is cached; needs the config_version table
+            from app.utils.config_cache import ConfigCache
+            ConfigCache.get_instance().check_schema(db.engine)
+            
+            # Start the single writer used by the camera pipeline
+            DatabaseWriter.get_instance().start()
         except Exception as e:
             logger.error(f"Database connection failed: {str(e)}")
             logger.info("Please run 'python initialize_db.py' to reinitialize the database")
             sys.exit(1)
 
+def recover_recordings():
+    """Index recording segments left open by a crash or power loss"""
+    from app.utils.recording_store import recover_open_segments
+    
+    with app.app_context():
+        try:
+            recovered = recover_open_segments(app.config.get('FFMPEG_PATH', 'ffmpeg'))
+            if recovered:
+                logger.info(f"Recovered {recovered} interrupted recording segments")
+        except Exception as e:
+            logger.error(f"Error recovering recordings: {str(e)}")
+
 def download_models():
     """Download YOLOv5 models if they don't exist"""
     import torch
@@ -102,6 +148,33 @@ def start_resource_monitor():
     thread.start()
     logger.info("Started system resource monitoring")
 
+def start_detection_archiver():
+    """Start compacting old detection partitions in a background thread"""
+    from app.utils.detection_archive import run_archiver
+    
+    thread = threading.Thread(target=run_archiver, kwargs={'interval': 3600}, daemon=True)
+    thread.start()
+    logger.info("Started detection archiver")
+
+def start_storage_janitor():
+    """Start enforcing recording retention and disk watermarks in a background thread"""
+    from app.utils.storage_janitor import StorageJanitor
+    
+    StorageJanitor.get_instance().start()
+
+def start_tier_mover():
+    """Start moving old segments to cold storage in a background thread"""
+    from app.utils.storage_tiers import TierMover
+    
+    if TierMover.get_instance().start():
+        logger.info(f"Cold storage tier enabled at {app.config['COLD_STORAGE_PATH']}")
+
+def start_object_offload():
+    """Start uploading finished footage to object storage in a background thread"""
+    from app.utils.object_store import ObjectOffloader
+    
+    ObjectOffloader.get_instance().start()
+
 def parse_arguments():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(description='SmartNVR - Network Video Recorder with AI')
@@ -135,9 +208,24 @@ if __name__ == '__main__':
     # Initialize database and defaults
     initialize_database()
     
+    # Register segments that were still being written when we last stopped
+    recover_recordings()
+    
     # Start system resource monitoring
     start_resource_monitor()
     
+    # Start moving old detections into columnar archives
+    start_detection_archiver()
+    
+    # Start deleting expired footage
+    start_storage_janitor()
+    
+    # Start moving old footage to cold storage
+    start_tier_mover()
+    
+    # Start offloading footage to object storage
+    start_object_offload()
+    
     # Start camera processors if not disabled
     if not args.no_cameras:
         # Start cameras in a separate thread to not block the web server
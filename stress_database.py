@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Database concurrency stress test for SmartNVR
+This script runs many API reader threads against the reader pool while a
+high-rate writer stores detections through the pipeline DatabaseWriter, and
+checks that no request or write failed on a database lock and that every
+submitted detection was stored. tests/test_database_stress.py runs a short
+version of it under pytest.
+
+Usage:
+    python stress_database.py [--readers 16] [--seconds 20] [--write-rate 200]
+                              [--batch 5] [--seed 20000] [--database URI]
+
+Without --database a scratch SQLite file in a temporary directory is used, so
+the configured database is never touched. A server database given with
+--database should be a scratch database too: the test camera and its rows are
+deleted afterwards, but the tables are created there if missing.
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Stress the database with concurrent API readers and a pipeline writer")
+    parser.add_argument('--readers', type=int, default=16, help="API reader threads (default: 16)")
+    parser.add_argument('--seconds', type=float, default=20, help="Test duration (default: 20)")
+    parser.add_argument('--write-rate', type=float, default=200,
+                        help="Detection reports submitted per second, 0 for as fast as possible (default: 200)")
+    parser.add_argument('--batch', type=int, default=5, help="Detections per report (default: 5)")
+    parser.add_argument('--seed', type=int, default=20000, help="Detections stored before the test (default: 20000)")
+    parser.add_argument('--database', help="Database URI (default: scratch SQLite file)")
+    return parser.parse_args()
+
+def is_lock_error(error):
+    """Check whether an exception is SQLite's database lock error"""
+    return 'database is locked' in str(error) or 'database table is locked' in str(error)
+
+def percentile(values, share):
+    """Get a percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+def detection_reports(count, batch):
+    """Build detection reports in the format camera processors send"""
+    classes = ['person', 'car', 'dog', 'bicycle']
+    now = datetime.now()
+    for i in range(count):
+        yield [{
+            'class_name': classes[(i + j) % len(classes)],
+            'confidence': 0.5 + (j % 5) / 10,
+            'bbox_x': 10 * j, 'bbox_y': 20, 'bbox_width': 64, 'bbox_height': 128,
+            'timestamp': now
+        } for j in range(batch)]
+
+def run_stress(readers=16, seconds=20, write_rate=200, batch=5, seed=20000, database=None):
+    """Run concurrent API readers against the pipeline writer
+
+    The app is imported here because it reads DATABASE_URI on import.
+
+    Returns:
+        dict: Reader and writer results; 'stored' is the number of detection
+              rows of the test camera found in the database afterwards
+    """
+    scratch_dir = None
+    if database:
+        os.environ['DATABASE_URI'] = database
+    else:
+        scratch_dir = tempfile.mkdtemp(prefix='smartnvr-stress-')
+        os.environ['DATABASE_URI'] = f"sqlite:///{os.path.join(scratch_dir, 'stress.db')}"
+
+    from app import app, db
+    from app.models.camera import Camera
+    from app.models.detection import Detection
+    from app.models.detection_image import DetectionImage
+    from app.models.event import Event
+    from app.routes.api_routes import store_detections
+    from app.utils.database import DatabaseWriter, insert_many
+
+    app.config['LOGIN_DISABLED'] = True
+    app.config['PROPAGATE_EXCEPTIONS'] = True
+
+    try:
+        with app.app_context():
+            db.create_all()
+            camera = Camera(name=f"stress-{int(time.time() * 1000)}", rtsp_url='rtsp://stress.invalid/stream')
+            db.session.add(camera)
+            db.session.commit()
+            camera_id = camera.id
+
+            # Seed enough rows that reads do real work
+            start = datetime.now() - timedelta(hours=12)
+            rows = [{
+                'camera_id': camera_id,
+                'class_name': ('person', 'car', 'dog')[i % 3],
+                'confidence': 0.8,
+                'bbox_x': 0, 'bbox_y': 0, 'bbox_width': 10, 'bbox_height': 10,
+                'timestamp': start + timedelta(seconds=i),
+                'notified': False
+            } for i in range(seed)]
+            for i in range(0, len(rows), 1000):
+                insert_many(db.session, Detection, rows[i:i + 1000])
+            db.session.commit()
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        reads = {'requests': 0, 'errors': 0, 'lock_errors': 0, 'latencies': []}
+        urls = [
+            f'/api/detections?camera_id={camera_id}&per_page=50',
+            f'/api/detections?camera_id={camera_id}&class_name=person&page=3&per_page=20',
+            '/api/detections/summary?days=1',
+            f'/api/events?camera_id={camera_id}'
+        ]
+
+        def reader(index):
+            client = app.test_client()
+            i = index
+            while not stop.is_set():
+                url = urls[i % len(urls)]
+                i += 1
+                started = time.perf_counter()
+                try:
+                    response = client.get(url)
+                    failed = response.status_code != 200
+                    error = None
+                except Exception as e:
+                    failed = True
+                    error = e
+                elapsed = time.perf_counter() - started
+                with lock:
+                    reads['requests'] += 1
+                    reads['latencies'].append(elapsed)
+                    if failed:
+                        reads['errors'] += 1
+                        if error is not None and is_lock_error(error):
+                            reads['lock_errors'] += 1
+
+        writes = {'submitted': 0, 'rows_submitted': 0, 'rows': 0, 'errors': 0, 'lock_errors': 0, 'queue_full': 0}
+        writer = DatabaseWriter.get_instance()
+        writer.start()
+        futures = []
+
+        def write_loop():
+            interval = 1.0 / write_rate if write_rate > 0 else 0
+            next_time = time.perf_counter()
+            for report in detection_reports(10 ** 9, batch):
+                if stop.is_set():
+                    break
+                try:
+                    futures.append(writer.submit(store_detections, camera_id, report, shard=camera_id))
+                    writes['submitted'] += 1
+                    writes['rows_submitted'] += len(report)
+                except Exception:
+                    # Queue stayed full for the submit timeout: the writer cannot keep up
+                    writes['queue_full'] += 1
+                if interval:
+                    next_time += interval
+                    delay = next_time - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+
+        threads = [threading.Thread(target=reader, args=(i,), daemon=True) for i in range(readers)]
+        threads.append(threading.Thread(target=write_loop, daemon=True))
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+
+        for future in futures:
+            try:
+                _, detections = future.result(timeout=60)
+                writes['rows'] += len(detections)
+            except Exception as e:
+                writes['errors'] += 1
+                if is_lock_error(e):
+                    writes['lock_errors'] += 1
+        drained = time.time() - started
+        stats = writer.get_stats()
+        writer.stop()
+        DatabaseWriter._instance = None
+
+        with app.app_context():
+            stored = Detection.query.filter_by(camera_id=camera_id).count() - seed
+            # Remove the test camera's rows from databases that outlive the test
+            Detection.query.filter_by(camera_id=camera_id).delete(synchronize_session=False)
+            Event.query.filter_by(camera_id=camera_id).delete(synchronize_session=False)
+            DetectionImage.query.filter_by(camera_id=camera_id).delete(synchronize_session=False)
+            Camera.query.filter_by(id=camera_id).delete(synchronize_session=False)
+            db.session.commit()
+            db.engine.dispose()
+
+        return {
+            'database': app.config['SQLALCHEMY_DATABASE_URI'],
+            'elapsed': elapsed,
+            'drained': drained,
+            'reads': reads,
+            'writes': writes,
+            'stored': stored,
+            'writer': stats
+        }
+
+    finally:
+        if scratch_dir:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+def check_results(results):
+    """List what went wrong in a stress run
+
+    Returns:
+        list: Problem descriptions, empty if the run passed
+    """
+    reads, writes = results['reads'], results['writes']
+    problems = []
+    if reads['lock_errors'] or writes['lock_errors']:
+        problems.append(f"{reads['lock_errors'] + writes['lock_errors']} database lock errors")
+    if reads['errors']:
+        problems.append(f"{reads['errors']} failed API requests")
+    if writes['errors']:
+        problems.append(f"{writes['errors']} failed writes")
+    if writes['rows'] != writes['rows_submitted']:
+        problems.append(f"writer returned {writes['rows']} of {writes['rows_submitted']} submitted rows")
+    if results['stored'] != writes['rows_submitted']:
+        problems.append(f"database holds {results['stored']} of {writes['rows_submitted']} submitted rows")
+    return problems
+
+def print_results(results):
+    """Print a stress run's throughput and latencies"""
+    reads, writes, stats = results['reads'], results['writes'], results['writer']
+    elapsed, drained = results['elapsed'], results['drained']
+    latencies = reads['latencies']
+    print(f"Database: {results['database']}")
+    print("\nReaders")
+    print(f"  requests:        {reads['requests']} ({reads['requests'] / elapsed:.0f}/s)")
+    print(f"  latency:         p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.1f} ms, max {max(latencies, default=0) * 1000:.1f} ms")
+    print(f"  errors:          {reads['errors']} (lock errors: {reads['lock_errors']})")
+    print("Writer")
+    print(f"  reports:         {writes['submitted']} ({writes['submitted'] / elapsed:.0f}/s), "
+          f"queue full: {writes['queue_full']}")
+    print(f"  rows stored:     {results['stored']} of {writes['rows_submitted']} ({writes['rows'] / drained:.0f}/s, "
+          f"queue drained {drained - elapsed:.1f}s after the test)")
+    print(f"  errors:          {writes['errors']} (lock errors: {writes['lock_errors']})")
+    print(f"  commits:         {stats['commits']}, jobs_per_commit: {stats['jobs_per_commit']}")
+
+def main():
+    """Run the stress test and report the results"""
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler()]
+    )
+    args = parse_args()
+    print(f"Readers: {args.readers}, write rate: {args.write_rate or 'unlimited'} reports/s "
+          f"of {args.batch} detections, seeded: {args.seed}, duration: {args.seconds}s")
+
+    results = run_stress(args.readers, args.seconds, args.write_rate, args.batch, args.seed, args.database)
+    print_results(results)
+
+    problems = check_results(results)
+    for problem in problems:
+        logger.error(problem)
+    if problems:
+        sys.exit(1)
+    print("\nNo database lock errors, every submitted detection was stored")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+"""
+Short run of the database concurrency stress test
+
+API reader threads and the pipeline writer share a scratch SQLite database;
+no request or write may fail on a database lock and every submitted
+detection has to be stored.
+"""
+from stress_database import check_results, run_stress
+
+def test_readers_and_writer_share_the_database():
+    results = run_stress(readers=8, seconds=5, write_rate=100, batch=5, seed=2000)
+
+    assert results['reads']['requests'] > 0
+    assert results['writes']['submitted'] > 0
+    assert results['reads']['lock_errors'] == 0
+    assert results['writes']['lock_errors'] == 0
+    assert results['stored'] == results['writes']['rows_submitted']
+    assert check_results(results) == []
@@ -0,0 +1,85 @@
+"""
+Read-through cache of the object store, against a moto S3 bucket
+
+A failed download must not leave its fetch lock behind, and concurrent
+requests for the same evicted segment must share one download.
+"""
+import threading
+
+import pytest
+
+moto = pytest.importorskip('moto')
+boto3 = pytest.importorskip('boto3')
+
+BUCKET = 'smartnvr-test'
+
+@pytest.fixture
+def store(tmp_path):
+    # Imported here so the app reads DATABASE_URI only when a test needs it
+    from app.utils.object_store import ObjectStore
+
+    with moto.mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET)
+        yield ObjectStore(BUCKET, access_key='testing', secret_key='testing',
+                          cache_folder=str(tmp_path / 'cache'))
+
+def count_downloads(store):
+    """Count the downloads store.fetch starts"""
+    downloads = []
+    download_file = store.client.download_file
+
+    def counting_download(*args, **kwargs):
+        downloads.append(args[1])
+        return download_file(*args, **kwargs)
+
+    store.client.download_file = counting_download
+    return downloads
+
+def test_failed_fetch_releases_its_lock(store):
+    with pytest.raises(Exception):
+        store.fetch('recordings/1/missing.mp4')
+    assert store.fetch_locks == {}
+
+    store.client.put_object(Bucket=BUCKET, Key='recordings/1/missing.mp4', Body=b'segment')
+    with open(store.fetch('recordings/1/missing.mp4'), 'rb') as f:
+        assert f.read() == b'segment'
+    assert store.fetch_locks == {}
+
+def test_concurrent_fetches_download_once(store):
+    key = 'recordings/1/segment.mp4'
+    store.client.put_object(Bucket=BUCKET, Key=key, Body=b'x' * 1024 * 1024)
+    downloads = count_downloads(store)
+
+    readers = 8
+    barrier = threading.Barrier(readers)
+    paths = []
+
+    def reader():
+        barrier.wait()
+        paths.append(store.fetch(key))
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert downloads == [key]
+    assert len(paths) == readers and len(set(paths)) == 1
+    assert store.cache_misses == 1
+    assert store.cache_hits == readers - 1
+    assert store.fetch_locks == {}
+
+def test_cache_evicts_least_recently_played(store):
+    store.cache_bytes = 1500
+    for name in ('a', 'b', 'c'):
+        store.client.put_object(Bucket=BUCKET, Key=f'recordings/{name}.mp4', Body=b'x' * 600)
+
+    first = store.fetch('recordings/a.mp4')
+    second = store.fetch('recordings/b.mp4')
+    store.fetch('recordings/a.mp4')  # Played again, b is now the oldest
+    store.fetch('recordings/c.mp4')
+
+    assert store.cache_used == 1200
+    assert set(store.cache_files) == {first, store.fetch('recordings/c.mp4')}
+    assert second not in store.cache_files
@@ -10,6 +10,7 @@ import logging
 from app import app, db
 from app.models.user import User
 from app.models.ai_model import AIModel
+from app.utils.database import sqlite_file_path
 
 # Setup basic logging
 logging.basicConfig(
@@ -24,9 +25,10 @@ def main():
     try:
         # Display database URI from configuration
         logger.info(f"Database URI: {app.config['SQLALCHEMY_DATABASE_URI']}")
-        db_path = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
-        logger.info(f"Database path: {db_path}")
-        logger.info(f"Database file exists: {os.path.exists(db_path)}")
+        db_path = sqlite_file_path(app.config['SQLALCHEMY_DATABASE_URI'])
+        if db_path:
+            logger.info(f"Database path: {db_path}")
+            logger.info(f"Database file exists: {os.path.exists(db_path)}")
         
         # Attempt to access database through SQLAlchemy
         with app.app_context():